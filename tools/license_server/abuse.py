@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+import os
+import json
+import math
+import time
+import threading
+
+from conn_store import file_lock
+from snapshot import publish
+from rate_limit import SharedBuckets
+
+# Automatic, time-limited bans from failed /check patterns (ABUSE=1).
+#
+# Every failed check is counted per IP, per ASN and per key prefix in a shared
+# table of exponentially decayed counters (abuse.bin, same layout as the rate
+# limiter's ratelimit.bin): a count decays with time constant `window`, so it
+# approximates the failures seen in the last `window` seconds. The table has a
+# fixed number of slots; when an identity's probe slots are all taken the one
+# with the smallest decayed count is reused, so a flood of one-off IPs cannot
+# push out an attacker that keeps failing, and memory never grows.
+#
+# Crossing a threshold bans the IP/ASN through the server's normal ban path
+# for `ban_seconds`. Auto-bans are tracked in autobans.json and lifted when they
+# expire; a key prefix only raises an alert (there is no prefix ban). An admin
+# ban or unban of the same value drops its entry (forget), so the ban becomes
+# permanent or stays lifted. Every ban, alert, expiry and takeover is appended
+# to the audit log (one JSON object a line).
+
+
+class DecayedCounters(SharedBuckets):
+    """Shared table of decayed event counts"""
+
+    def hit(self, ident, tau, n=1.0, now=None):
+        """Add n to ident's count; returns the decayed total"""
+        now = now if now is not None else time.time()
+
+        def decayed(entry):
+            return entry[1] * math.exp(-max(0.0, now - entry[2]) / tau)
+
+        with self._locked() as mm:
+            # when the probes are full, the smallest count gives way
+            slot, tag, entry = self._probe(mm, ident, decayed)
+            v = (decayed(entry) if entry else 0.0) + n
+            self._store(mm, slot, tag, v, now)
+        return v
+
+    def reset(self, ident):
+        with self._locked() as mm:
+            slot, tag, entry = self._probe(mm, ident, lambda e: 0)
+            if entry:
+                self._store(mm, slot, tag, 0.0, 0.0)
+
+
+def _load(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class AbuseDetector:
+    """Counts failed checks and bans/alerts past the thresholds (0 disables one)"""
+
+    def __init__(self, counters, registry, audit_log, ban, unban, window=60.0, ip_fails=20,
+                 asn_fails=300, prefix_fails=100, prefix_len=8, ban_seconds=3600, allow=(), emit=None):
+        self.counters = counters
+        self.registry = registry
+        self.audit_log = audit_log
+        self.ban = ban
+        self.unban = unban
+        self.window = window
+        self.ip_fails = ip_fails
+        self.asn_fails = asn_fails
+        self.prefix_fails = prefix_fails
+        self.prefix_len = prefix_len
+        self.ban_seconds = ban_seconds
+        self.allow = frozenset(allow)
+        self.emit = emit
+        self._pid = None
+        self._lock = threading.Lock()
+        self.observed = 0
+        self.bans = 0
+        self.alerts = 0
+        self.expired = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='abuse-expire', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(min(10.0, self.ban_seconds / 4))
+            try:
+                self.expire()
+            except Exception:
+                pass
+
+    def observe(self, ip=None, asn=None, key=None, now=None):
+        """Count one failed check"""
+        self.observe_many([(ip, asn, key)], now)
+
+    def observe_many(self, fails, now=None):
+        """Count failed checks given as (ip, asn, key)"""
+        self._ensure_started()
+        now = now if now is not None else time.time()
+        for ip, asn, key in fails:
+            self.observed += 1
+            rules = []
+            if self.ip_fails and ip and ip not in self.allow:
+                rules.append(('ip', ip, self.ip_fails))
+            if self.asn_fails and asn:
+                rules.append(('asn', str(asn), self.asn_fails))
+            if self.prefix_fails and key and len(key) > self.prefix_len:
+                rules.append(('prefix', key[:self.prefix_len], self.prefix_fails))
+            for typ, value, limit in rules:
+                ident = '%s:%s' % (typ, value)
+                count = self.counters.hit(ident, self.window, now=now)
+                if count >= limit:
+                    # start over, so in-flight requests do not trigger again
+                    self.counters.reset(ident)
+                    self._trigger(typ, value, count, limit, now)
+
+    def _trigger(self, typ, value, count, limit, now):
+        rec = {'time': int(now), 'type': typ, 'value': value, 'count': round(count, 1),
+               'threshold': limit, 'window': self.window}
+        if typ == 'prefix':
+            self.alerts += 1
+            self._audit(dict(rec, action='alert'))
+            if self.emit:
+                self.emit([dict(rec, type='abuse_alert', kind=typ)])
+            return
+        until = int(now + self.ban_seconds)
+        reason = 'auto: %d failed checks in ~%ds' % (count, self.window)
+        with file_lock(self.registry):
+            if not self.ban(typ, value, reason):
+                return  # already banned (by hand or by another worker)
+            bans = _load(self.registry, {})
+            bans['%s:%s' % (typ, value)] = {'type': typ, 'value': value, 'since': int(now), 'until': until,
+                                            'count': rec['count']}
+            publish(self.registry, bans)
+        self.bans += 1
+        self._audit(dict(rec, action='ban', until=until))
+        if self.emit:
+            self.emit([{'type': 'auto_ban', 'ban_type': typ, 'value': value, 'until': until,
+                        'count': rec['count']}])
+
+    def expire(self, now=None):
+        """Lift auto-bans whose time is up; returns how many"""
+        now = now if now is not None else time.time()
+        with file_lock(self.registry):
+            bans = _load(self.registry, {})
+            due = [k for k, b in bans.items() if b['until'] <= now]
+            if not due:
+                return 0
+            for k in due:
+                b = bans.pop(k)
+                # False when an admin already unbanned it
+                lifted = self.unban(b['type'], b['value'])
+                self._audit({'time': int(now), 'action': 'expire', 'type': b['type'], 'value': b['value'],
+                             'lifted': bool(lifted)})
+                if lifted and self.emit:
+                    self.emit([{'type': 'auto_unban', 'ban_type': b['type'], 'value': b['value']}])
+            publish(self.registry, bans)
+        self.expired += len(due)
+        return len(due)
+
+    def forget(self, typ, value, action='forget', now=None):
+        """Drop the auto-ban entry for typ/value so expiry never lifts it (an
+        admin ban or unban took it over); True if there was one"""
+        now = now if now is not None else time.time()
+        with file_lock(self.registry):
+            bans = _load(self.registry, {})
+            if bans.pop('%s:%s' % (typ, value), None) is None:
+                return False
+            publish(self.registry, bans)
+        self._audit({'time': int(now), 'action': action, 'type': typ, 'value': value})
+        return True
+
+    def _audit(self, rec):
+        line = (json.dumps(rec, separators=(',', ':')) + '\n').encode()
+        fd = os.open(self.audit_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def active(self):
+        """Current auto-bans, soonest expiry first"""
+        return sorted(_load(self.registry, {}).values(), key=lambda b: b['until'])
+
+    def audit(self, limit=100):
+        """Last `limit` audit records, newest first"""
+        try:
+            with open(self.audit_log, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - limit * 256))
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        if size > limit * 256:
+            lines = lines[1:]  # partial first line
+        out = []
+        for line in reversed(lines[-limit:]):
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                pass
+        return out
+
+    def stats(self):
+        return {'observed': self.observed, 'bans': self.bans, 'alerts': self.alerts, 'expired': self.expired,
+                'active': len(_load(self.registry, {})), 'window': self.window, 'ip_fails': self.ip_fails,
+                'asn_fails': self.asn_fails, 'prefix_fails': self.prefix_fails, 'ban_seconds': self.ban_seconds,
+                'slots': self.counters.slots}
+
+
+def from_env(app_dir, ban, unban, emit=None):
+    """Detector configured by ABUSE_* when ABUSE=1, else None.
+
+    ban(type, value, reason) and unban(type, value) return True when they
+    changed the bans store.
+    """
+    if os.environ.get('ABUSE', '0') != '1':
+        return None
+    counters = DecayedCounters(os.environ.get('ABUSE_FILE', os.path.join(app_dir, 'abuse.bin')),
+                               slots=int(os.environ.get('ABUSE_SLOTS', 65536)))
+    allow = [ip.strip() for ip in os.environ.get('ABUSE_ALLOW', '127.0.0.1,::1').split(',') if ip.strip()]
+    return AbuseDetector(
+        counters,
+        os.environ.get('ABUSE_REGISTRY', os.path.join(app_dir, 'autobans.json')),
+        os.environ.get('ABUSE_LOG', os.path.join(app_dir, 'abuse_audit.log')),
+        ban, unban,
+        window=float(os.environ.get('ABUSE_WINDOW', 60)),
+        ip_fails=float(os.environ.get('ABUSE_IP_FAILS', 20)),
+        asn_fails=float(os.environ.get('ABUSE_ASN_FAILS', 300)),
+        prefix_fails=float(os.environ.get('ABUSE_PREFIX_FAILS', 100)),
+        prefix_len=int(os.environ.get('ABUSE_PREFIX_LEN', 8)),
+        ban_seconds=int(os.environ.get('ABUSE_BAN_SECONDS', 3600)),
+        allow=allow,
+        emit=emit,
+    )
@@ -2,21 +2,27 @@
 import requests
 import json
 import sys
+import time
+from collections import deque
 from tabulate import tabulate
 from datetime import datetime
 
 BASE_URL = "http://localhost:5000"
 ADMIN_TOKEN = "your_admin_token_here"
+SESSION_TTL = 3600  # same as the server's; older sessions drop out of `watch`
 
-def api_call(endpoint, method="GET", data=None):
+# one keep-alive connection for every command
+session = requests.Session()
+session.headers.update({"X-Admin-Token": ADMIN_TOKEN, "Content-Type": "application/json"})
+
+def api_call(endpoint, method="GET", data=None, params=None):
     """Make API call to license server"""
     url = f"{BASE_URL}{endpoint}"
-    headers = {"X-Admin-Token": ADMIN_TOKEN, "Content-Type": "application/json"}
     try:
         if method == "GET":
-            resp = requests.get(url, headers=headers, timeout=5)
+            resp = session.get(url, params=params, timeout=5)
         else:
-            resp = requests.post(url, headers=headers, json=data, timeout=5)
+            resp = session.post(url, json=data, timeout=5)
         return resp.json()
     except Exception as e:
         return {"error": str(e)}
@@ -29,6 +35,29 @@ def format_time(iso_time):
     except:
         return iso_time
 
+def connection_rows(conns):
+    return [[
+        c.get('ip'),
+        c.get('asn', 'N/A'),
+        (c.get('org') or 'N/A')[:30],
+        c.get('device_name', 'Unknown'),
+        (c.get('key') or 'N/A')[:20],
+        format_time(c.get('timestamp', ''))
+    ] for c in conns]
+
+CONNECTION_HEADERS = ["IP", "ASN", "Organization", "Device", "Key", "Connected"]
+
+def failed_rows(failed):
+    return [[
+        f.get('ip'),
+        f.get('asn', 'N/A'),
+        (f.get('key') or 'N/A')[:20],
+        f.get('device_name', 'Unknown'),
+        format_time(f.get('timestamp', ''))
+    ] for f in failed]
+
+FAILED_HEADERS = ["IP", "ASN", "Key", "Device", "Timestamp"]
+
 def cmd_connections():
     """Show active connections"""
     result = api_call("/admin/connections")
@@ -41,25 +70,13 @@ def cmd_connections():
         print("No active connections")
         return
     
-    table_data = []
-    for c in conns:
-        table_data.append([
-            c.get('ip'),
-            c.get('asn', 'N/A'),
-            c.get('org', 'N/A')[:30],
-            c.get('device_name', 'Unknown'),
-            c.get('key', 'N/A')[:20],
-            format_time(c.get('timestamp', ''))
-        ])
-    
-    headers = ["IP", "ASN", "Organization", "Device", "Key", "Connected"]
     print("\n=== ACTIVE CONNECTIONS ===")
-    print(tabulate(table_data, headers=headers, tablefmt="grid"))
+    print(tabulate(connection_rows(conns), headers=CONNECTION_HEADERS, tablefmt="grid"))
     print(f"\nTotal: {len(conns)} active connection(s)")
 
 def cmd_failed_logins():
     """Show failed login attempts"""
-    result = api_call("/admin/failed-logins")
+    result = api_call("/admin/failed-logins", params={"limit": 20})
     if "error" in result:
         print(f"Error: {result['error']}")
         return
@@ -69,20 +86,158 @@ def cmd_failed_logins():
         print("No failed logins")
         return
     
-    table_data = []
-    for f in failed[-20:]:  # Show last 20
-        table_data.append([
-            f.get('ip'),
-            f.get('asn', 'N/A'),
-            f.get('key', 'N/A')[:20],
-            f.get('device_name', 'Unknown'),
-            format_time(f.get('timestamp', ''))
-        ])
-    
-    headers = ["IP", "ASN", "Key", "Device", "Timestamp"]
     print("\n=== FAILED LOGIN ATTEMPTS (Last 20) ===")
-    print(tabulate(table_data, headers=headers, tablefmt="grid"))
-    print(f"\nTotal failed attempts: {len(failed)}")
+    print(tabulate(failed_rows(failed), headers=FAILED_HEADERS, tablefmt="grid"))
+
+def cmd_watch(interval=2.0):
+    """Live view of connections and failed logins, refreshed every `interval` seconds.
+
+    After the first poll only changes are fetched: sessions seen since the
+    previous reply's `now`, failed logins after the previous reply's `next`.
+    """
+    conns = {}
+    failed = deque(maxlen=20)
+    since = None
+    cursor = None
+    status = ""
+    try:
+        while True:
+            result = api_call("/admin/connections", params={"since": since} if since else None)
+            if "error" in result or result.get('result') != 'ok':
+                status = f"connections: {result.get('error') or result.get('result')}"
+            else:
+                for c in result.get('connections', []):
+                    conns[c.get('key')] = c
+                since = result.get('now', since)
+                if since:
+                    for k in [k for k, c in conns.items() if c.get('last_seen', 0) < since - SESSION_TTL]:
+                        del conns[k]
+                status = ""
+            params = {"limit": 20} if cursor is None else {"cursor": cursor}
+            result = api_call("/admin/failed-logins", params=params)
+            if "error" in result or result.get('result') != 'ok':
+                status = f"failed-logins: {result.get('error') or result.get('result')}"
+            else:
+                failed.extend(result.get('failed', []))
+                cursor = result.get('next') or cursor
+
+            # redraw over the previous frame
+            rows = sorted(conns.values(), key=lambda c: c.get('last_seen', 0), reverse=True)
+            sys.stdout.write("\033[H\033[J")
+            print(f"=== LIVE ({datetime.now().strftime('%H:%M:%S')}, every {interval:g}s, Ctrl-C to stop) ===")
+            if status:
+                print(f"Error: {status}")
+            print(f"\n=== ACTIVE CONNECTIONS ({len(rows)}) ===")
+            print(tabulate(connection_rows(rows), headers=CONNECTION_HEADERS, tablefmt="grid"))
+            print("\n=== FAILED LOGIN ATTEMPTS (Last 20) ===")
+            print(tabulate(failed_rows(failed), headers=FAILED_HEADERS, tablefmt="grid"))
+            sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+def format_event(ev):
+    """One line for a /admin/events event"""
+    t = datetime.fromtimestamp(ev.get('time', 0)).strftime("%H:%M:%S")
+    kind = ev.get('type')
+    if kind == 'check':
+        return f"{t}  check      {ev.get('result', ''):<8} {(ev.get('key') or '')[:20]:<20} {ev.get('ip')} {ev.get('asn') or ''} {ev.get('device') or ''}"
+    if kind == 'heartbeat':
+        return f"{t}  heartbeat           {(ev.get('key') or '')[:20]:<20} {ev.get('ip')} {ev.get('asn') or ''}"
+    if kind in ('ban', 'unban'):
+        return f"{t}  {kind:<10} {ev.get('ban_type')} {ev.get('value')} {ev.get('reason') or ''}"
+    if kind in ('key_added', 'key_removed'):
+        return f"{t}  {kind:<10} {ev.get('key')}"
+    if kind == 'auto_ban':
+        until = datetime.fromtimestamp(ev.get('until', 0)).strftime("%H:%M:%S")
+        return f"{t}  auto_ban   {ev.get('ban_type')} {ev.get('value')} ({ev.get('count')} fails, until {until})"
+    if kind == 'auto_unban':
+        return f"{t}  auto_unban {ev.get('ban_type')} {ev.get('value')}"
+    if kind == 'abuse_alert':
+        return f"{t}  alert      {ev.get('kind')} {ev.get('value')} ({ev.get('count')} fails)"
+    return f"{t}  {kind} {json.dumps(ev)}"
+
+def cmd_events(types=()):
+    """Print events as the server pushes them (optionally only some types)"""
+    last_id = None
+    print("=== LIVE EVENTS (Ctrl-C to stop) ===")
+    try:
+        while True:
+            headers = {"Accept": "text/event-stream"}
+            if last_id:
+                headers["Last-Event-ID"] = last_id
+            try:
+                with session.get(f"{BASE_URL}/admin/events", headers=headers, stream=True,
+                                 timeout=(5, 60)) as resp:
+                    if resp.status_code != 200:
+                        print(f"Error: {resp.status_code} {resp.text.strip()}")
+                        return
+                    event, data = None, []
+                    for line in resp.iter_lines(decode_unicode=True):
+                        if line is None:
+                            continue
+                        if line.startswith("id:"):
+                            last_id = line[3:].strip()
+                        elif line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data.append(line[5:].strip())
+                        elif line == "" and data:
+                            payload = json.loads("\n".join(data))
+                            if event == "dropped":
+                                print(f"... {payload.get('count')} event(s) dropped (client too slow)")
+                            elif not types or event in types:
+                                print(format_event(payload))
+                            event, data = None, []
+            except requests.RequestException as e:
+                # reconnect and resume after the last event seen
+                print(f"(reconnecting: {e})")
+                time.sleep(2)
+    except KeyboardInterrupt:
+        print()
+
+def cmd_stats(window="1h", group_by="ip", only="failed", limit=10):
+    """Top IPs/ASNs/keys from the server's per-minute rollups"""
+    params = {"window": window, "group_by": group_by, "limit": limit}
+    if only != "all":
+        params["filter"] = only
+    result = api_call("/admin/stats", params=params)
+    if "error" in result or result.get("result") != "ok":
+        print(f"Error: {result.get('error') or result.get('message') or result}")
+        return
+
+    label = "all" if only == "all" else only
+    print(f"\n=== TOP {group_by.upper()} ({label}, last {window}) ===")
+    rows = [[i, t['value'], t['count'], f"{100.0 * t['count'] / result['total']:.1f}%"]
+            for i, t in enumerate(result['top'], 1)]
+    if rows:
+        print(tabulate(rows, headers=["#", group_by.upper(), "Count", "Share"], tablefmt="grid"))
+    else:
+        print("No attempts in this window")
+    print(f"\nTotal: {result['total']} attempt(s), {result['distinct']} distinct")
+    if result.get('other'):
+        print(f"({result['other']} more in small per-minute tails)")
+
+def cmd_abuse():
+    """Show automatic bans and the latest detector decisions"""
+    result = api_call("/admin/abuse", params={"limit": 20})
+    if "error" in result or result.get("result") != "ok":
+        print(f"Error: {result.get('error') or result.get('message') or result}")
+        return
+
+    active = result.get('active', [])
+    print(f"\n=== AUTOMATIC BANS ({len(active)}) ===")
+    if active:
+        rows = [[b['type'], b['value'], b.get('count'),
+                 datetime.fromtimestamp(b['since']).strftime("%H:%M:%S"),
+                 datetime.fromtimestamp(b['until']).strftime("%Y-%m-%d %H:%M:%S")] for b in active]
+        print(tabulate(rows, headers=["Type", "Value", "Fails", "Since", "Until"], tablefmt="grid"))
+    audit = result.get('audit', [])
+    if audit:
+        print("\n=== RECENT DECISIONS ===")
+        rows = [[datetime.fromtimestamp(a['time']).strftime("%Y-%m-%d %H:%M:%S"), a['action'],
+                 a['type'], a['value'], a.get('count', '')] for a in audit]
+        print(tabulate(rows, headers=["Time", "Action", "Type", "Value", "Fails"], tablefmt="grid"))
 
 def cmd_bans():
     """List all bans"""
@@ -184,6 +339,16 @@ def print_help():
 Commands:
   connections              - Show active connections
   failed-logins           - Show failed login attempts
+  watch [seconds]         - Live connections + failed logins (Ctrl-C stops)
+  events [type ...]       - Stream events as they happen (check, heartbeat,
+                            ban, unban, key_added, key_removed, auto_ban,
+                            auto_unban, abuse_alert)
+  stats [window] [by] [filter]
+                          - Top IPs/ASNs/keys from per-minute rollups
+                            window: 15m, 1h, 1d (default 1h)
+                            by: ip, asn, key, result (default ip)
+                            filter: failed, wrong, banned, success, all
+  abuse                   - Automatic bans and recent detector decisions
   bans                    - List all bans
   ban <type> <value>      - Ban IP/ASN/key (type: ip, asn, key)
                             Example: ban ip 192.168.1.100
@@ -201,6 +366,7 @@ Examples:
   unban ip 192.168.1.100
   connections
   failed-logins
+  stats 1h asn failed
 """)
 
 def main():
@@ -225,6 +391,14 @@ def main():
                 cmd_connections()
             elif command == "failed-logins":
                 cmd_failed_logins()
+            elif command == "events":
+                cmd_events(parts[1:])
+            elif command == "watch":
+                cmd_watch(float(parts[1]) if len(parts) > 1 else 2.0)
+            elif command == "stats":
+                cmd_stats(*parts[1:4])
+            elif command == "abuse":
+                cmd_abuse()
             elif command == "bans":
                 cmd_bans()
             elif command == "ban":
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import os
+import time
+import sqlite3
+import threading
+
+# ip -> (asn, org, isp) cache shared by all gunicorn workers through one
+# SQLite file. Entries expire after a TTL (shorter for failed lookups) and the
+# least recently used rows are evicted once the table exceeds max_entries.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS asn_cache (
+    ip TEXT PRIMARY KEY,
+    asn TEXT,
+    org TEXT,
+    isp TEXT,
+    negative INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS asn_cache_last_used ON asn_cache(last_used);
+CREATE TABLE IF NOT EXISTS asn_cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+COUNTERS = ('hits', 'misses', 'negative_hits', 'evictions', 'expired', 'fetches', 'fetch_failures')
+
+# don't rewrite last_used on every hit, only when it is this stale
+TOUCH_INTERVAL = 60
+COUNTER_FLUSH_INTERVAL = 10
+# COUNT(*) is a table scan, so the size limit is checked every N inserts
+EVICT_CHECK_EVERY = 64
+
+
+class AsnCache:
+    """Bounded TTL/LRU cache of ASN lookups in a shared SQLite file"""
+
+    def __init__(self, path, ttl=3600, negative_ttl=120, max_entries=100000):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(COUNTERS, 0)
+        self._flushed_at = time.time()
+        self._inserts = 0
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        # connections must not cross a fork (gunicorn --preload)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._pending[name] += n
+
+    def _flush_counters(self, db, force=False):
+        now = time.time()
+        if not force and now - self._flushed_at < COUNTER_FLUSH_INTERVAL:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, dict.fromkeys(COUNTERS, 0)
+            self._flushed_at = now
+        db.executemany(
+            'INSERT INTO asn_cache_stats(name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            [(k, v) for k, v in pending.items() if v])
+
+    def get_or_fetch(self, ip, fetch):
+        """Return cached (asn, org, isp) for ip, calling fetch(ip) on a miss.
+
+        fetch returns a tuple, or None when the lookup failed; failures are
+        cached for negative_ttl seconds and returned as None.
+        """
+        if not self.ttl:
+            return fetch(ip)
+        db = self._db()
+        now = time.time()
+        try:
+            row = db.execute(
+                'SELECT asn, org, isp, negative, expires, last_used FROM asn_cache WHERE ip = ?',
+                (ip,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is not None:
+            asn, org, isp, negative, expires, last_used = row
+            if expires > now:
+                if now - last_used > TOUCH_INTERVAL:
+                    self._try(db.execute, 'UPDATE asn_cache SET last_used = ? WHERE ip = ?', (now, ip))
+                self._count('negative_hits' if negative else 'hits')
+                self._try(self._flush_counters, db)
+                return None if negative else (asn, org, isp)
+            self._count('expired')
+        self._count('misses')
+        self._count('fetches')
+        value = fetch(ip)
+        if value is None:
+            self._count('fetch_failures')
+        self._try(self._store, db, ip, value, now)
+        return value
+
+    def _try(self, fn, *args):
+        # the cache is an optimization; a locked or broken file must not fail requests
+        try:
+            fn(*args)
+        except sqlite3.Error:
+            pass
+
+    def _store(self, db, ip, value, now):
+        negative = value is None
+        asn, org, isp = value if value is not None else (None, None, None)
+        ttl = self.negative_ttl if negative else self.ttl
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'INSERT OR REPLACE INTO asn_cache(ip, asn, org, isp, negative, expires, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (ip, asn, org, isp, int(negative), now + ttl, now))
+            self._evict(db, now)
+            self._flush_counters(db)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+
+    def _evict(self, db, now):
+        self._inserts += 1
+        if self._inserts % EVICT_CHECK_EVERY:
+            return
+        (count,) = db.execute('SELECT COUNT(*) FROM asn_cache').fetchone()
+        if count <= self.max_entries:
+            return
+        # drop expired rows first, then the least recently used ones;
+        # trim 5% below the limit so eviction doesn't run on every insert
+        cur = db.execute('DELETE FROM asn_cache WHERE expires <= ?', (now,))
+        removed = cur.rowcount
+        excess = count - removed - int(self.max_entries * 0.95)
+        if excess > 0:
+            cur = db.execute(
+                'DELETE FROM asn_cache WHERE ip IN '
+                '(SELECT ip FROM asn_cache ORDER BY last_used LIMIT ?)', (excess,))
+            removed += cur.rowcount
+        self._count('evictions', removed)
+
+    def stats(self):
+        db = self._db()
+        out = dict.fromkeys(COUNTERS, 0)
+        try:
+            self._flush_counters(db, force=True)
+            out.update(db.execute('SELECT name, value FROM asn_cache_stats').fetchall())
+            (out['entries'],) = db.execute('SELECT COUNT(*) FROM asn_cache').fetchone()
+        except sqlite3.Error as e:
+            out['error'] = str(e)
+        out.update(ttl=self.ttl, negative_ttl=self.negative_ttl, max_entries=self.max_entries)
+        return out
+
+
+def from_env(app_dir):
+    """Cache configured by ASN_CACHE_* environment variables (ASN_CACHE_TTL=0 disables)"""
+    return AsnCache(
+        os.environ.get('ASN_CACHE_DB', os.path.join(app_dir, 'asn_cache.sqlite3')),
+        ttl=int(os.environ.get('ASN_CACHE_TTL', 3600)),
+        negative_ttl=int(os.environ.get('ASN_CACHE_NEGATIVE_TTL', 120)),
+        max_entries=int(os.environ.get('ASN_CACHE_MAX', 100000)),
+    )
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+import os
+import re
+import json
+import gzip
+import time
+import bisect
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not POSIX; single-process use only
+    fcntl = None
+
+# Segmented, rotating JSON-lines log for /check attempts.
+#
+# Layout of the log directory:
+#   seg-<created>-<n>.log[.gz]  one segment, gzip'd once closed (optional)
+#   seg-<created>-<n>.idx       sparse index: "<time> <byte offset>" lines
+#   current                     symlink to the segment being appended to
+#   .lock                       flock: writers share it, rotation is exclusive
+#
+# Each writer records an index line for every record that covers a multiple of
+# index_stride bytes, so a reader can seek close to a timestamp and return one
+# page without parsing older data. Offsets are into the uncompressed stream.
+
+SEGMENT_RE = re.compile(r'^(seg-(\d+)-(\d+))\.log(\.gz)?$')
+
+
+class Segment:
+    def __init__(self, dirpath, name, created, compressed):
+        self.name = name
+        self.created = created
+        self.compressed = compressed
+        self.path = os.path.join(dirpath, name + ('.log.gz' if compressed else '.log'))
+        self.idx_path = os.path.join(dirpath, name + '.idx')
+
+    def index(self):
+        """Sorted [(offset, time)] entries"""
+        entries = []
+        try:
+            with open(self.idx_path, 'r') as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        entries.append((int(parts[1]), int(parts[0])))
+        except (OSError, ValueError):
+            pass
+        entries.sort()
+        return entries
+
+    def first_time(self):
+        """Time of the segment's first record (its offset-0 index entry)"""
+        try:
+            with open(self.idx_path, 'r') as f:
+                return int(f.readline().split()[0])
+        except (OSError, ValueError, IndexError):
+            return self.created
+
+    def seek_offset(self, since):
+        """Byte offset of a record at or before the first one with time >= since"""
+        best = 0
+        for offset, t in self.index():
+            if t < since:
+                best = offset
+            else:
+                break
+        return best
+
+    def open(self):
+        if self.compressed:
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+
+class SegmentedLog:
+    """Append-only attempts log split into rotating, indexed segments"""
+
+    def __init__(self, dirpath, max_bytes=64 * 1024 * 1024, max_age=86400, compress=True,
+                 retention=30 * 86400, max_segments=0, index_stride=64 * 1024):
+        self.dir = dirpath
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.retention = retention
+        self.max_segments = max_segments
+        self.index_stride = index_stride
+        self._lock = threading.Lock()
+        self._fd = None
+        self._idx_fd = None
+        self._name = None
+        self._pid = None
+        self.appended = 0
+        self.rotations = 0
+        os.makedirs(self.dir, exist_ok=True)
+        self._lock_path = os.path.join(self.dir, '.lock')
+        self._current = os.path.join(self.dir, 'current')
+
+    # locking
+
+    def _flock(self, exclusive):
+        f = open(self._lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return f
+
+    def _unlock(self, f):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+    # segments
+
+    def segments(self):
+        """All segments, oldest first"""
+        found = {}
+        for fn in os.listdir(self.dir):
+            m = SEGMENT_RE.match(fn)
+            if not m:
+                continue
+            name = m.group(1)
+            # while compressing both files exist; the plain one is complete
+            if name in found and m.group(4):
+                continue
+            found[name] = Segment(self.dir, name, int(m.group(2)), bool(m.group(4)))
+        return sorted(found.values(), key=lambda s: (s.created, s.name))
+
+    def _current_name(self):
+        try:
+            return os.path.basename(os.readlink(self._current))[:-len('.log')]
+        except OSError:
+            return None
+
+    def _new_segment(self):
+        # caller holds the exclusive lock
+        now = int(time.time())
+        n = 0
+        # the .idx outlives compression of the .log, so it marks a taken name
+        while os.path.exists(os.path.join(self.dir, 'seg-%010d-%04d.idx' % (now, n))):
+            n += 1
+        name = 'seg-%010d-%04d' % (now, n)
+        open(os.path.join(self.dir, name + '.idx'), 'ab').close()
+        open(os.path.join(self.dir, name + '.log'), 'ab').close()
+        tmp = self._current + '.tmp'
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        os.symlink(name + '.log', tmp)
+        os.replace(tmp, self._current)
+        return name
+
+    def _close_fds(self):
+        for fd in (self._fd, self._idx_fd):
+            if fd is not None:
+                os.close(fd)
+        self._fd = self._idx_fd = self._name = None
+
+    def _init_current(self):
+        # must not be called while holding the shared lock (flock can't upgrade)
+        lk = self._flock(True)
+        try:
+            if self._current_name() is None:
+                self._new_segment()
+        finally:
+            self._unlock(lk)
+
+    def _open_current(self):
+        # the symlink is only ever replaced, never removed, once it exists
+        name = self._current_name()
+        if name != self._name or self._pid != os.getpid():
+            if self._pid == os.getpid():
+                self._close_fds()
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            self._fd = os.open(os.path.join(self.dir, name + '.log'), flags, 0o644)
+            self._idx_fd = os.open(os.path.join(self.dir, name + '.idx'), flags, 0o644)
+            self._name = name
+            self._pid = os.getpid()
+        return name
+
+    def append(self, rec):
+        """Append one record (a dict with an integer 'time' field)"""
+        self.append_many([rec])
+
+    def append_many(self, recs):
+        """Append records with a single write (they stay contiguous in the segment)"""
+        if not recs:
+            return
+        lines = [(json.dumps(r, separators=(',', ':')) + '\n').encode() for r in recs]
+        times = [int(r.get('time') or time.time()) for r in recs]
+        data = b''.join(lines)
+        with self._lock:
+            if self._current_name() is None:
+                self._init_current()
+            lk = self._flock(False)
+            try:
+                name = self._open_current()
+                os.write(self._fd, data)
+                end = os.lseek(self._fd, 0, os.SEEK_CUR)
+                start = end - len(data)
+                # index each record that covers the next stride boundary
+                idx = []
+                for line, t in zip(lines, times):
+                    boundary = -(-start // self.index_stride) * self.index_stride
+                    if boundary < start + len(line):
+                        idx.append('%d %d\n' % (t, start))
+                    start += len(line)
+                if idx:
+                    os.write(self._idx_fd, ''.join(idx).encode())
+            finally:
+                self._unlock(lk)
+            self.appended += len(recs)
+            t = times[-1]
+            created = int(name.split('-')[1])
+            if end >= self.max_bytes or (self.max_age and t - created >= self.max_age):
+                self._rotate(name)
+
+    def _rotate(self, name):
+        lk = self._flock(True)
+        try:
+            if self._current_name() != name:
+                return  # another worker rotated first
+            self._new_segment()
+            self.rotations += 1
+        finally:
+            self._unlock(lk)
+        self._close_fds()
+        threading.Thread(target=self._maintain, name='attempts-log-maintain', daemon=True).start()
+
+    def _maintain(self):
+        """Compress closed segments and apply retention"""
+        current = self._current_name()
+        segs = self.segments()
+        if self.compress:
+            for seg in segs:
+                if seg.name == current or seg.compressed:
+                    continue
+                gz = seg.path + '.gz'
+                try:
+                    if not os.path.exists(gz):
+                        # another worker may be compressing the same segment;
+                        # each writes its own temp file and the renames are atomic
+                        tmp = '%s.tmp.%d.%d' % (gz, os.getpid(), threading.get_ident())
+                        try:
+                            with open(seg.path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+                                shutil.copyfileobj(src, dst)
+                            os.replace(tmp, gz)
+                        finally:
+                            if os.path.exists(tmp):
+                                os.remove(tmp)
+                    # the .gz is complete once it exists
+                    os.remove(seg.path)
+                except OSError:
+                    pass
+            segs = self.segments()
+        closed = [s for s in segs if s.name != current]
+        now = time.time()
+        drop = []
+        for i, seg in enumerate(closed):
+            # a closed segment ends where the next one starts
+            end = closed[i + 1].created if i + 1 < len(closed) else now
+            if self.retention and now - end > self.retention:
+                drop.append(seg)
+        if self.max_segments and len(segs) > self.max_segments:
+            drop.extend(closed[:len(segs) - self.max_segments])
+        for seg in drop:
+            for p in (seg.path, seg.idx_path):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def import_legacy(self, path):
+        """Move a pre-rotation attempts.log into the directory as a closed, indexed segment"""
+        if not os.path.exists(path):
+            return False
+        lk = self._flock(True)
+        try:
+            if not os.path.exists(path):
+                return False
+            first = None
+            entries = []
+            offset = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        t = int(json.loads(line).get('time', 0))
+                    except (ValueError, AttributeError):
+                        t = None
+                    if t is not None:
+                        if first is None:
+                            first = t
+                        end = offset + len(line)
+                        if -(-offset // self.index_stride) * self.index_stride < end:
+                            entries.append('%d %d\n' % (t, offset))
+                    offset += len(line)
+            name = 'seg-%010d-%04d' % (first or 0, 9999)
+            with open(os.path.join(self.dir, name + '.idx'), 'w') as f:
+                f.writelines(entries)
+            os.replace(path, os.path.join(self.dir, name + '.log'))
+        finally:
+            self._unlock(lk)
+        threading.Thread(target=self._maintain, name='attempts-log-maintain', daemon=True).start()
+        return True
+
+    def read(self, since=None, until=None, limit=1000, cursor=None):
+        """One page of records with since <= time <= until, oldest first.
+
+        Returns (records, next_cursor); pass next_cursor back to continue.
+        """
+        segs = self.segments()
+        start_offset = 0
+        if cursor:
+            name, _, off = cursor.rpartition(':')
+            names = [s.name for s in segs]
+            i = bisect.bisect_left(names, name)
+            if i < len(segs) and segs[i].name == name:
+                start_offset = int(off)
+            segs = segs[i:]
+        elif since is not None:
+            # last segment starting at or before `since` holds the first match
+            starts = [s.first_time() for s in segs]
+            i = max(0, bisect.bisect_right(starts, since) - 1)
+            segs = segs[i:]
+        out = []
+        offset = start_offset
+        for n, seg in enumerate(segs):
+            if n == 0 and cursor:
+                offset = start_offset
+            else:
+                offset = seg.seek_offset(since) if since is not None else 0
+            try:
+                f = seg.open()
+            except OSError:
+                continue
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # partial write still in progress
+                    offset += len(line)
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    t = rec.get('time', 0)
+                    if since is not None and t < since:
+                        continue
+                    if until is not None and t > until:
+                        return out, None
+                    out.append(rec)
+                    if len(out) >= limit:
+                        return out, '%s:%d' % (seg.name, offset)
+        # cursor at the end of the data, for tailing
+        if segs:
+            return out, '%s:%d' % (segs[-1].name, offset)
+        return out, None
+
+    def stats(self):
+        segs = self.segments()
+        size = 0
+        for s in segs:
+            try:
+                size += os.path.getsize(s.path)
+            except OSError:
+                pass
+        return {
+            'segments': len(segs),
+            'bytes': size,
+            'current': self._current_name(),
+            'appended': self.appended,
+            'rotations': self.rotations,
+        }
+
+
+def from_env(dirpath):
+    """Log configured by the ATTEMPTS_* environment variables"""
+    return SegmentedLog(
+        dirpath,
+        max_bytes=int(os.environ.get('ATTEMPTS_SEGMENT_BYTES', 64 * 1024 * 1024)),
+        max_age=int(os.environ.get('ATTEMPTS_SEGMENT_SECONDS', 86400)),
+        compress=os.environ.get('ATTEMPTS_COMPRESS', '1') == '1',
+        retention=int(os.environ.get('ATTEMPTS_RETENTION_DAYS', 30)) * 86400,
+        max_segments=int(os.environ.get('ATTEMPTS_MAX_SEGMENTS', 0)),
+    )
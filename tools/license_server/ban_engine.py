@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+import bisect
+import threading
+import ipaddress
+
+# Compiled ban lists: hash sets for exact values (keys, ASNs, devices, single
+# IPs) and a sorted, merged interval table per address family for CIDR blocks,
+# so a check is a few set lookups plus one binary search regardless of how
+# many bans exist. Single IPs and CIDRs are keyed by their normalized form and
+# remember the stored values behind it ('1.2.3.4' and '1.2.3.4/32' are two bans
+# of one address), so removing one keeps the address banned by the other.
+
+EXACT_TYPES = ('key', 'asn', 'device')
+
+
+def parse_ip_ban(value):
+    """ip_network for an 'ip' ban value (single address or CIDR), or None if invalid"""
+    try:
+        return ipaddress.ip_network(value.strip(), strict=False)
+    except (ValueError, AttributeError):
+        return None
+
+
+class _Ranges:
+    """Merged [start, end] integer intervals with binary-search membership"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def build(self, networks):
+        spans = sorted((int(n.network_address), int(n.broadcast_address)) for n in networks)
+        starts, ends = [], []
+        for a, b in spans:
+            if ends and a <= ends[-1] + 1:
+                if b > ends[-1]:
+                    ends[-1] = b
+            else:
+                starts.append(a)
+                ends.append(b)
+        self.starts, self.ends = starts, ends
+
+    def __contains__(self, value):
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def _forget(table, norm, value):
+    """Drop one stored value behind norm; True when norm is no longer banned"""
+    values = table.get(norm)
+    if values is None:
+        return False
+    values.discard(value)
+    if values:
+        return False
+    del table[norm]
+    return True
+
+
+class BanMatcher:
+    """In-memory ban engine built from (type, value) pairs"""
+
+    def __init__(self, bans=()):
+        self.exact = {t: set() for t in EXACT_TYPES}
+        self.ips = {}
+        self.networks = {4: {}, 6: {}}
+        self.ranges = {4: _Ranges(), 6: _Ranges()}
+        for t, v in bans:
+            self._add(t, v)
+        for family in (4, 6):
+            self.ranges[family].build(self.networks[family])
+
+    def _add(self, ban_type, value):
+        if ban_type in self.exact:
+            self.exact[ban_type].add(value)
+            return None
+        if ban_type != 'ip':
+            return None
+        net = parse_ip_ban(value)
+        if net is None:
+            return None
+        if net.num_addresses == 1:
+            self.ips.setdefault(str(net.network_address), set()).add(value.strip())
+            return None
+        new = net not in self.networks[net.version]
+        self.networks[net.version].setdefault(net, set()).add(value.strip())
+        return net.version if new else None
+
+    def add(self, ban_type, value):
+        family = self._add(ban_type, value)
+        if family:
+            self.ranges[family].build(self.networks[family])
+
+    def remove(self, ban_type, value):
+        if ban_type in self.exact:
+            self.exact[ban_type].discard(value)
+            return
+        net = parse_ip_ban(value) if ban_type == 'ip' else None
+        if net is None:
+            return
+        if net.num_addresses == 1:
+            _forget(self.ips, str(net.network_address), value.strip())
+        elif _forget(self.networks[net.version], net, value.strip()):
+            self.ranges[net.version].build(self.networks[net.version])
+
+    def match_ip(self, ip):
+        if not ip:
+            return False
+        if ip in self.ips:
+            return True
+        if not (self.ips or len(self.ranges[4]) or len(self.ranges[6])):
+            return False
+        try:
+            addr = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            return False
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        if str(addr) in self.ips:
+            return True
+        return int(addr) in self.ranges[addr.version]
+
+    def match(self, ip=None, key=None, asn=None, device=None):
+        """Ban type that matches first ('ip', 'key', 'asn', 'device'), or None"""
+        if key and key in self.exact['key']:
+            return 'key'
+        if asn and asn in self.exact['asn']:
+            return 'asn'
+        if device and device in self.exact['device']:
+            return 'device'
+        if self.match_ip(ip):
+            return 'ip'
+        return None
+
+    def has(self, ban_type):
+        if ban_type == 'ip':
+            return bool(self.ips or self.networks[4] or self.networks[6])
+        return bool(self.exact.get(ban_type))
+
+    def stats(self):
+        return {
+            'ips': len(self.ips),
+            'cidrs_v4': len(self.networks[4]),
+            'cidrs_v6': len(self.networks[6]),
+            'ranges_v4': len(self.ranges[4]),
+            'ranges_v6': len(self.ranges[6]),
+            'keys': len(self.exact['key']),
+            'asns': len(self.exact['asn']),
+            'devices': len(self.exact['device']),
+        }
+
+
+class BanIndex:
+    """BanMatcher kept current with its source.
+
+    load() returns (type, value) pairs; stamp() returns something cheap that
+    changes whenever the source changes (file stat, generation counter).
+    """
+
+    def __init__(self, load, stamp):
+        self._load = load
+        self._stamp_fn = stamp
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._loaded = False
+        self.matcher = BanMatcher()
+        self.rebuilds = 0
+        self.incremental = 0
+        self.checks = 0
+
+    def refresh(self):
+        stamp = self._stamp_fn()
+        if self._loaded and stamp == self._stamp:
+            return
+        with self._lock:
+            if self._loaded and stamp == self._stamp:
+                return
+            self.matcher = BanMatcher(self._load())
+            self._stamp = stamp
+            self._loaded = True
+            self.rebuilds += 1
+
+    def match(self, **values):
+        self.refresh()
+        self.checks += 1
+        return self.matcher.match(**values)
+
+    def has(self, ban_type):
+        self.refresh()
+        return self.matcher.has(ban_type)
+
+    def added(self, ban_type, value, stamps=None):
+        """Apply a ban this process just wrote, without a full rebuild.
+
+        stamps is (before, after) read around the write; if nothing else
+        changed the source in between, the matcher stays current.
+        """
+        with self._lock:
+            self.matcher.add(ban_type, value)
+            self._after_local_change(stamps)
+
+    def removed(self, ban_type, value, stamps=None):
+        with self._lock:
+            self.matcher.remove(ban_type, value)
+            self._after_local_change(stamps)
+
+    def _after_local_change(self, stamps):
+        self.incremental += 1
+        if stamps is not None and self._loaded and self._stamp == stamps[0]:
+            self._stamp = stamps[1]
+
+    def stats(self):
+        out = self.matcher.stats()
+        out.update(rebuilds=self.rebuilds, incremental=self.incremental, checks=self.checks)
+        return out
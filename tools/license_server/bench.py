@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Load test / benchmark harness for server.py and server_extended.py.
+
+Copies the server into a scratch directory, seeds keys, bans and attempts,
+points ASN lookups at a local stub with configurable latency, starts the
+server and drives it at each concurrency level. Results go to a JSON file.
+
+  python3 bench.py --server server --keys 100000 --bans 1000 --attempts 1000000 \\
+      --concurrency 1,8,32 --duration 10 --stub-latency 0.05
+  python3 bench.py --replay attempts.log --concurrency 16
+"""
+import os
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import socket
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ADMIN_TOKEN = 'bench-token'
+
+SCENARIOS = {
+    'server': ('check', 'check_miss', 'heartbeat', 'admin_list', 'admin_connections', 'admin_attempts'),
+    'server_extended': ('check', 'check_miss', 'admin_list', 'admin_connections', 'admin_history'),
+}
+
+
+# ASN stub
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    jitter = 0.0
+    fail_rate = 0.0
+    requests = 0
+
+    def do_GET(self):
+        StubHandler.requests += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.fail_rate:
+            self.send_response(500)
+            self.end_headers()
+            return
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        ip = parts[1] if parts and parts[0] == 'json' else (parts[0] if parts else '')
+        asn = 'AS%d' % (64512 + int(hashlib.md5(ip.encode()).hexdigest(), 16) % 1000)
+        if parts and parts[0] == 'json':  # ip-api.com
+            body = {'asn': asn + ' Bench', 'org': 'Bench Org', 'isp': 'Bench ISP'}
+        else:  # ipinfo.io
+            body = {'ip': ip, 'org': asn + ' Bench Org'}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency, jitter, fail_rate):
+    StubHandler.latency = latency
+    StubHandler.jitter = jitter
+    StubHandler.fail_rate = fail_rate
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+# datasets
+
+def bench_key(i):
+    return 'BENCH-%08d' % i
+
+def bench_ip(rng):
+    # 100.64.0.0/10, never covered by the seeded bans
+    return '100.%d.%d.%d' % (rng.randint(64, 127), rng.randint(0, 255), rng.randint(1, 254))
+
+def seed_bans(n):
+    """(type, value) pairs: single IPs, /24 blocks and ASNs in 10.0.0.0/8"""
+    bans = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            bans.append(('ip', '10.%d.%d.%d' % (i >> 16 & 255, i >> 8 & 255, i & 255 or 1)))
+        elif kind == 1:
+            bans.append(('ip', '10.%d.%d.0/24' % (128 + (i >> 8 & 127), i & 255)))
+        else:
+            bans.append(('asn', 'AS%d' % (4200000000 + i)))
+    return bans
+
+def seed(workdir, server, n_keys, n_bans, n_attempts, sqlite):
+    rng = random.Random(42)
+    keys = [bench_key(i) for i in range(n_keys)]
+    bans = seed_bans(n_bans)
+    now = int(time.time())
+    attempts = ({'time': now - n_attempts + i, 'ip': bench_ip(rng), 'key': keys[i % n_keys] if n_keys else 'X'}
+                for i in range(n_attempts))
+    if sqlite:
+        sys.path.insert(0, workdir)
+        import storage as storage_mod
+        db = storage_mod.Storage(os.path.join(workdir, 'license.db'))
+        db.add_keys(keys)
+        for typ, value in bans:
+            db.add_ban(typ, value, 'bench')
+        batch = []
+        for a in attempts:
+            batch.append(dict(a, success=True))
+            if len(batch) == 10000:
+                db.add_attempts(batch)
+                batch = []
+        db.add_attempts(batch)
+        return
+    with open(os.path.join(workdir, 'authorized_keys.json'), 'w') as f:
+        json.dump(keys, f)
+    if server == 'server':
+        fields = {'ip': 'ips', 'asn': 'asns', 'device': 'devices'}
+        data = {'ips': [], 'asns': [], 'devices': []}
+        for typ, value in bans:
+            data[fields[typ]].append(value)
+        with open(os.path.join(workdir, 'bans.json'), 'w') as f:
+            json.dump(data, f)
+        # imported as the first segment on startup
+        with open(os.path.join(workdir, 'attempts.log'), 'w') as f:
+            for a in attempts:
+                f.write(json.dumps(a) + '\n')
+    else:
+        with open(os.path.join(workdir, 'bans.json'), 'w') as f:
+            json.dump([{'type': t, 'value': v, 'reason': 'bench', 'timestamp': ''} for t, v in bans], f)
+        # imported into the partitioned history on startup
+        with open(os.path.join(workdir, 'connections.json'), 'w') as f:
+            json.dump([dict(a, device_name='bench', device_info={}, asn='N/A', org='N/A', isp='N/A',
+                            timestamp='', last_seen=a['time'], success=True) for a in attempts], f)
+
+
+# server process
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(args, workdir, port, stub_port):
+    env = dict(os.environ,
+               ADMIN_TOKEN=ADMIN_TOKEN,
+               PORT=str(port),
+               IPINFO_URL='http://127.0.0.1:%d/{ip}/json' % stub_port,
+               IP_API_URL='http://127.0.0.1:%d/json/{ip}' % stub_port,
+               ASN_REMOTE_FALLBACK='1',
+               RATE_LIMIT='1' if args.rate_limit else '0')
+    env.pop('ASN_DB', None)
+    if not args.asn_cache:
+        env['ASN_CACHE_TTL'] = '0'
+    if args.sqlite:
+        env['LICENSE_DB'] = os.path.join(workdir, 'license.db')
+    else:
+        env.pop('LICENSE_DB', None)
+    bind = '127.0.0.1:%d' % port
+    if args.mode == 'async':
+        cmd = [sys.executable, '-m', 'uvicorn', 'server_async:app', '--host', '127.0.0.1',
+               '--port', str(port), '--workers', str(args.workers), '--log-level', 'warning']
+    elif args.workers and shutil.which('gunicorn'):
+        cmd = ['gunicorn', '-w', str(args.workers), '-b', bind, '--log-level', 'warning', args.server + ':app']
+    else:
+        cmd = [sys.executable, args.server + '.py']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit('server exited during startup, see %s' % log.name)
+        try:
+            c = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            c.request('GET', '/admin/list', headers={'X-Admin-Token': ADMIN_TOKEN})
+            if c.getresponse().status == 200:
+                return proc, ' '.join(cmd)
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('server did not come up in %ds, see %s' % (args.startup_timeout, log.name))
+
+
+# load driver
+
+def make_request(scenario, rng, n_keys):
+    """(method, path, body, headers) for one request of a scenario"""
+    headers = {'X-Forwarded-For': bench_ip(rng)}
+    admin = {'X-Admin-Token': ADMIN_TOKEN}
+    if scenario == 'check':
+        return 'GET', '/check?key=' + bench_key(rng.randrange(max(1, n_keys))), None, headers
+    if scenario == 'check_miss':
+        return 'GET', '/check?key=MISS-%d' % rng.randrange(1 << 30), None, headers
+    if scenario == 'heartbeat':
+        body = json.dumps({'key': bench_key(rng.randrange(max(1, n_keys))), 'device_name': 'bench'})
+        return 'POST', '/heartbeat', body, dict(headers, **{'Content-Type': 'application/json'})
+    if scenario == 'admin_list':
+        return 'GET', '/admin/list', None, admin
+    if scenario == 'admin_connections':
+        return 'GET', '/admin/connections', None, admin
+    if scenario == 'admin_attempts':
+        return 'GET', '/admin/attempts?limit=1000', None, admin
+    if scenario == 'admin_history':
+        return 'GET', '/admin/history?limit=1000', None, admin
+    raise ValueError(scenario)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+def summarize(name, concurrency, latencies, statuses, errors, elapsed):
+    lat = sorted(latencies)
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': len(lat),
+        'errors': errors,
+        'status': {str(k): v for k, v in sorted(statuses.items())},
+        'duration': round(elapsed, 3),
+        'rps': round(len(lat) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(lat, 50)),
+            'p95': ms(percentile(lat, 95)),
+            'p99': ms(percentile(lat, 99)),
+            'mean': ms(sum(lat) / len(lat)) if lat else None,
+            'max': ms(lat[-1]) if lat else None,
+        },
+    }
+
+def drive(port, concurrency, next_request, duration=None, total=None):
+    """Run `concurrency` keep-alive clients until duration/total is reached.
+
+    next_request(rng) returns (method, path, body, headers), or None when a
+    finite source (replay) is exhausted.
+    """
+    lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    errors = [0]
+    issued = [0]
+    stop_at = time.perf_counter() + duration if duration else None
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        codes = {}
+        while True:
+            if stop_at is not None and time.perf_counter() >= stop_at:
+                break
+            if total is not None:
+                with lock:
+                    if issued[0] >= total:
+                        break
+                    issued[0] += 1
+            req = next_request(rng)
+            if req is None:
+                break
+            method, path, body, headers = req
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                mine.append(time.perf_counter() - start)
+                codes[resp.status] = codes.get(resp.status, 0) + 1
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            for k, v in codes.items():
+                statuses[k] = statuses.get(k, 0) + v
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, statuses, errors[0], time.perf_counter() - started
+
+def replay_source(path, speed):
+    """next_request() over a captured attempts.log (JSON lines with time, ip, key)"""
+    records = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get('key'):
+                records.append(rec)
+    records.sort(key=lambda r: r.get('time', 0))
+    lock = threading.Lock()
+    pos = [0]
+    t0 = records[0].get('time', 0) if records else 0
+    start = [None]
+
+    def next_request(rng):
+        with lock:
+            if pos[0] >= len(records):
+                return None
+            rec = records[pos[0]]
+            pos[0] += 1
+            if start[0] is None:
+                start[0] = time.perf_counter()
+        if speed:
+            # keep the original inter-arrival times, compressed by `speed`
+            delay = start[0] + (rec.get('time', t0) - t0) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        headers = {'X-Forwarded-For': rec.get('ip') or bench_ip(rng)}
+        return 'GET', '/check?key=' + quote(str(rec['key'])), None, headers
+
+    return next_request, len(records)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=SRC_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    p = argparse.ArgumentParser(description='License server load test')
+    p.add_argument('--server', choices=sorted(SCENARIOS), default='server')
+    p.add_argument('--mode', choices=['sync', 'async'], default='sync', help='async = server_async.py under uvicorn')
+    p.add_argument('--workers', type=int, default=3, help='gunicorn/uvicorn workers (0 = Flask dev server)')
+    p.add_argument('--sqlite', action='store_true', help='use the SQLite backend (LICENSE_DB)')
+    p.add_argument('--keys', type=int, default=1000)
+    p.add_argument('--bans', type=int, default=100)
+    p.add_argument('--attempts', type=int, default=10000)
+    p.add_argument('--concurrency', default='1,8,32', help='comma-separated client counts')
+    p.add_argument('--scenarios', help='comma-separated subset of: ' + ', '.join(sorted(set(sum(SCENARIOS.values(), ())))))
+    p.add_argument('--duration', type=float, default=10.0, help='seconds per scenario and concurrency')
+    p.add_argument('--requests', type=int, help='fixed request count instead of --duration')
+    p.add_argument('--stub-latency', type=float, default=0.05, help='ASN stub response time (s)')
+    p.add_argument('--stub-jitter', type=float, default=0.0)
+    p.add_argument('--stub-fail-rate', type=float, default=0.0)
+    p.add_argument('--no-asn-cache', dest='asn_cache', action='store_false', help='every lookup hits the stub')
+    p.add_argument('--rate-limit', action='store_true', help='keep the rate limiter on (off by default)')
+    p.add_argument('--replay', help='replay a captured attempts.log as /check traffic')
+    p.add_argument('--replay-speed', type=float, default=0.0, help='time compression (0 = as fast as possible)')
+    p.add_argument('--startup-timeout', type=int, default=120)
+    p.add_argument('--keep', action='store_true', help='keep the scratch directory')
+    p.add_argument('--out', help='results file (default bench_results/<server>-<time>.json)')
+    args = p.parse_args()
+    if args.mode == 'async' and args.server != 'server':
+        p.error('--mode async is only available for server')
+
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+    scenarios = args.scenarios.split(',') if args.scenarios else list(SCENARIOS[args.server])
+
+    workdir = tempfile.mkdtemp(prefix='license-bench-')
+    for path in glob.glob(os.path.join(SRC_DIR, '*.py')):
+        shutil.copy(path, workdir)
+    print('seeding %d keys, %d bans, %d attempts in %s' % (args.keys, args.bans, args.attempts, workdir))
+    t = time.time()
+    seed(workdir, args.server, args.keys, args.bans, args.attempts, args.sqlite)
+    seed_seconds = time.time() - t
+
+    stub = start_stub(args.stub_latency, args.stub_jitter, args.stub_fail_rate)
+    port = free_port()
+    t = time.time()
+    proc, cmd = start_server(args, workdir, port, stub.server_address[1])
+    startup_seconds = time.time() - t
+    print('server up in %.1fs: %s' % (startup_seconds, cmd))
+
+    results = []
+    try:
+        if args.replay:
+            for c in levels:
+                source, n = replay_source(args.replay, args.replay_speed)
+                lat, st, err, el = drive(port, c, source)
+                results.append(summarize('replay', c, lat, st, err, el))
+                print(json.dumps(results[-1]))
+        else:
+            for name in scenarios:
+                for c in levels:
+                    lat, st, err, el = drive(port, c, lambda rng: make_request(name, rng, args.keys),
+                                             duration=None if args.requests else args.duration,
+                                             total=args.requests)
+                    results.append(summarize(name, c, lat, st, err, el))
+                    print(json.dumps(results[-1]))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        stub.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'time': int(time.time()),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'command': cmd,
+            'seed_seconds': round(seed_seconds, 2),
+            'startup_seconds': round(startup_seconds, 2),
+            'stub_requests': StubHandler.requests,
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    out = args.out or os.path.join('bench_results', '%s-%s.json' % (args.server, time.strftime('%Y%m%d-%H%M%S')))
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % out)
+
+if __name__ == '__main__':
+    main()
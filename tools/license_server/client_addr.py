@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import os
+import ipaddress
+
+# Client address behind a reverse proxy.
+#
+# X-Forwarded-For is sent by the client and can hold anything; only the hops
+# appended by our own proxies can be believed. nginx ($proxy_add_x_forwarded_for)
+# appends the address it saw, so walking the header from the right, the first
+# hop that is not a trusted proxy is the client. A request that does not come
+# from a trusted proxy is answered by its peer address and the header is
+# ignored. TRUSTED_PROXIES lists addresses or CIDRs (default: loopback, where
+# setup_deploy.sh puts nginx); empty trusts nobody.
+
+
+def _parse(value):
+    try:
+        addr = ipaddress.ip_address(value.strip())
+    except (ValueError, AttributeError):
+        return None
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    return addr
+
+
+class TrustedProxies:
+    """Resolves the client address from the peer and X-Forwarded-For"""
+
+    def __init__(self, proxies=()):
+        self.networks = [ipaddress.ip_network(p.strip(), strict=False) for p in proxies if p.strip()]
+
+    def trusted(self, value):
+        addr = _parse(value)
+        return addr is not None and any(addr in net for net in self.networks)
+
+    def client_ip(self, remote_addr, forwarded=None):
+        if not forwarded or not self.trusted(remote_addr):
+            return remote_addr
+        hops = [h.strip() for h in forwarded.split(',') if h.strip()]
+        for hop in reversed(hops):
+            if not self.trusted(hop):
+                return hop
+        # every hop is one of ours: the leftmost is as close to the client as it gets
+        return hops[0] if hops else remote_addr
+
+
+def from_env():
+    """TrustedProxies from TRUSTED_PROXIES (comma separated addresses/CIDRs)"""
+    return TrustedProxies(os.environ.get('TRUSTED_PROXIES', '127.0.0.1,::1').split(','))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+
+from conn_store import file_lock
+
+# Bounded connection history for server_extended.py: records are appended to
+# hourly JSON-lines partitions and only the newest `retention` partitions are
+# kept, so writing costs O(batch) and disk use is capped by time.
+
+
+class PartitionedHistory:
+    """Append-only history split into time partitions with count-based retention"""
+
+    def __init__(self, dirpath, prefix, partition_seconds=3600, retention=72, time_field='last_seen'):
+        self.dir = dirpath
+        self.prefix = prefix
+        self.partition_seconds = partition_seconds
+        self.retention = retention
+        self.time_field = time_field
+        self._last_partition = None
+        self.appended = 0
+        self.dropped_partitions = 0
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _partition_path(self, t):
+        start = int(t) // self.partition_seconds * self.partition_seconds
+        return os.path.join(self.dir, '%s-%010d.jsonl' % (self.prefix, start))
+
+    def partitions(self):
+        """Partition file paths, oldest first"""
+        names = [fn for fn in os.listdir(self.dir)
+                 if fn.startswith(self.prefix + '-') and fn.endswith('.jsonl')]
+        return [os.path.join(self.dir, fn) for fn in sorted(names)]
+
+    def append(self, records, now=None):
+        if not records:
+            return
+        path = self._partition_path(now if now is not None else time.time())
+        data = ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records)
+        with file_lock(os.path.join(self.dir, self.prefix)):
+            with open(path, 'a') as f:
+                f.write(data)
+            if path != self._last_partition:
+                self._last_partition = path
+                self._expire()
+        self.appended += len(records)
+
+    def _expire(self):
+        parts = self.partitions()
+        for p in parts[:max(0, len(parts) - self.retention)]:
+            try:
+                os.remove(p)
+                self.dropped_partitions += 1
+            except OSError:
+                pass
+
+    def read(self, limit=1000, since=None):
+        """Newest `limit` records (oldest first), optionally only those at or after `since`"""
+        out = []
+        for path in reversed(self.partitions()):
+            start = int(os.path.basename(path)[len(self.prefix) + 1:-len('.jsonl')])
+            if since is not None and start + self.partition_seconds <= since:
+                break
+            recs = []
+            try:
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            rec = json.loads(line)
+                        except ValueError:
+                            continue
+                        if since is None or rec.get(self.time_field, 0) >= since:
+                            recs.append(rec)
+            except OSError:
+                continue
+            out[:0] = recs
+            if len(out) >= limit:
+                break
+        return out[-limit:] if limit else out
+
+    def _start(self, path):
+        return int(os.path.basename(path)[len(self.prefix) + 1:-len('.jsonl')])
+
+    def _lines(self, path, offset=0):
+        """(record, end offset) for each complete line from offset on"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # still being appended
+                        return
+                    offset += len(line)
+                    try:
+                        yield json.loads(line), offset
+                    except ValueError:
+                        yield None, offset
+        except OSError:
+            return
+
+    def page(self, cursor=None, limit=1000):
+        """(records, next_cursor) for incremental readers.
+
+        Without a cursor: the newest `limit` records and a cursor at the end.
+        With one: up to `limit` records appended after it, oldest first. The
+        cursor is "<partition start>:<byte offset>".
+        """
+        parts = self.partitions()
+        if cursor is None:
+            out = []
+            end = 0
+            for i, path in enumerate(reversed(parts)):
+                recs = []
+                for rec, pos in self._lines(path):
+                    if rec is not None:
+                        recs.append(rec)
+                    if i == 0:
+                        end = pos
+                out[:0] = recs
+                if len(out) >= limit:
+                    break
+            return out[-limit:], '%d:%d' % (self._start(parts[-1]) if parts else 0, end)
+        start, offset = (int(x) for x in cursor.split(':'))
+        out = []
+        for path in parts:
+            pstart = self._start(path)
+            if pstart < start:
+                continue
+            if pstart > start:
+                start, offset = pstart, 0
+            for rec, end in self._lines(path, offset):
+                if rec is not None:
+                    out.append(rec)
+                offset = end
+                if len(out) >= limit:
+                    return out, '%d:%d' % (start, offset)
+        return out, '%d:%d' % (start, offset)
+
+    def import_legacy(self, path):
+        """Move records from an old unbounded JSON list file into the history once"""
+        if not os.path.exists(path):
+            return 0
+        with file_lock(os.path.join(self.dir, self.prefix)):
+            try:
+                with open(path, 'r') as f:
+                    records = json.load(f)
+            except (OSError, ValueError):
+                return 0
+            if not isinstance(records, list):
+                return 0
+            with open(self._partition_path(time.time()), 'a') as f:
+                for r in records:
+                    f.write(json.dumps(r, separators=(',', ':')) + '\n')
+            os.replace(path, path + '.migrated')
+        return len(records)
+
+    def stats(self):
+        parts = self.partitions()
+        size = 0
+        for p in parts:
+            try:
+                size += os.path.getsize(p)
+            except OSError:
+                pass
+        return {
+            'partitions': len(parts),
+            'bytes': size,
+            'appended': self.appended,
+            'dropped_partitions': self.dropped_partitions,
+            'partition_seconds': self.partition_seconds,
+            'retention': self.retention,
+        }
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import os
+import time
+import queue
+import atexit
+import threading
+
+# Background pipeline for connection events: request handlers submit() and
+# return immediately, a small worker pool enriches events (ASN lookup) and
+# hands them to persist() in batches.
+
+_STOP = object()
+
+
+class ConnectionPipeline:
+    """Bounded queue + worker pool that enriches and persists events in batches"""
+
+    def __init__(self, enrich, persist, workers=2, maxsize=10000, batch_size=200,
+                 flush_interval=1.0, put_timeout=0.05):
+        self.enrich = enrich
+        self.persist = persist
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        self.counters = {
+            'submitted': 0,
+            'dropped': 0,
+            'enrich_failures': 0,
+            'persisted': 0,
+            'batches': 0,
+            'persist_failures': 0,
+        }
+
+    def _count(self, name, n=1):
+        with self._counter_lock:
+            self.counters[name] += n
+
+    def _ensure_started(self):
+        # threads are started lazily so they belong to the worker process, not
+        # a pre-fork master
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name='conn-pipeline-%d' % i, daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def submit(self, event):
+        """Queue an event; returns False (and counts a drop) if the queue stays full"""
+        self._ensure_started()
+        try:
+            # brief blocking put is the backpressure; beyond that we shed load
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('submitted')
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+            if event is _STOP:
+                self._flush(batch)
+                return
+            if event is not None:
+                try:
+                    event = self.enrich(event)
+                except Exception:
+                    self._count('enrich_failures')
+                batch.append(event)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.persist(batch)
+        except Exception:
+            self._count('persist_failures')
+            return
+        self._count('persisted', len(batch))
+        self._count('batches')
+
+    def stop(self, timeout=10):
+        """Drain queued events and stop the workers"""
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        end = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, end - time.monotonic()))
+        self._threads = []
+        self._pid = None
+
+    def stats(self):
+        with self._counter_lock:
+            out = dict(self.counters)
+        out['queued'] = self._queue.qsize()
+        out['capacity'] = self._queue.maxsize
+        out['workers'] = self.workers
+        return out
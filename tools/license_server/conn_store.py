@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import heapq
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not POSIX; single-process use only
+    fcntl = None
+
+# Write-behind store for per-key connection state (connections.json).
+#
+# Heartbeats only touch an in-memory dict. A background thread flushes the
+# dirty keys every flush_interval seconds, or sooner once flush_dirty keys are
+# pending. A flush merges with the file on disk under an exclusive file lock
+# (newest last_seen wins), so gunicorn workers don't overwrite each other, and
+# publishes the result with write-to-temp + fsync + rename. With max_age set,
+# keys not seen for that many seconds are dropped at flush time.
+#
+# Sessions seen within active_window seconds are also tracked in an
+# ActiveSessions index ordered by last_seen, so listing or counting live
+# sessions costs O(active) rather than O(every key ever seen).
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive advisory lock on path + '.lock' (shared by all processes)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def atomic_write_json(path, data, indent=None):
+    """Replace path with data without readers ever seeing a partial file"""
+    tmp = '%s.tmp.%d.%d' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'w') as f:
+        if indent is None:
+            json.dump(data, f, separators=(',', ':'))
+        else:
+            json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ActiveSessions:
+    """Keys with last_seen within the last `window` seconds.
+
+    A heap of (last_seen, key) orders the sessions by expiry; entries left
+    behind by newer heartbeats are skipped when they reach the top. sweep()
+    pops everything older than the window.
+    """
+
+    def __init__(self, window=5):
+        self.window = window
+        self._seen = {}
+        self._heap = []
+        self.expired = 0
+
+    def touch(self, key, last_seen, now=None):
+        cur = self._seen.get(key)
+        if cur is not None and cur >= last_seen:
+            return
+        if last_seen < (now if now is not None else time.time()) - self.window:
+            # already expired (e.g. old state merged from disk)
+            return
+        self._seen[key] = last_seen
+        heapq.heappush(self._heap, (last_seen, key))
+
+    def sweep(self, now=None):
+        """Drop sessions that left the window; returns how many"""
+        cutoff = (now if now is not None else time.time()) - self.window
+        heap = self._heap
+        n = 0
+        while heap and heap[0][0] < cutoff:
+            t, key = heapq.heappop(heap)
+            if self._seen.get(key) == t:
+                del self._seen[key]
+                n += 1
+        if len(heap) > 4 * len(self._seen) + 1024:
+            # mostly superseded entries; rebuild from the live set
+            self._heap = [(t, k) for k, t in self._seen.items()]
+            heapq.heapify(self._heap)
+        self.expired += n
+        return n
+
+    def keys(self, now=None):
+        """key -> last_seen of every active session"""
+        self.sweep(now)
+        return dict(self._seen)
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class ConnectionStore:
+    """In-memory key -> connection state with coalescing write-behind"""
+
+    def __init__(self, path, flush_interval=2.0, flush_dirty=500, max_age=0, active_window=5):
+        self.path = path
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.flush_dirty = flush_dirty
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = set()
+        self._pid = None
+        self.updates = 0
+        self.flushes = 0
+        self.flushed_keys = 0
+        self.flush_failures = 0
+        self.on_flush = None  # optional callback(seconds) after each flush
+        self.sessions = ActiveSessions(active_window)
+        self._conns = self._read_disk()
+        self._track(self._conns)
+
+    def _read_disk(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # the flush thread also sweeps expired sessions out of the active index
+            threading.Thread(target=self._run, name='conn-store-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def update(self, key, **fields):
+        """Merge fields into key's state; repeated updates coalesce until the next flush"""
+        self._ensure_started()
+        with self._lock:
+            self._conns.setdefault(key, {}).update(fields)
+            self._dirty.add(key)
+            if 'last_seen' in fields:
+                self.sessions.touch(key, fields['last_seen'])
+            self.updates += 1
+            pending = len(self._dirty)
+        if pending >= self.flush_dirty:
+            self._wake.set()
+
+    def update_many(self, updates):
+        """update() for a {key: fields} batch under one lock acquisition"""
+        if not updates:
+            return
+        self._ensure_started()
+        with self._lock:
+            for key, fields in updates.items():
+                self._conns.setdefault(key, {}).update(fields)
+                self._dirty.add(key)
+            self._track(updates)
+            self.updates += len(updates)
+            pending = len(self._dirty)
+        if pending >= self.flush_dirty:
+            self._wake.set()
+
+    def get(self, key):
+        with self._lock:
+            v = self._conns.get(key)
+            return dict(v) if v is not None else None
+
+    def snapshot(self):
+        """Copy of all known connection state (this worker + last merged flush)"""
+        with self._lock:
+            return {k: dict(v) for k, v in self._conns.items()}
+
+    def _track(self, conns):
+        # caller holds the lock (or is __init__)
+        now = time.time()
+        for k, v in conns.items():
+            if 'last_seen' in v:
+                self.sessions.touch(k, v['last_seen'], now)
+
+    def active(self, now=None):
+        """State of the sessions seen within active_window seconds, O(active)"""
+        with self._lock:
+            return {k: dict(self._conns[k]) for k in self.sessions.keys(now) if k in self._conns}
+
+    def stale(self, now=None):
+        """State of every known key that is not active"""
+        with self._lock:
+            live = self.sessions.keys(now)
+            return {k: dict(v) for k, v in self._conns.items() if k not in live}
+
+    def counts(self, now=None):
+        with self._lock:
+            self.sessions.sweep(now)
+            active = len(self.sessions)
+            return {'active': active, 'stale': len(self._conns) - active, 'total': len(self._conns)}
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                self.sessions.sweep()
+            try:
+                self.flush()
+            except Exception:
+                self.flush_failures += 1
+
+    def flush(self):
+        """Merge dirty state into the backing store and publish it atomically"""
+        start = time.perf_counter()
+        with self._lock:
+            dirty = {k: dict(self._conns[k]) for k in self._dirty}
+            self._dirty = set()
+        try:
+            merged = self._write(dirty)
+        except Exception:
+            # put the keys back so the next flush retries them
+            with self._lock:
+                self._dirty.update(dirty)
+            raise
+        self._refresh(merged)
+        if dirty:
+            self.flushes += 1
+            self.flushed_keys += len(dirty)
+            if self.on_flush is not None:
+                self.on_flush(time.perf_counter() - start)
+
+    def _write(self, dirty):
+        with file_lock(self.path):
+            disk = self._read_disk()
+            for k, v in dirty.items():
+                cur = disk.get(k)
+                if cur is None or cur.get('last_seen', 0) <= v.get('last_seen', 0):
+                    disk[k] = v
+            expired = self._expired(disk)
+            for k in expired:
+                del disk[k]
+            if dirty or expired:
+                atomic_write_json(self.path, disk)
+        return disk
+
+    def _expired(self, conns):
+        if not self.max_age:
+            return []
+        cutoff = time.time() - self.max_age
+        return [k for k, v in conns.items() if v.get('last_seen', 0) < cutoff]
+
+    def _refresh(self, merged):
+        with self._lock:
+            # pick up other workers' sessions, keeping anything updated meanwhile
+            for k, v in merged.items():
+                if k not in self._dirty:
+                    self._conns[k] = v
+            self._track(merged)
+            for k in self._expired(self._conns):
+                if k not in self._dirty:
+                    del self._conns[k]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._conns),
+                'dirty': len(self._dirty),
+                'updates': self.updates,
+                'flushes': self.flushes,
+                'flushed_keys': self.flushed_keys,
+                'flush_failures': self.flush_failures,
+                'flush_interval': self.flush_interval,
+                'flush_dirty': self.flush_dirty,
+                'max_age': self.max_age,
+                'active': len(self.sessions),
+                'active_window': self.sessions.window,
+                'expired_sessions': self.sessions.expired,
+            }
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import threading
+
+from conn_store import file_lock
+from key_index import file_stamp
+
+# Hashed key store for deployments with millions of keys (KEY_STORE=digest).
+#
+# keys.bin   header (magic, salt, count) + sorted 16-byte keyed BLAKE2b
+#            digests of every key; memory-mapped read-only by each worker, so
+#            the pages are shared through the page cache
+# keys.bin.delta
+#            append-only 17-byte records (b'+' or b'-', digest) for keys
+#            added/removed since the last compaction; small, held in a dict
+#
+# A lookup checks the delta dict, then binary-searches the mapped array. Once
+# the delta passes compact_at records it is merged into a new keys.bin
+# (streamed in one pass, written to a temp file and renamed) and emptied.
+# Appends, compaction and reader resyncs take file_lock(keys.bin), and writers
+# bump the 'keys' generation so workers notice. The key set holds no
+# plaintext, and the servers record client keys in their attempts,
+# connections, rollups and events under the hex digest (see key_ids() in
+# server.py). The abuse detector still counts the first ABUSE_PREFIX_LEN
+# characters of failed keys. The salt keeps the digests from being matched
+# against a list of guessed keys computed elsewhere.
+
+MAGIC = b'LKD1'
+_HEADER = struct.Struct('<4s16sQ4x')
+DIGEST = 16
+_DELTA = struct.Struct('<c16s')
+ADD, REMOVE = b'+', b'-'
+
+
+def digest(salt, key):
+    return hashlib.blake2b(key.encode(), digest_size=DIGEST, key=salt).digest()
+
+
+def write_base(path, salt, digests):
+    """Publish a sorted iterable of digests as the new base file"""
+    tmp = '%s.tmp.%d.%d' % (path, os.getpid(), threading.get_ident())
+    count = 0
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, salt, 0))
+        buf = []
+        for d in digests:
+            buf.append(d)
+            count += 1
+            if len(buf) == 65536:
+                f.write(b''.join(buf))
+                buf = []
+        f.write(b''.join(buf))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, salt, count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return count
+
+
+class DigestStore:
+    """KeyIndex-compatible lookups plus add/remove over keys.bin + delta"""
+
+    def __init__(self, path, generations=None, stamp=None, compact_at=10000, background=True):
+        self.path = path
+        self.delta_path = path + '.delta'
+        self.generations = generations
+        self._stat = stamp or (lambda: (file_stamp(path), file_stamp(path + '.delta')))
+        self.compact_at = compact_at
+        self.background = background
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._mm = None
+        self._base_id = None
+        self._delta_id = None
+        self._delta_off = 0
+        self._delta = {}
+        self._compacting = False
+        self.salt = None
+        self.count = 0
+        self.reloads = 0
+        self.lookups = 0
+        self.compactions = 0
+        with file_lock(self.path):
+            if not os.path.exists(self.path):
+                write_base(self.path, os.urandom(16), ())
+
+    # reading
+
+    def _sync(self):
+        # caller holds self._lock and file_lock(self.path)
+        st = os.stat(self.path)
+        if (st.st_ino, st.st_size) != self._base_id:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, salt, count = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC:
+                raise ValueError('%s is not a key digest file' % self.path)
+            self._mm, self.salt, self.count = mm, salt, count
+            self._base_id = (st.st_ino, st.st_size)
+            self._delta_id = None
+        try:
+            dst = os.stat(self.delta_path)
+            delta_id = dst.st_ino
+        except FileNotFoundError:
+            delta_id = None
+        if delta_id != self._delta_id:
+            self._delta_id = delta_id
+            self._delta_off = 0
+            self._delta = {}
+        if delta_id is not None:
+            with open(self.delta_path, 'rb') as f:
+                f.seek(self._delta_off)
+                data = f.read()
+            n = len(data) // _DELTA.size * _DELTA.size
+            for op, d in _DELTA.iter_unpack(data[:n]):
+                self._delta[d] = op == ADD
+            self._delta_off += n
+        self.reloads += 1
+
+    def refresh(self):
+        """Pick up appends/compactions if the keys generation moved"""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            with file_lock(self.path):
+                self._sync()
+            self._stamp = stamp
+
+    def invalidate(self):
+        with self._lock:
+            self._stamp = None
+
+    def _in_base(self, d):
+        mm = self._mm
+        lo, hi = 0, self.count
+        off = _HEADER.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = mm[off + mid * DIGEST:off + (mid + 1) * DIGEST]
+            if cur < d:
+                lo = mid + 1
+            elif cur > d:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def _has(self, d):
+        v = self._delta.get(d)
+        if v is not None:
+            return v
+        return self._in_base(d)
+
+    def digest(self, key):
+        self.refresh()
+        return digest(self.salt, key)
+
+    def digest_many(self, keys):
+        self.refresh()
+        return [digest(self.salt, k) for k in keys]
+
+    def contains(self, key):
+        self.refresh()
+        self.lookups += 1
+        return self._has(digest(self.salt, key))
+
+    def contains_many(self, keys):
+        self.refresh()
+        self.lookups += len(keys)
+        return [self._has(digest(self.salt, k)) for k in keys]
+
+    def stamp(self):
+        """Change marker for the stored set (moves on every add/remove/compaction)"""
+        return self._stat()
+
+    def iter_digests(self):
+        """Raw digests of the current keys"""
+        self.refresh()
+        mm, count, delta = self._mm, self.count, dict(self._delta)
+        for i in range(count):
+            d = mm[_HEADER.size + i * DIGEST:_HEADER.size + (i + 1) * DIGEST]
+            if delta.get(d, True):
+                yield d
+        for d, v in delta.items():
+            if v and not self._in_base(d):
+                yield d
+
+    def keys(self):
+        """Hex digests in sorted order (the plaintext keys are not stored)"""
+        return sorted(d.hex() for d in self.iter_digests())
+
+    def stats(self):
+        with self._lock:
+            # delta entries that change membership
+            live = self.count + sum(1 if v else -1 for d, v in self._delta.items() if v != self._in_base(d))
+        return {
+            'backend': 'digest',
+            'size': live,
+            'base': self.count,
+            'delta': len(self._delta),
+            'reloads': self.reloads,
+            'lookups': self.lookups,
+            'compactions': self.compactions,
+        }
+
+    # writing
+
+    def _write_ops(self, keys, add):
+        with self._lock, file_lock(self.path):
+            self._sync()
+            recs = []
+            seen = set()
+            for k in keys:
+                d = digest(self.salt, k)
+                if d in seen or self._has(d) == add:
+                    continue
+                seen.add(d)
+                recs.append(_DELTA.pack(ADD if add else REMOVE, d))
+            if recs:
+                fd = os.open(self.delta_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, b''.join(recs))
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self._sync()
+                if self.generations is not None:
+                    self.generations.bump('keys')
+            self._stamp = None
+            pending = self._delta_off // _DELTA.size
+        if recs and pending >= self.compact_at:
+            self._schedule_compaction()
+        return len(recs)
+
+    def add_many(self, keys):
+        """Add keys; returns how many were new"""
+        return self._write_ops(keys, True)
+
+    def remove_many(self, keys):
+        """Remove keys; returns how many were present"""
+        return self._write_ops(keys, False)
+
+    def _schedule_compaction(self):
+        if not self.background:
+            self.compact()
+            return
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_bg, name='key-compact', daemon=True).start()
+
+    def _compact_bg(self):
+        try:
+            self.compact()
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """Merge the delta into a new keys.bin and empty the delta"""
+        with self._lock, file_lock(self.path):
+            self._sync()
+            if not self._delta:
+                return self.count
+            adds = sorted(d for d, v in self._delta.items() if v)
+            removes = {d for d, v in self._delta.items() if not v}
+            mm, count, off = self._mm, self.count, _HEADER.size
+
+            def merged():
+                j = 0
+                last = None
+                for i in range(count):
+                    d = mm[off + i * DIGEST:off + (i + 1) * DIGEST]
+                    while j < len(adds) and adds[j] < d:
+                        if adds[j] != last:
+                            yield adds[j]
+                            last = adds[j]
+                        j += 1
+                    if d not in removes and d != last:
+                        yield d
+                        last = d
+                for d in adds[j:]:
+                    if d != last:
+                        yield d
+                        last = d
+
+            n = write_base(self.path, self.salt, merged())
+            # an empty delta with a new inode tells readers to start over
+            open(self.delta_path + '.tmp', 'wb').close()
+            os.replace(self.delta_path + '.tmp', self.delta_path)
+            self._sync()
+            self.compactions += 1
+            if self.generations is not None:
+                self.generations.bump('keys')
+            self._stamp = None
+        return n
+
+
+def convert(keys_file, path, generations=None):
+    """Build keys.bin (new salt, empty delta) from a plaintext JSON key list;
+    returns the key count"""
+    with open(keys_file, 'r') as f:
+        keys = json.load(f)
+    salt = os.urandom(16)
+    with file_lock(path):
+        n = write_base(path, salt, sorted({digest(salt, k) for k in keys}))
+        try:
+            os.remove(path + '.delta')
+        except FileNotFoundError:
+            pass
+    if generations is not None:
+        generations.bump('keys')
+    return n
+
+
+def env_path(app_dir):
+    return os.environ.get('KEY_DIGESTS', os.path.join(app_dir, 'keys.bin'))
+
+
+def from_env(app_dir, generations=None, stamp_factory=None, background=True):
+    """DigestStore when KEY_STORE=digest (file KEY_DIGESTS), else None"""
+    if os.environ.get('KEY_STORE', 'json') != 'digest':
+        return None
+    path = env_path(app_dir)
+    stamp = stamp_factory(path) if stamp_factory else None
+    return DigestStore(path, generations, stamp, compact_at=int(os.environ.get('KEY_COMPACT_AT', 10000)),
+                       background=background)
+
+
+if __name__ == '__main__':
+    # python3 digest_store.py authorized_keys.json keys.bin
+    if len(sys.argv) != 3:
+        print('usage: digest_store.py <authorized_keys.json> <keys.bin>')
+        sys.exit(2)
+    print('%d keys written to %s' % (convert(sys.argv[1], sys.argv[2]), sys.argv[2]))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+import os
+import json
+import mmap
+import time
+import queue
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not POSIX; single-process use only
+    fcntl = None
+
+# Live license events (checks, heartbeats, bans, key changes) for /admin/events.
+#
+# Every gunicorn worker publishes into one memory-mapped ring (events.bin):
+# a sequence counter followed by `slots` fixed-size records, event N living in
+# slot N % slots. The worker serving a stream runs one Broadcaster thread that
+# reads new events from the ring and hands them to each subscriber's bounded
+# queue; a subscriber whose queue is full loses events instead of slowing the
+# others down (it is told how many). The ring also lets a reconnecting client
+# resume from its Last-Event-ID as long as the events are still in it.
+#
+# The header also holds a "readers until" time that every worker with open
+# streams pushes forward while polling. Broadcaster.publish_many() drops events
+# when it has passed, so with no stream open anywhere a check costs one 8-byte
+# read instead of the ring's lock.
+#
+# A stream served by a sync worker (gunicorn -w N) holds that worker for as
+# long as it stays open. Those streams take one of `sync_streams` slots, each
+# an flock on events.bin.stream.<n> that the kernel drops if the worker dies,
+# so they can never occupy every worker. The asyncio server streams without
+# holding a worker and is limited only by max_subscribers.
+
+_HEADER = struct.Struct('<QQ')  # last sequence number, readers-until (unix time)
+_U64 = struct.Struct('<Q')
+READER_TTL = 5
+_LEN = struct.Struct('<H')
+SLOT_SIZE = 512
+
+
+class EventRing:
+    """Fixed-size ring of JSON events shared by all processes"""
+
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        self.oversized = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._mm = None
+        self._fd = None
+
+    def _map(self):
+        if self._pid != os.getpid():
+            size = _HEADER.size + SLOT_SIZE * self.slots
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+            self._fd = fd
+            self._pid = os.getpid()
+        return self._mm
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            mm = self._map()
+            if fcntl is None:
+                yield mm
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield mm
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def publish(self, type, **fields):
+        self.publish_many([dict(fields, type=type)])
+
+    def publish_many(self, events):
+        """Append event dicts (each with a 'type'); returns the last sequence number"""
+        now = int(time.time())
+        datas = []
+        for ev in events:
+            ev.setdefault('time', now)
+            data = json.dumps(ev, separators=(',', ':'), default=str).encode()
+            if len(data) > SLOT_SIZE - _LEN.size:
+                self.oversized += 1
+                data = json.dumps({'type': ev['type'], 'time': ev['time'], 'truncated': True}).encode()
+            datas.append(data)
+        if not datas:
+            return self.head()
+        with self._locked() as mm:
+            seq = _HEADER.unpack_from(mm, 0)[0]
+            for data in datas:
+                seq += 1
+                off = _HEADER.size + (seq % self.slots) * SLOT_SIZE
+                _LEN.pack_into(mm, off, len(data))
+                mm[off + _LEN.size:off + _LEN.size + len(data)] = data
+            _U64.pack_into(mm, 0, seq)
+        return seq
+
+    def head(self):
+        return _HEADER.unpack_from(self._map(), 0)[0]
+
+    def mark_readers(self, ttl=READER_TTL):
+        """Keep has_readers() true for ttl seconds (a lone 8-byte store, no lock)"""
+        _U64.pack_into(self._map(), 8, int(time.time()) + ttl)
+
+    def has_readers(self, now=None):
+        return _HEADER.unpack_from(self._map(), 0)[1] >= (now if now is not None else time.time())
+
+    def read(self, after, until=None):
+        """([(seq, event)], lost) for events after `after` (up to `until`);
+        lost counts events already overwritten in the ring"""
+        with self._locked() as mm:
+            head = _HEADER.unpack_from(mm, 0)[0]
+            if until is None or until > head:
+                until = head
+            first = max(after + 1, until - self.slots + 1, 1)
+            out = []
+            for seq in range(first, until + 1):
+                off = _HEADER.size + (seq % self.slots) * SLOT_SIZE
+                n = _LEN.unpack_from(mm, off)[0]
+                out.append((seq, bytes(mm[off + _LEN.size:off + _LEN.size + n])))
+        events = []
+        for seq, data in out:
+            try:
+                events.append((seq, json.loads(data)))
+            except ValueError:
+                pass
+        return events, max(0, first - after - 1)
+
+
+class Subscription:
+    def __init__(self, size):
+        self.queue = queue.Queue(size)
+        self.dropped = 0
+        self.slot = None
+
+
+class StreamSlots:
+    """At most `limit` streams open at once across all processes"""
+
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+
+    def acquire(self):
+        """An open slot file (kept until release()), or None when all are taken"""
+        for n in range(self.limit):
+            fd = os.open('%s.%d' % (self.path, n), os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is None:
+                return fd
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def release(self, fd):
+        os.close(fd)  # drops the flock
+
+
+class Broadcaster:
+    """Fans new ring events out to this process's subscribers"""
+
+    def __init__(self, ring, poll_interval=0.2, queue_size=1000, max_subscribers=8, sync_streams=None):
+        self.ring = ring
+        self.sync_streams = sync_streams
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subs = []
+        self._lock = threading.Lock()
+        self._seq = None
+        self._pid = None
+        self.delivered = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def publish_many(self, events):
+        """Publish event dicts into the ring, unless no stream is open in any worker"""
+        if not self.ring.has_readers():
+            self.skipped += len(events)
+            return
+        self.ring.publish_many(events)
+
+    def _ensure_started(self):
+        # caller holds self._lock
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._subs = []
+        self._seq = self.ring.head()
+        threading.Thread(target=self._run, name='event-broadcast', daemon=True).start()
+
+    def subscribe(self, after=None, holds_worker=False):
+        """Subscription, or None when max_subscribers are already connected
+        (or, with holds_worker, every sync stream slot is taken).
+
+        With `after` (a Last-Event-ID) the events since then that are still in
+        the ring are queued first.
+        """
+        slot = None
+        if holds_worker and self.sync_streams is not None:
+            slot = self.sync_streams.acquire()
+            if slot is None:
+                return None
+        with self._lock:
+            self._ensure_started()
+            if len(self._subs) >= self.max_subscribers:
+                if slot is not None:
+                    self.sync_streams.release(slot)
+                return None
+            self.ring.mark_readers()
+            sub = Subscription(self.queue_size)
+            sub.slot = slot
+            if after is not None:
+                backlog, lost = self.ring.read(after, until=self._seq)
+                # keep the newest that fit in the queue
+                sub.dropped += lost + max(0, len(backlog) - self.queue_size)
+                for item in backlog[-self.queue_size:]:
+                    sub.queue.put_nowait(item)
+            self._subs.append(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+            if sub.slot is not None:
+                self.sync_streams.release(sub.slot)
+                sub.slot = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                pass
+
+    def poll(self):
+        with self._lock:
+            if not self._subs:
+                # nobody listening; skip ahead rather than replay later
+                self._seq = self.ring.head()
+                return
+            self.ring.mark_readers()
+            events, lost = self.ring.read(self._seq)
+            if events:
+                self._seq = events[-1][0]
+            for sub in self._subs:
+                sub.dropped += lost
+                for item in events:
+                    try:
+                        sub.queue.put_nowait(item)
+                        self.delivered += 1
+                    except queue.Full:
+                        sub.dropped += 1
+                        self.dropped += 1
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subs), 'head': self.ring.head(), 'slots': self.ring.slots,
+                    'delivered': self.delivered, 'dropped': self.dropped, 'oversized': self.ring.oversized,
+                    'skipped': self.skipped, 'readers': self.ring.has_readers(),
+                    'sync_streams': self.sync_streams.limit if self.sync_streams else None}
+
+
+def format_event(seq, ev):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (seq, ev.get('type', 'message'), json.dumps(ev))
+
+def format_dropped(count):
+    return 'event: dropped\ndata: {"count": %d}\n\n' % count
+
+KEEPALIVE = ': keepalive\n\n'
+
+
+def sse(broadcaster, sub, keepalive=15.0):
+    """text/event-stream chunks for a subscription; unsubscribes when the client goes away"""
+    try:
+        yield 'retry: 2000\n\n'
+        reported = 0
+        while True:
+            try:
+                seq, ev = sub.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+            if sub.dropped > reported:
+                yield format_dropped(sub.dropped - reported)
+                reported = sub.dropped
+            yield format_event(seq, ev)
+    finally:
+        broadcaster.unsubscribe(sub)
+
+
+def from_env(app_dir):
+    """Broadcaster over EVENTS_FILE when EVENTS=1, else None.
+
+    EVENTS_SYNC_STREAMS (default 1) caps the streams served by sync workers
+    and must stay below the gunicorn worker count.
+    """
+    if os.environ.get('EVENTS', '0') != '1':
+        return None
+    path = os.environ.get('EVENTS_FILE', os.path.join(app_dir, 'events.bin'))
+    ring = EventRing(path, slots=int(os.environ.get('EVENTS_SLOTS', 4096)))
+    return Broadcaster(ring,
+                       queue_size=int(os.environ.get('EVENTS_QUEUE', 1000)),
+                       max_subscribers=int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 8)),
+                       sync_streams=StreamSlots(path + '.stream', int(os.environ.get('EVENTS_SYNC_STREAMS', 1))))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import os
+import csv
+import gzip
+import bisect
+import argparse
+import ipaddress
+from array import array
+
+# Local IP range -> ASN/org table, so lookups need no network I/O.
+#
+# Supported inputs (optionally .gz compressed):
+#   *.csv : start_ip,end_ip,asn,org[,isp]   (header row optional)
+#   *.tsv : iptoasn.com layout: start_ip  end_ip  as_number  country  as_description
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', newline='')
+    return open(path, 'r', newline='')
+
+def _format_asn(asn):
+    asn = (asn or '').strip()
+    if not asn or asn in ('0', 'None'):
+        return None
+    if asn.upper().startswith('AS'):
+        return 'AS' + asn[2:]
+    return 'AS' + asn
+
+
+class _Family:
+    """Sorted, non-overlapping ranges for one address family"""
+
+    def __init__(self, typecode):
+        self.typecode = typecode
+        self.rows = []
+
+    def add(self, start, end, rec):
+        self.rows.append((start, end, rec))
+
+    def freeze(self):
+        self.rows.sort(key=lambda r: r[0])
+        if self.typecode:
+            self.starts = array(self.typecode, (r[0] for r in self.rows))
+            self.ends = array(self.typecode, (r[1] for r in self.rows))
+        else:
+            # 128-bit values do not fit an array typecode
+            self.starts = [r[0] for r in self.rows]
+            self.ends = [r[1] for r in self.rows]
+        self.recs = [r[2] for r in self.rows]
+        del self.rows
+
+    def find(self, value):
+        i = bisect.bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self.recs[i]
+        return None
+
+
+class IpAsnDatabase:
+    """Binary-search lookup over sorted IPv4/IPv6 ranges"""
+
+    def __init__(self, path):
+        self.path = path
+        self.v4 = _Family('I' if array('I').itemsize >= 4 else 'L')
+        self.v6 = _Family(None)
+        self.lookups = 0
+        self.hits = 0
+        self._load()
+
+    def _rows(self):
+        with _open_text(self.path) as f:
+            if self.path.endswith('.tsv') or self.path.endswith('.tsv.gz'):
+                for row in csv.reader(f, delimiter='\t'):
+                    if len(row) < 5:
+                        continue
+                    yield row[0], row[1], row[2], row[4], row[4]
+            else:
+                for row in csv.reader(f):
+                    if len(row) < 4 or row[0].startswith('#'):
+                        continue
+                    yield row[0], row[1], row[2], row[3], row[4] if len(row) > 4 else row[3]
+
+    def _load(self):
+        # interned so repeated org names share one object
+        recs = {}
+        for start, end, asn, org, isp in self._rows():
+            try:
+                a = ipaddress.ip_address(start.strip())
+                b = ipaddress.ip_address(end.strip())
+            except ValueError:
+                continue  # header or malformed line
+            if a.version != b.version:
+                continue
+            asn = _format_asn(asn)
+            if asn is None:
+                continue  # "not routed" ranges
+            rec = (asn, org.strip() or None, isp.strip() or None)
+            rec = recs.setdefault(rec, rec)
+            fam = self.v4 if a.version == 4 else self.v6
+            fam.add(int(a), int(b), rec)
+        self.v4.freeze()
+        self.v6.freeze()
+
+    def __len__(self):
+        return len(self.v4.recs) + len(self.v6.recs)
+
+    def lookup(self, ip):
+        """Return (asn, org, isp) for ip, or None if unknown/invalid"""
+        self.lookups += 1
+        try:
+            addr = ipaddress.ip_address(ip.strip())
+        except (ValueError, AttributeError):
+            return None
+        if addr.version == 6 and addr.ipv4_mapped:
+            addr = addr.ipv4_mapped
+        fam = self.v4 if addr.version == 4 else self.v6
+        rec = fam.find(int(addr))
+        if rec is not None:
+            self.hits += 1
+        return rec
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'ranges_v4': len(self.v4.recs),
+            'ranges_v6': len(self.v6.recs),
+            'lookups': self.lookups,
+            'hits': self.hits,
+        }
+
+
+def load_default():
+    """Database named by the ASN_DB environment variable, or None"""
+    path = os.environ.get('ASN_DB')
+    if not path:
+        return None
+    try:
+        return IpAsnDatabase(path)
+    except Exception as e:
+        print('ASN database %s not loaded: %s' % (path, e))
+        return None
+
+def main():
+    p = argparse.ArgumentParser(description='Look up IPs in a local IP->ASN range table')
+    p.add_argument('db')
+    p.add_argument('ips', nargs='+')
+    args = p.parse_args()
+    db = IpAsnDatabase(args.db)
+    for ip in args.ips:
+        rec = db.lookup(ip)
+        print(ip, *(rec or ('not found',)))
+
+if __name__ == '__main__':
+    main()
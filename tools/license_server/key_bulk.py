@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import os
+import csv
+import json
+
+from conn_store import file_lock
+from snapshot import publish
+
+# Bulk key import/removal/export shared by manage_keys.py and the admin
+# endpoints. Input is read as a stream of lines, deduplicated with a set and
+# committed once: one JSON publish (or one SQLite transaction) per batch
+# instead of a load + O(n) membership test + rewrite per key.
+#
+# Formats:
+#   lines  one key per line; blank lines and '#' comments are skipped
+#   csv    header row with a `key` column; the other columns are stored as
+#          that key's metadata (keys_meta.json / the key_meta table)
+
+MAX_KEY_LENGTH = 256
+
+
+class TooMany(ValueError):
+    pass
+
+
+def parse(lines, fmt='lines', limit=None):
+    """{key: metadata dict or None} from an iterable of text lines, plus the
+    invalid count; raises TooMany past `limit` distinct keys"""
+    out = {}
+    invalid = 0
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames or 'key' not in reader.fieldnames:
+            raise ValueError('csv needs a "key" column')
+        for row in reader:
+            key = (row.pop('key') or '').strip()
+            if not key or len(key) > MAX_KEY_LENGTH:
+                invalid += 1
+                continue
+            meta = {k: v for k, v in row.items() if k and v not in (None, '')}
+            out[key] = meta or None
+            if limit is not None and len(out) > limit:
+                raise TooMany(limit)
+        return out, invalid
+    for line in lines:
+        key = line.strip()
+        if not key or key.startswith('#'):
+            continue
+        if len(key) > MAX_KEY_LENGTH or any(c.isspace() for c in key):
+            invalid += 1
+            continue
+        out[key] = None
+        if limit is not None and len(out) > limit:
+            raise TooMany(limit)
+    return out, invalid
+
+
+def body_lines(stream):
+    """Text lines from a (possibly chunked) binary request body"""
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8', 'replace')
+
+
+def load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def meta_file(keys_file):
+    return os.path.join(os.path.dirname(keys_file), 'keys_meta.json')
+
+
+def _store_meta(path, meta):
+    with file_lock(path):
+        stored = load_json(path, {})
+        stored.update(meta)
+        publish(path, stored)
+
+
+def import_keys(entries, keys_file=None, generations=None, storage=None, digests=None):
+    """Add {key: meta} in one commit; returns {'added', 'existing'}"""
+    if digests is not None:
+        # metadata is filed under the digest, never the plaintext key
+        added = digests.add_many(entries)
+        meta = {digests.digest(k).hex(): m for k, m in entries.items() if m}
+        if meta:
+            _store_meta(meta_file(digests.path), meta)
+        return {'added': added, 'existing': len(entries) - added}
+    if storage is not None:
+        added = storage.add_keys(entries)
+        meta = {k: m for k, m in entries.items() if m}
+        if meta:
+            storage.set_key_meta(meta)
+        return {'added': added, 'existing': len(entries) - added}
+    with file_lock(keys_file):
+        keys = load_json(keys_file, [])
+        have = set(keys)
+        new = [k for k in entries if k not in have]
+        if new:
+            keys.extend(new)
+            publish(keys_file, keys, generations, 'keys')
+        meta = {k: m for k, m in entries.items() if m}
+        if meta:
+            path = meta_file(keys_file)
+            stored = load_json(path, {})
+            stored.update(meta)
+            publish(path, stored)
+    return {'added': len(new), 'existing': len(entries) - len(new)}
+
+
+def remove_keys(keys, keys_file=None, generations=None, storage=None, digests=None):
+    """Remove a set of keys in one commit; returns {'removed', 'not_found'}"""
+    keys = set(keys)
+    if digests is not None:
+        removed = digests.remove_many(keys)
+        return {'removed': removed, 'not_found': len(keys) - removed}
+    if storage is not None:
+        removed = storage.remove_keys(keys)
+        return {'removed': removed, 'not_found': len(keys) - removed}
+    with file_lock(keys_file):
+        current = load_json(keys_file, [])
+        kept = [k for k in current if k not in keys]
+        removed = len(current) - len(kept)
+        if removed:
+            publish(keys_file, kept, generations, 'keys')
+            path = meta_file(keys_file)
+            stored = load_json(path, None)
+            if stored and any(k in stored for k in keys):
+                publish(path, {k: v for k, v in stored.items() if k not in keys})
+    return {'removed': removed, 'not_found': len(keys) - removed}
+
+
+def export_keys(keys_file=None, storage=None, fmt='lines', digests=None):
+    """Yield the keys as text lines (csv: key plus metadata columns); a digest
+    store exports hex digests"""
+    if digests is not None:
+        keys = digests.keys()
+        meta = load_json(meta_file(digests.path), {}) if fmt == 'csv' else {}
+    elif storage is not None:
+        keys = storage.iter_keys()
+        meta = storage.key_meta() if fmt == 'csv' else {}
+    else:
+        keys = load_json(keys_file, [])
+        meta = load_json(meta_file(keys_file), {}) if fmt == 'csv' else {}
+    if fmt != 'csv':
+        for k in keys:
+            yield k + '\n'
+        return
+    columns = sorted({c for m in meta.values() for c in m})
+    yield _csv_line(['key'] + columns)
+    for k in keys:
+        m = meta.get(k) or {}
+        yield _csv_line([k] + [m.get(c, '') for c in columns])
+
+
+class _Line:
+    def write(self, s):
+        return s
+
+def _csv_line(row):
+    return csv.writer(_Line(), lineterminator='\n').writerow(row)
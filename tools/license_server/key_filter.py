@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+import os
+import math
+import time
+import hashlib
+import threading
+
+# Bloom filter over the authorized keys, consulted by /check before the ASN
+# lookup, ban checks, attempt log and connection update (KEY_FILTER=1).
+#
+# A miss is definite, so guessed keys are answered `wrong` after one hash and
+# a few bit tests. A hit may be a false positive (about KEY_FILTER_FP of the
+# wrong keys) and goes through the normal path, which has the exact answer.
+#
+# The filter is tagged with the keys stamp it was built from. When the stamp
+# moves (a key was added or removed) it is rebuilt in a background thread and
+# every lookup passes through until then, so a freshly added key is never
+# rejected. Removed keys only cost an extra false positive until the rebuild.
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter for str/bytes items"""
+
+    def __init__(self, capacity, fp_rate=0.01):
+        capacity = max(1, capacity)
+        self.bits = max(64, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, item):
+        if isinstance(item, str):
+            item = item.encode()
+        h = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(h[:8], 'little')
+        h2 = int.from_bytes(h[8:], 'little') | 1
+        m = self.bits
+        return [(h1 + i * h2) % m for i in range(self.hashes)]
+
+    def add(self, item):
+        a = self._array
+        for p in self._positions(item):
+            a[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def update(self, items):
+        """add() for many items (the same positions, without the per-call overhead)"""
+        a, m, k = self._array, self.bits, self.hashes
+        blake2b, from_bytes = hashlib.blake2b, int.from_bytes
+        n = 0
+        for item in items:
+            if isinstance(item, str):
+                item = item.encode()
+            h = blake2b(item, digest_size=16).digest()
+            p, step = from_bytes(h[:8], 'little'), from_bytes(h[8:], 'little') | 1
+            for _ in range(k):
+                q = p % m
+                a[q >> 3] |= 1 << (q & 7)
+                p += step
+            n += 1
+        self.count += n
+
+    def __contains__(self, item):
+        a = self._array
+        for p in self._positions(item):
+            if not a[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def expected_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+class KeyFilter:
+    """Prefilter for one key source.
+
+    stamp() changes whenever the keys change; items() lists them (the filter
+    holds transform(key) for each lookup, e.g. a digest store's salted digest).
+    """
+
+    def __init__(self, stamp, items, fp_rate=0.01, transform=None):
+        self.stamp = stamp
+        self.items = items
+        self.fp_rate = fp_rate
+        self.transform = transform
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._built = None
+        self._building = None
+        self.rebuilds = 0
+        self.build_seconds = 0.0
+        self.checks = 0
+        self.rejects = 0
+        self.bypassed = 0
+
+    def might_contain(self, key):
+        """False only if the key is certainly not authorized"""
+        self.checks += 1
+        bloom = self._bloom
+        if bloom is None or self.stamp() != self._built:
+            self._schedule()
+            self.bypassed += 1
+            return True
+        if (self.transform(key) if self.transform else key) in bloom:
+            return True
+        self.rejects += 1
+        return False
+
+    def _schedule(self):
+        with self._lock:
+            # a build started before a fork does not run in this process
+            if self._building == os.getpid():
+                return
+            self._building = os.getpid()
+        threading.Thread(target=self._rebuild_bg, name='key-filter', daemon=True).start()
+
+    def _rebuild_bg(self):
+        try:
+            self.rebuild()
+        finally:
+            self._building = None
+
+    def rebuild(self):
+        # stamp first: a change during the build leaves the filter tagged stale
+        stamp = self.stamp()
+        started = time.perf_counter()
+        items = list(self.items())
+        bloom = BloomFilter(len(items), self.fp_rate)
+        bloom.update(items)
+        self._bloom, self._built = bloom, stamp
+        self.rebuilds += 1
+        self.build_seconds = round(time.perf_counter() - started, 3)
+
+    def stats(self):
+        bloom = self._bloom
+        out = {
+            'checks': self.checks,
+            'rejects': self.rejects,
+            'bypassed': self.bypassed,
+            'reject_rate': round(self.rejects / self.checks, 4) if self.checks else 0.0,
+            'fp_rate': self.fp_rate,
+            'rebuilds': self.rebuilds,
+            'build_seconds': self.build_seconds,
+            'stale': bloom is None or self.stamp() != self._built,
+        }
+        if bloom is not None:
+            out.update(keys=bloom.count, bits=bloom.bits, bytes=len(bloom._array), hashes=bloom.hashes,
+                       expected_fp_rate=round(bloom.expected_fp_rate(), 6))
+        return out
+
+
+def from_env(stamp, items, transform=None):
+    """KeyFilter when KEY_FILTER=1 (false-positive rate KEY_FILTER_FP), else None"""
+    if os.environ.get('KEY_FILTER', '0') != '1':
+        return None
+    return KeyFilter(stamp, items, float(os.environ.get('KEY_FILTER_FP', 0.01)), transform)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import json
+import threading
+
+
+def file_stamp(path):
+    """Cheap change marker for a file that is replaced or rewritten"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ()
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class KeyIndex:
+    """Resident set of authorized keys, reloaded only when the keys file changes.
+
+    stamp() defaults to the file's stat; pass a cheaper change marker (e.g. a
+    shared generation counter) if writers maintain one.
+    """
+
+    def __init__(self, path, stamp=None):
+        self.path = path
+        self._stat = stamp or (lambda: file_stamp(path))
+        self._lock = threading.Lock()
+        self._keys = frozenset()
+        self._order = []
+        self._stamp = None
+        self.reloads = 0
+        self.lookups = 0
+
+    def _load(self, stamp):
+        try:
+            with open(self.path, 'r') as f:
+                keys = json.load(f)
+        except Exception:
+            # keep serving the last good copy if the file is mid-write
+            if self.reloads:
+                return
+            keys = []
+        self._order = list(keys)
+        self._keys = frozenset(keys)
+        self._stamp = stamp
+        self.reloads += 1
+
+    def refresh(self):
+        """Reload the index if the keys file changed since the last load"""
+        stamp = self._stat()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp != self._stamp:
+                self._load(stamp)
+
+    def invalidate(self):
+        """Force a reload on the next lookup (call after writing the keys file)"""
+        with self._lock:
+            self._stamp = None
+
+    def contains(self, key):
+        self.refresh()
+        self.lookups += 1
+        return key in self._keys
+
+    def contains_many(self, keys):
+        """contains() for a batch, with one freshness check"""
+        self.refresh()
+        self.lookups += len(keys)
+        current = self._keys
+        return [k in current for k in keys]
+
+    def keys(self):
+        """Keys in file order"""
+        self.refresh()
+        return list(self._order)
+
+    def stats(self):
+        return {
+            'size': len(self._keys),
+            'reloads': self.reloads,
+            'lookups': self.lookups,
+        }
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import hashlib
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.exceptions import InvalidSignature
+except ImportError:  # HMAC tokens only
+    ed25519 = None
+
+# Signed, time-limited license tokens returned by /check, so clients and edge
+# proxies can skip the server until the token expires.
+#
+# token = base64url(claims json) "." base64url(signature)
+# claims: alg ('HS256' or 'EdDSA'), kid (key_id of the license key), dev
+# (device_hash of the device name or null), iat, exp, gen (ban-list generation
+# at issue time).
+#
+# HS256 needs the server secret to verify (edge proxies); EdDSA tokens can be
+# verified anywhere with the public key. verify() is all a client needs; this
+# file can be copied on its own.
+
+
+def key_id(key):
+    return hashlib.sha256(key.encode()).digest()[:8]
+
+def device_hash(name):
+    return hashlib.sha256((name or '').encode()).digest()[:8]
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def verify(token, secret=None, public_key=None, key=None, device=None, now=None):
+    """Claims dict if the token is authentic, unexpired and (when given)
+    issued for this key / device; otherwise None.
+
+    secret verifies HS256 tokens; public_key (Ed25519PublicKey or 32 raw
+    bytes) verifies EdDSA tokens.
+    """
+    try:
+        body, sig = token.split('.')
+        payload = _unb64(body)
+        claims = json.loads(payload)
+        sig = _unb64(sig)
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(claims, dict):
+        return None
+    alg = claims.get('alg')
+    if alg == 'HS256' and secret is not None:
+        secret = secret.encode() if isinstance(secret, str) else secret
+        if not hmac.compare_digest(sig, hmac.new(secret, payload, hashlib.sha256).digest()):
+            return None
+    elif alg == 'EdDSA' and public_key is not None and ed25519 is not None:
+        if isinstance(public_key, bytes):
+            public_key = ed25519.Ed25519PublicKey.from_public_bytes(public_key)
+        try:
+            public_key.verify(sig, payload)
+        except InvalidSignature:
+            return None
+    else:
+        return None
+    if claims.get('exp', 0) < (now if now is not None else time.time()):
+        return None
+    if key is not None and claims.get('kid') != key_id(key).hex():
+        return None
+    if device is not None and claims.get('dev') not in (None, device_hash(device).hex()):
+        return None
+    return claims
+
+
+class TokenSigner:
+    """Issues tokens with an HMAC secret or an Ed25519 private key"""
+
+    def __init__(self, secret=None, private_key=None, ttl=86400):
+        if private_key is None and not secret:
+            raise ValueError('secret or private_key required')
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.private_key = private_key
+        self.ttl = ttl
+        self.alg = 'EdDSA' if private_key is not None else 'HS256'
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+
+    def public_key_hex(self):
+        if self.private_key is None:
+            return None
+        return self.private_key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw).hex()
+
+    def issue(self, key, device=None, generation=0, now=None):
+        """(token, expires) for a key that just passed /check"""
+        now = int(now if now is not None else time.time())
+        claims = {
+            'alg': self.alg,
+            'kid': key_id(key).hex(),
+            'dev': device_hash(device).hex() if device else None,
+            'iat': now,
+            'exp': now + self.ttl,
+            'gen': generation,
+        }
+        payload = json.dumps(claims, separators=(',', ':'), sort_keys=True).encode()
+        if self.private_key is not None:
+            sig = self.private_key.sign(payload)
+        else:
+            sig = hmac.new(self.secret, payload, hashlib.sha256).digest()
+        self.issued += 1
+        return _b64(payload) + '.' + _b64(sig), claims['exp']
+
+    def verify(self, token, key=None, device=None, now=None):
+        public = self.private_key.public_key() if self.private_key is not None else None
+        claims = verify(token, secret=self.secret, public_key=public, key=key, device=device, now=now)
+        if claims is None or claims.get('alg') != self.alg:
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims
+
+    def stats(self):
+        return {'alg': self.alg, 'ttl': self.ttl, 'issued': self.issued,
+                'verified': self.verified, 'rejected': self.rejected}
+
+
+def from_env():
+    """Signer from TOKEN_ED25519_KEY (PEM file) or TOKEN_SECRET, else None (tokens off)"""
+    ttl = int(os.environ.get('TOKEN_TTL', 86400))
+    pem = os.environ.get('TOKEN_ED25519_KEY')
+    if pem:
+        if ed25519 is None:
+            raise RuntimeError('TOKEN_ED25519_KEY needs the cryptography package')
+        with open(pem, 'rb') as f:
+            return TokenSigner(private_key=serialization.load_pem_private_key(f.read(), None), ttl=ttl)
+    secret = os.environ.get('TOKEN_SECRET')
+    if secret:
+        return TokenSigner(secret=secret, ttl=ttl)
+    return None
+
+
+def main():
+    # python3 license_token.py genkey token_ed25519.pem
+    if len(sys.argv) != 3 or sys.argv[1] != 'genkey':
+        print('usage: license_token.py genkey <private-key.pem>')
+        sys.exit(2)
+    if ed25519 is None:
+        print('the cryptography package is required')
+        sys.exit(1)
+    priv = ed25519.Ed25519PrivateKey.generate()
+    pem = priv.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+    fd = os.open(sys.argv[2], os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(pem)
+    print('public key (embed in clients):', TokenSigner(private_key=priv).public_key_hex())
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 import os
+import sys
 import json
 import argparse
+import storage as storage_mod
+import key_bulk
+import digest_store
+from conn_store import file_lock
+from snapshot import Generations, publish
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 KEYS_FILE = os.path.join(APP_DIR, 'authorized_keys.json')
+GENERATIONS_FILE = os.path.join(APP_DIR, 'generations.bin')
+
+# SQLite backend when LICENSE_DB is set (same database the servers use)
+storage = storage_mod.from_env(Generations(GENERATIONS_FILE))
+
+# KEY_STORE=digest: salted digests in keys.bin instead of the plaintext list;
+# compaction runs inline since this process exits right after
+digests = None if storage else digest_store.from_env(APP_DIR, Generations(GENERATIONS_FILE), background=False)
 
 def load_keys():
     try:
@@ -14,32 +28,111 @@ def load_keys():
         return []
 
 def save_keys(keys):
-    with open(KEYS_FILE, 'w') as f:
-        json.dump(keys, f, indent=2)
+    # caller holds file_lock(KEYS_FILE); running servers see the new generation
+    publish(KEYS_FILE, keys, Generations(GENERATIONS_FILE), 'keys')
 
 def add_key(key):
-    keys = load_keys()
-    if key in keys:
-        print('exists')
+    if storage is not None:
+        print('added' if storage.add_key(key) else 'exists')
         return
-    keys.append(key)
-    save_keys(keys)
+    if digests is not None:
+        print('added' if digests.add_many([key]) else 'exists')
+        return
+    with file_lock(KEYS_FILE):
+        keys = load_keys()
+        if key in keys:
+            print('exists')
+            return
+        keys.append(key)
+        save_keys(keys)
     print('added')
 
 def remove_key(key):
-    keys = load_keys()
-    if key not in keys:
-        print('not_found')
+    if storage is not None:
+        print('removed' if storage.remove_key(key) else 'not_found')
+        return
+    if digests is not None:
+        print('removed' if digests.remove_many([key]) else 'not_found')
         return
-    keys.remove(key)
-    save_keys(keys)
+    with file_lock(KEYS_FILE):
+        keys = load_keys()
+        if key not in keys:
+            print('not_found')
+            return
+        keys.remove(key)
+        save_keys(keys)
     print('removed')
 
+def read_entries(path, fmt=None):
+    """{key: meta} and the invalid-line count from a file or stdin ('-')"""
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'lines')
+    if path == '-':
+        return key_bulk.parse(sys.stdin, fmt)
+    with open(path, 'r', newline='' if fmt == 'csv' else None) as f:
+        return key_bulk.parse(f, fmt)
+
+def import_keys(path, fmt=None):
+    entries, invalid = read_entries(path, fmt)
+    res = key_bulk.import_keys(entries, KEYS_FILE, Generations(GENERATIONS_FILE), storage, digests)
+    print('added: %d, existing: %d, invalid: %d' % (res['added'], res['existing'], invalid))
+
+def remove_keys(path, fmt=None):
+    entries, invalid = read_entries(path, fmt)
+    res = key_bulk.remove_keys(entries, KEYS_FILE, Generations(GENERATIONS_FILE), storage, digests)
+    print('removed: %d, not_found: %d, invalid: %d' % (res['removed'], res['not_found'], invalid))
+
+def export_keys(path, fmt=None):
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'lines')
+    out = sys.stdout if path == '-' else open(path, 'w', newline='')
+    try:
+        for line in key_bulk.export_keys(KEYS_FILE, storage, fmt, digests):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
 def list_keys():
-    keys = load_keys()
+    if storage is not None:
+        keys = storage.list_keys()
+    elif digests is not None:
+        keys = digests.keys()
+    else:
+        keys = load_keys()
     for k in keys:
         print(k)
 
+def convert_digests(path, delete_plaintext=False):
+    """One-shot switch to KEY_STORE=digest: build keys.bin from the JSON list
+    and re-file keys_meta.json under the digests"""
+    with file_lock(KEYS_FILE):
+        n = digest_store.convert(KEYS_FILE, path, Generations(GENERATIONS_FILE))
+        store = digest_store.DigestStore(path, background=False)
+        meta_path = key_bulk.meta_file(KEYS_FILE)
+        meta = key_bulk.load_json(meta_path, None)
+        if meta and meta_path == key_bulk.meta_file(path):
+            publish(meta_path, {store.digest(k).hex(): m for k, m in meta.items()})
+        if delete_plaintext:
+            os.remove(KEYS_FILE)
+    print('%d keys written to %s' % (n, path))
+    if not delete_plaintext:
+        print('%s still holds the plaintext keys; remove it once KEY_STORE=digest is live' % KEYS_FILE)
+
+def compact():
+    if digests is None:
+        print('compact needs KEY_STORE=digest')
+        return
+    print('%d keys in %s' % (digests.compact(), digests.path))
+
+def migrate(db_path, src_dir):
+    db = storage_mod.Storage(db_path)
+    if db.attempts(limit=1):
+        # attempt rows have no natural key, a second import would duplicate them
+        print('database already has attempts; migrate into a fresh file')
+        return
+    counts = storage_mod.migrate_json(db, src_dir)
+    for name, n in counts.items():
+        print('%s: %d' % (name, n))
+
 def main():
     p = argparse.ArgumentParser(description='Manage authorized license keys file')
     sub = p.add_subparsers(dest='cmd')
@@ -48,6 +141,22 @@ def main():
     r = sub.add_parser('remove')
     r.add_argument('key')
     l = sub.add_parser('list')
+    i = sub.add_parser('import', help='add keys from a file or stdin (one per line, or csv with a key column)')
+    i.add_argument('file', nargs='?', default='-')
+    i.add_argument('--format', choices=['lines', 'csv'], help='default: csv for *.csv, else lines')
+    rb = sub.add_parser('remove-bulk', help='remove the keys listed in a file or stdin')
+    rb.add_argument('file', nargs='?', default='-')
+    rb.add_argument('--format', choices=['lines', 'csv'])
+    e = sub.add_parser('export', help='write all keys to a file or stdout')
+    e.add_argument('file', nargs='?', default='-')
+    e.add_argument('--format', choices=['lines', 'csv'], help='csv includes metadata columns')
+    c = sub.add_parser('convert-digests', help='build the hashed key store (KEY_STORE=digest) from the JSON key list')
+    c.add_argument('--out', default=digest_store.env_path(APP_DIR), help='default: $KEY_DIGESTS or keys.bin')
+    c.add_argument('--delete-plaintext', action='store_true', help='remove authorized_keys.json afterwards')
+    sub.add_parser('compact', help='merge the digest store delta into keys.bin')
+    m = sub.add_parser('migrate', help='import the JSON files into a SQLite database (one-shot)')
+    m.add_argument('--db', default=os.environ.get('LICENSE_DB'), help='database path (default: $LICENSE_DB)')
+    m.add_argument('--src', default=APP_DIR, help='directory with the JSON files')
 
     args = p.parse_args()
     if args.cmd == 'add':
@@ -56,6 +165,20 @@ def main():
         remove_key(args.key)
     elif args.cmd == 'list':
         list_keys()
+    elif args.cmd == 'import':
+        import_keys(args.file, args.format)
+    elif args.cmd == 'remove-bulk':
+        remove_keys(args.file, args.format)
+    elif args.cmd == 'export':
+        export_keys(args.file, args.format)
+    elif args.cmd == 'convert-digests':
+        convert_digests(args.out, args.delete_plaintext)
+    elif args.cmd == 'compact':
+        compact()
+    elif args.cmd == 'migrate':
+        if not args.db:
+            p.error('migrate needs --db or LICENSE_DB')
+        migrate(args.db, args.src)
     else:
         p.print_help()
 
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+
+from conn_store import atomic_write_json, file_lock
+
+# Counters and latency histograms for /metrics (Prometheus text format).
+#
+# Each worker records into memory and writes its totals to <dir>/<pid>.json
+# every flush_interval seconds. render() sums the files of all workers; files
+# of workers that have exited are folded into _archive.json first, so totals
+# never go backwards when gunicorn recycles a worker.
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ARCHIVE = '_archive.json'
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                      for k, v in sorted(labels.items())))
+
+
+def _merge(into, data):
+    for k, v in data.get('counters', {}).items():
+        into['counters'][k] = into['counters'].get(k, 0) + v
+    for k, v in data.get('histograms', {}).items():
+        cur = into['histograms'].get(k)
+        into['histograms'][k] = v if cur is None else [a + b for a, b in zip(cur, v)]
+
+
+def _empty():
+    return {'counters': {}, 'histograms': {}}
+
+
+class Metrics:
+    """Per-process counters/histograms, aggregated across processes on render()"""
+
+    def __init__(self, dirpath, flush_interval=1.0):
+        self.dir = dirpath
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._data = _empty()
+        self._help = {}
+        self._changed = False
+        self._pid = None
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked child starts from zero; the parent's totals are in its own file
+            if self._pid is not None:
+                self._data = _empty()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, n=1, **labels):
+        self._ensure_started()
+        key = _series(name, labels)
+        with self._lock:
+            self._data['counters'][key] = self._data['counters'].get(key, 0) + n
+            self._changed = True
+
+    def observe(self, name, seconds, **labels):
+        self._ensure_started()
+        key = _series(name, labels)
+        with self._lock:
+            h = self._data['histograms'].get(key)
+            if h is None:
+                # per-bucket counts, +Inf, sum
+                h = self._data['histograms'][key] = [0] * (len(BUCKETS) + 2)
+            for i, b in enumerate(BUCKETS):
+                if seconds <= b:
+                    h[i] += 1
+                    break
+            else:
+                h[len(BUCKETS)] += 1
+            h[-1] += seconds
+            self._changed = True
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        with self._lock:
+            if not self._changed:
+                return
+            data = json.loads(json.dumps(self._data))
+            self._changed = False
+        atomic_write_json(os.path.join(self.dir, '%d.json' % os.getpid()), data)
+
+    def collect(self):
+        """Totals of every process, live and exited"""
+        self.flush()
+        total = _empty()
+        with file_lock(os.path.join(self.dir, ARCHIVE)):
+            archive_path = os.path.join(self.dir, ARCHIVE)
+            archive = _load(archive_path) or _empty()
+            dead = []
+            for fn in os.listdir(self.dir):
+                if not fn.endswith('.json') or fn == ARCHIVE or not fn[:-5].isdigit():
+                    continue
+                data = _load(os.path.join(self.dir, fn))
+                if data is None:
+                    continue
+                if _alive(int(fn[:-5])):
+                    _merge(total, data)
+                else:
+                    _merge(archive, data)
+                    dead.append(fn)
+            if dead:
+                atomic_write_json(archive_path, archive)
+                for fn in dead:
+                    os.remove(os.path.join(self.dir, fn))
+            _merge(total, archive)
+        return total
+
+    def render(self, extra=()):
+        """Prometheus text exposition; extra is [(name, kind, help, {series: value})]"""
+        data = self.collect()
+        by_name = {}
+        for key, v in data['counters'].items():
+            by_name.setdefault(key.split('{')[0], []).append((key, v))
+        lines = []
+        for name in sorted(by_name):
+            kind, text = self._help.get(name, ('counter', name))
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend('%s %s' % (k, _num(v)) for k, v in sorted(by_name[name]))
+        hists = {}
+        for key, h in data['histograms'].items():
+            name, _, labels = key.partition('{')
+            hists.setdefault(name, []).append((labels.rstrip('}'), h))
+        for name in sorted(hists):
+            lines.append('# HELP %s %s' % (name, self._help.get(name, ('histogram', name))[1]))
+            lines.append('# TYPE %s histogram' % name)
+            for labels, h in sorted(hists[name]):
+                prefix = labels + ',' if labels else ''
+                cum = 0
+                for b, n in zip(BUCKETS, h):
+                    cum += n
+                    lines.append('%s_bucket{%sle="%s"} %d' % (name, prefix, b, cum))
+                cum += h[len(BUCKETS)]
+                lines.append('%s_bucket{%sle="+Inf"} %d' % (name, prefix, cum))
+                suffix = '{%s}' % labels if labels else ''
+                lines.append('%s_sum%s %s' % (name, suffix, _num(h[-1])))
+                lines.append('%s_count%s %d' % (name, suffix, cum))
+        for name, kind, text, series in extra:
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend('%s %s' % (k, _num(v)) for k, v in sorted(series.items()))
+        return '\n'.join(lines) + '\n'
+
+
+def _load(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import math
+import time
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not POSIX; single-process use only
+    fcntl = None
+
+# Token buckets shared by all gunicorn workers.
+#
+# The buckets live in a fixed-size memory-mapped table (ratelimit.bin):
+# a header of counters followed by `slots` entries of (tag, tokens, updated).
+# An identity ("ip:1.2.3.4", "key:ABC") hashes to a slot and probes a few
+# neighbours; when they are all taken the least recently updated entry is
+# reused, so memory stays bounded and idle clients are forgotten first.
+# Each take() is a lock + a few memory reads/writes, no file or network I/O.
+
+_HEADER = struct.Struct('<8Q')
+_ENTRY = struct.Struct('<Qdd')
+PROBES = 4
+COUNTERS = ('passed', 'limited_ip', 'limited_key')
+
+
+def _tag(ident):
+    # never 0, which marks an empty slot
+    return int.from_bytes(hashlib.blake2b(ident.encode(), digest_size=8).digest(), 'little') or 1
+
+
+class SharedBuckets:
+    """Bounded table of token buckets in a file mapped by every process"""
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+        self._mm = None
+        self._fd = None
+
+    def _map(self):
+        if self._pid != os.getpid():
+            size = _HEADER.size + _ENTRY.size * self.slots
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+            self._fd = fd
+            self._pid = os.getpid()
+        return self._mm
+
+    @contextmanager
+    def _locked(self):
+        # thread lock for this process + flock against the other workers
+        with self._lock:
+            mm = self._map()
+            if fcntl is None:
+                yield mm
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield mm
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _probe(self, mm, ident, weight):
+        """(slot, tag, entry) for ident: its own slot, else the first empty one,
+        else the probed slot with the lowest weight(entry); entry is None unless
+        ident was found. Caller holds _locked()."""
+        tag = _tag(ident)
+        base = tag % self.slots
+        victim = victim_w = None
+        for i in range(PROBES):
+            s = (base + i) % self.slots
+            entry = _ENTRY.unpack_from(mm, _HEADER.size + s * _ENTRY.size)
+            if entry[0] == tag:
+                return s, tag, entry
+            if entry[0] == 0:
+                return s, tag, None
+            w = weight(entry)
+            if victim_w is None or w < victim_w:
+                victim, victim_w = s, w
+        return victim, tag, None
+
+    def _store(self, mm, slot, tag, value, updated):
+        _ENTRY.pack_into(mm, _HEADER.size + slot * _ENTRY.size, tag, value, updated)
+
+    def take(self, ident, rate, burst, cost=1.0, now=None):
+        """Remove cost tokens from ident's bucket; returns seconds to wait (0 if allowed)"""
+        now = now if now is not None else time.time()
+        with self._locked() as mm:
+            # reuse the least recently updated bucket when the probes are full
+            slot, tag, entry = self._probe(mm, ident, lambda e: e[2])
+            if entry is None:
+                tokens, updated = float(burst), now
+            else:
+                tokens, updated = entry[1], entry[2]
+            tokens = min(float(burst), tokens + max(0.0, now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._store(mm, slot, tag, tokens, now)
+        return wait
+
+    def count(self, name, n=1):
+        i = COUNTERS.index(name)
+        with self._locked() as mm:
+            off = i * 8
+            struct.pack_into('<Q', mm, off, struct.unpack_from('<Q', mm, off)[0] + n)
+
+    def counters(self):
+        values = _HEADER.unpack_from(self._map(), 0)
+        return dict(zip(COUNTERS, values))
+
+
+class RateLimiter:
+    """Per-IP and per-key token buckets; a rate of 0 disables that limit"""
+
+    def __init__(self, buckets, ip_rate=5.0, ip_burst=20, key_rate=2.0, key_burst=10):
+        self.buckets = buckets
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+
+    def check(self, ip=None, key=None, last=True):
+        """Seconds the caller should wait (rounded up), or 0 if the request may proceed.
+
+        A request checked in stages (ip before its body is read, then key)
+        passes last=False to all but the final stage, so it counts as passed once.
+        """
+        if ip and self.ip_rate:
+            wait = self.buckets.take('ip:' + ip, self.ip_rate, self.ip_burst)
+            if wait:
+                self.buckets.count('limited_ip')
+                return math.ceil(wait)
+        if key and self.key_rate:
+            wait = self.buckets.take('key:' + key, self.key_rate, self.key_burst)
+            if wait:
+                self.buckets.count('limited_key')
+                return math.ceil(wait)
+        if last:
+            self.buckets.count('passed')
+        return 0
+
+    def stats(self):
+        return dict(self.buckets.counters(), ip_rate=self.ip_rate, ip_burst=self.ip_burst,
+                    key_rate=self.key_rate, key_burst=self.key_burst, slots=self.buckets.slots)
+
+
+def from_env(app_dir):
+    """Limiter configured by RATE_* when RATE_LIMIT=1, else None.
+
+    Off by default: many clients behind one NAT or carrier-grade NAT share an
+    address, so the per-IP rate has to be sized for the deployment.
+    """
+    if os.environ.get('RATE_LIMIT', '0') != '1':
+        return None
+    buckets = SharedBuckets(os.environ.get('RATE_LIMIT_FILE', os.path.join(app_dir, 'ratelimit.bin')),
+                            slots=int(os.environ.get('RATE_LIMIT_SLOTS', 65536)))
+    return RateLimiter(
+        buckets,
+        ip_rate=float(os.environ.get('RATE_IP', 5)),
+        ip_burst=float(os.environ.get('RATE_IP_BURST', 20)),
+        key_rate=float(os.environ.get('RATE_KEY', 2)),
+        key_burst=float(os.environ.get('RATE_KEY_BURST', 10)),
+    )
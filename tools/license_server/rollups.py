@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import heapq
+import atexit
+import threading
+
+from conn_store import atomic_write_json, file_lock
+from key_index import file_stamp
+
+# Per-minute attempt counts for /admin/stats, so "top failing IPs in the last
+# hour" never has to read the attempt log.
+#
+# Each worker counts into memory and merges its buckets into <dir>/<minute>.json
+# every flush_interval seconds (under a file lock, like metrics.py). A bucket is
+#
+#   {"results": {"wrong": 12, ...},
+#    "ip": {"wrong": {"1.2.3.4": 9, ...}, ...}, "asn": {...}, "key": {...}}
+#
+# Each per-result value table keeps its max_entries largest counts; the rest
+# are summed under OTHER, so a flood of distinct guessed keys cannot grow a
+# bucket without bound. Buckets older than `retention` minutes are deleted.
+# Readers cache parsed buckets by file stamp, so a query re-reads only the
+# minutes that changed since the last one.
+
+DIMENSIONS = ('ip', 'asn', 'key')
+OTHER = '_other'
+UNKNOWN = '-'
+
+
+def _empty():
+    return {'results': {}, 'ip': {}, 'asn': {}, 'key': {}}
+
+
+def _merge(into, data):
+    for r, n in data.get('results', {}).items():
+        into['results'][r] = into['results'].get(r, 0) + n
+    for dim in DIMENSIONS:
+        for r, counts in data.get(dim, {}).items():
+            cur = into[dim].setdefault(r, {})
+            for v, n in counts.items():
+                cur[v] = cur.get(v, 0) + n
+
+
+def _trim(bucket, cap):
+    for dim in DIMENSIONS:
+        for r, counts in bucket[dim].items():
+            if len(counts) <= cap + 1:
+                continue
+            other = counts.pop(OTHER, 0)
+            keep = heapq.nlargest(cap, counts.items(), key=lambda kv: kv[1])
+            other += sum(counts.values()) - sum(n for _, n in keep)
+            bucket[dim][r] = dict(keep, **{OTHER: other})
+
+
+def _load(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def parse_window(value, default=3600):
+    """Seconds from '900', '15m', '1h' or '1d'"""
+    if not value:
+        return default
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    try:
+        if value[-1] in units:
+            return int(value[:-1]) * units[value[-1]]
+        return int(value)
+    except ValueError:
+        raise ValueError('bad window %r' % value)
+
+
+class Rollups:
+    """Per-minute counts of attempts by result, IP, ASN and key, shared by all workers"""
+
+    def __init__(self, dirpath, retention=1440, max_entries=1000, flush_interval=2.0):
+        self.dir = dirpath
+        self.retention = retention
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._pid = None
+        self._last_expire = 0
+        self.recorded = 0
+        self.flushes = 0
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked child starts empty; the parent flushes its own counts
+            self._pending = {}
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='rollup-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    def record(self, t, result, ip=None, asn=None, key=None):
+        self.record_many([(t, result, ip, asn, key)])
+
+    def record_many(self, recs):
+        """Count (time, result, ip, asn, key) tuples"""
+        self._ensure_started()
+        with self._lock:
+            for t, result, ip, asn, key in recs:
+                b = self._pending.get(int(t) // 60)
+                if b is None:
+                    b = self._pending[int(t) // 60] = _empty()
+                b['results'][result] = b['results'].get(result, 0) + 1
+                for dim, v in (('ip', ip), ('asn', asn), ('key', key)):
+                    counts = b[dim].setdefault(result, {})
+                    v = UNKNOWN if v is None else str(v)
+                    counts[v] = counts.get(v, 0) + 1
+                self.recorded += 1
+
+    def _path(self, minute):
+        return os.path.join(self.dir, '%d.json' % minute)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        """Merge this worker's counts into the shared minute files"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for minute, bucket in pending.items():
+            path = self._path(minute)
+            with file_lock(path):
+                stored = _load(path) or _empty()
+                _merge(stored, bucket)
+                _trim(stored, self.max_entries)
+                atomic_write_json(path, stored)
+        if pending:
+            self.flushes += 1
+        if time.time() - self._last_expire >= 60:
+            self._last_expire = time.time()
+            self._expire()
+
+    def _expire(self):
+        oldest = int(time.time()) // 60 - self.retention
+        for fn in os.listdir(self.dir):
+            if fn.endswith('.json') and fn[:-5].isdigit() and int(fn[:-5]) < oldest:
+                for path in (os.path.join(self.dir, fn), os.path.join(self.dir, fn + '.lock')):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def _bucket(self, minute):
+        path = self._path(minute)
+        stamp = file_stamp(path)
+        if not stamp:
+            return None
+        with self._cache_lock:
+            hit = self._cache.get(minute)
+            if hit and hit[0] == stamp:
+                return hit[1]
+        data = _load(path)
+        if data is None:
+            return None
+        with self._cache_lock:
+            self._cache[minute] = (stamp, data)
+            oldest = int(time.time()) // 60 - self.retention
+            for m in [m for m in self._cache if m < oldest]:
+                del self._cache[m]
+        return data
+
+    def query(self, window=3600, group_by='ip', result=None, limit=10, now=None):
+        """Top `limit` values of `group_by` (ip, asn, key or result) over the last
+        `window` seconds. result: one result, 'failed' (all but success) or None."""
+        if group_by not in DIMENSIONS + ('result',):
+            raise ValueError('group_by must be one of ip, asn, key, result')
+        self.flush()
+        now = int(now or time.time())
+        last = now // 60
+        minutes = max(1, min(-(-window // 60), self.retention))
+
+        def wanted(r):
+            if result is None:
+                return True
+            if result == 'failed':
+                return r != 'success'
+            return r == result
+
+        totals = {}
+        total = 0
+        for minute in range(last - minutes + 1, last + 1):
+            b = self._bucket(minute)
+            if b is None:
+                continue
+            for r, n in b['results'].items():
+                if wanted(r):
+                    total += n
+                    if group_by == 'result':
+                        totals[r] = totals.get(r, 0) + n
+            if group_by == 'result':
+                continue
+            for r, counts in b[group_by].items():
+                if wanted(r):
+                    for v, n in counts.items():
+                        totals[v] = totals.get(v, 0) + n
+        other = totals.pop(OTHER, 0)
+        top = heapq.nlargest(limit, totals.items(), key=lambda kv: kv[1])
+        return {
+            'window': minutes * 60,
+            'since': (last - minutes + 1) * 60,
+            'group_by': group_by,
+            'filter': result,
+            'total': total,
+            'distinct': len(totals),
+            'other': other,
+            'top': [{'value': v, 'count': n} for v, n in top],
+        }
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'recorded': self.recorded, 'flushes': self.flushes, 'pending_minutes': pending,
+                'cached_minutes': len(self._cache), 'retention_minutes': self.retention}
+
+
+def from_env(app_dir):
+    """Rollups under ROLLUP_DIR, or None when ROLLUPS=0"""
+    if os.environ.get('ROLLUPS', '1') != '1':
+        return None
+    return Rollups(os.environ.get('ROLLUP_DIR', os.path.join(app_dir, 'rollups')),
+                   retention=int(os.environ.get('ROLLUP_RETENTION', 1440)),
+                   max_entries=int(os.environ.get('ROLLUP_MAX_ENTRIES', 1000)))
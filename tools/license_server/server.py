@@ -1,17 +1,52 @@
 #!/usr/bin/env python3
 import os
 import json
-import threading
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 import requests
 import time
 from datetime import datetime
+from key_index import KeyIndex
+from ban_engine import BanIndex, parse_ip_ban
+import ipasn
+import asn_cache as asn_cache_mod
+from conn_store import ConnectionStore, file_lock
+from snapshot import Generations, SnapshotStamp, publish
+import storage as storage_mod
+import attempts_log as attempts_log_mod
+import udp_heartbeat
+import license_token
+import rate_limit
+import client_addr
+import metrics as metrics_mod
+import events as events_mod
+import key_bulk
+import digest_store
+import key_filter as key_filter_mod
+import rollups as rollups_mod
+import abuse as abuse_mod
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 KEYS_FILE = os.path.join(APP_DIR, 'authorized_keys.json')
+GENERATIONS_FILE = os.path.join(APP_DIR, 'generations.bin')
 ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'change-me')
 
-lock = threading.Lock()
+# Latency histograms and counters for /metrics, summed across workers
+metrics = metrics_mod.Metrics(os.environ.get('METRICS_DIR', os.path.join(APP_DIR, 'metrics')))
+metrics.describe('license_request_seconds', 'histogram', 'Request latency by route')
+metrics.describe('license_stage_seconds', 'histogram', 'Latency of internal stages')
+metrics.describe('license_requests_total', 'counter', 'Requests by route and status')
+metrics.describe('license_check_results_total', 'counter', '/check results')
+metrics.describe('license_outbound_total', 'counter', 'Outbound lookups by service and outcome')
+metrics.describe('license_key_filter_rejects_total', 'counter', '/check keys rejected by the key filter')
+
+# keys/bans JSON files are published atomically; workers compare a shared
+# generation counter to know when their cached copy is stale
+generations = Generations(GENERATIONS_FILE)
+keys_stamp = SnapshotStamp(generations, 'keys', KEYS_FILE)
+
+# SQLite backend when LICENSE_DB is set, otherwise the JSON files below; its
+# commits move the same generation counters
+storage = storage_mod.from_env(generations)
 
 def load_keys():
     try:
@@ -21,12 +56,52 @@ def load_keys():
         return []
 
 def save_keys(keys):
-    with open(KEYS_FILE, 'w') as f:
-        json.dump(keys, f, indent=2)
+    # caller holds file_lock(KEYS_FILE)
+    publish(KEYS_FILE, keys, generations, 'keys')
+    key_index.invalidate()
+
+# KEY_STORE=digest keeps only salted key digests (keys.bin), see digest_store.py
+digest_keys = None if storage else digest_store.from_env(
+    APP_DIR, generations, lambda path: SnapshotStamp(generations, 'keys', path))
+
+def key_ids(keys):
+    """Names client keys are recorded under in attempts, connections, rollups
+    and events: the salted hex digest with KEY_STORE=digest, else the key"""
+    if digest_keys is None:
+        return list(keys)
+    return [d.hex() for d in digest_keys.digest_many(keys)]
+
+def key_id(key):
+    return key_ids([key])[0]
+
+if storage:
+    key_index = storage_mod.StorageKeyIndex(storage)
+elif digest_keys is not None:
+    key_index = digest_keys
+else:
+    key_index = KeyIndex(KEYS_FILE, keys_stamp)
+
+# Bloom prefilter so guessed keys are rejected before any other work (KEY_FILTER=1)
+if storage:
+    key_filter = key_filter_mod.from_env(storage.stamp('keys'), storage.iter_keys)
+elif digest_keys is not None:
+    key_filter = key_filter_mod.from_env(digest_keys.stamp, digest_keys.iter_digests, digest_keys.digest)
+else:
+    key_filter = key_filter_mod.from_env(keys_stamp, key_index.keys)
+
+def prefilter_miss(key, ip=None):
+    """True if the key is certainly unknown; only counted, nothing else is touched"""
+    if key_filter is None or key_filter.might_contain(key):
+        return False
+    metrics.inc('license_check_results_total', result='wrong')
+    metrics.inc('license_key_filter_rejects_total')
+    count_attempts(time.time(), ip, None, [{'key': key}], ['wrong'])
+    return True
 
 CONNS_FILE = os.path.join(APP_DIR, 'connections.json')
 BANS_FILE = os.path.join(APP_DIR, 'bans.json')
 ATTEMPTS_LOG = os.path.join(APP_DIR, 'attempts.log')
+ATTEMPTS_DIR = os.path.join(APP_DIR, 'attempts')
 
 def load_json(path, default):
     try:
@@ -36,30 +111,266 @@ def load_json(path, default):
         return default
 
 def save_json(path, data):
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
+    publish(path, data)
+
+BAN_FIELDS = {'ip': 'ips', 'asn': 'asns', 'device': 'devices'}
+
+def load_bans():
+    """bans.json as {"ips", "asns", "devices"}; None if it holds something else
+    (e.g. server_extended.py's list of records in a shared APP_DIR), which is
+    neither applied nor overwritten"""
+    bans = load_json(BANS_FILE, {"ips":[], "asns":[], "devices":[]})
+    return bans if isinstance(bans, dict) else None
+
+def ban_pairs():
+    """(type, value) for every ban in bans.json"""
+    bans = load_bans() or {}
+    return [(typ, v) for typ, field in BAN_FIELDS.items() for v in bans.get(field, [])]
+
+def bans_file_error():
+    return jsonify({'result':'error', 'message':'bans.json is not a ban table (written by server_extended.py?)'}), 409
+
+# Compiled ban lists (IP/CIDR, ASN, device), rebuilt when the source changes
+if storage is not None:
+    ban_index = BanIndex(storage.ban_pairs, storage.stamp('bans'))
+else:
+    bans_stamp = SnapshotStamp(generations, 'bans', BANS_FILE)
+    ban_index = BanIndex(ban_pairs, bans_stamp)
+
+def apply_ban(typ, val, reason=''):
+    """Store a ban (typ in BAN_FIELDS) and apply it to this worker's index;
+    False if it already existed or bans.json is not ours to write"""
+    if storage is not None:
+        gen = storage.add_ban(typ, val, reason)
+        if not gen:
+            return False
+        ban_index.added(typ, val, (gen - 1, gen))
+        return True
+    with file_lock(BANS_FILE):
+        before = bans_stamp()
+        bans = load_bans()
+        if bans is None:
+            return False
+        values = bans.setdefault(BAN_FIELDS[typ], [])
+        if val in values:
+            return False
+        values.append(val)
+        publish(BANS_FILE, bans, generations, 'bans')
+        ban_index.added(typ, val, (before, bans_stamp(force=True)))
+    return True
+
+def lift_ban(typ, val):
+    """Remove a ban; False if there was none (or bans.json is not ours)"""
+    if typ not in BAN_FIELDS:
+        return False
+    if storage is not None:
+        gen = storage.remove_ban(typ, val)
+        if not gen:
+            return False
+        ban_index.removed(typ, val, (gen - 1, gen))
+        return True
+    with file_lock(BANS_FILE):
+        before = bans_stamp()
+        bans = load_bans()
+        if bans is None:
+            return False
+        values = bans.get(BAN_FIELDS[typ], [])
+        if val not in values:
+            return False
+        values.remove(val)
+        publish(BANS_FILE, bans, generations, 'bans')
+        ban_index.removed(typ, val, (before, bans_stamp(force=True)))
+    return True
+
+# Optional local IP->ASN table (ASN_DB=path). When it is loaded, lookups stay
+# offline unless ASN_REMOTE_FALLBACK=1 lets misses go to ipinfo.io.
+asn_db = ipasn.load_default()
+ASN_REMOTE_FALLBACK = os.environ.get('ASN_REMOTE_FALLBACK', '0') == '1'
+
+asn_cache = asn_cache_mod.from_env(APP_DIR)
+
+# keep-alive connection pool for ipinfo.io (HTTP_POOL_SIZE connections)
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+http = requests.Session()
+http.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE))
+# overridable so benchmarks can point lookups at a local stub
+IPINFO_URL = os.environ.get('IPINFO_URL', 'https://ipinfo.io/{ip}/json')
+
+def fetch_ipinfo(ip):
+    """Remote (asn, org, isp) lookup via ipinfo.io, None on failure"""
+    try:
+        with metrics.time('license_stage_seconds', stage='ipinfo'):
+            r = http.get(IPINFO_URL.format(ip=ip), timeout=2)
+        if r.status_code == 200:
+            data = r.json()
+            org = data.get('org')
+            asn = None
+            if org and org.startswith('AS'):
+                asn = org.split(' ')[0]
+            metrics.inc('license_outbound_total', service='ipinfo', outcome='ok')
+            return (asn, org, None)
+    except Exception:
+        pass
+    metrics.inc('license_outbound_total', service='ipinfo', outcome='failure')
+    return None
+
+def local_asn(ip):
+    """(asn, org) from the local table, or None if the remote lookup should be tried"""
+    if asn_db is None:
+        return None
+    with metrics.time('license_stage_seconds', stage='asn_local'):
+        rec = asn_db.lookup(ip)
+    if rec is not None:
+        return rec[0], (rec[0] + ' ' + rec[1]) if rec[1] else rec[0]
+    if not ASN_REMOTE_FALLBACK:
+        return None, None
+    return None
+
+def remote_asn(ip):
+    """(asn, org) via the shared cache / ipinfo.io (may block on the network)"""
+    with metrics.time('license_stage_seconds', stage='asn_cache'):
+        rec = asn_cache.get_or_fetch(ip, fetch_ipinfo)
+    if rec is None:
+        return None, None
+    return rec[0], rec[1]
+
+def lookup_asn(ip):
+    """Return (asn, org) for ip, best-effort"""
+    res = local_asn(ip)
+    return res if res is not None else remote_asn(ip)
 
 # ensure ban/connections files exist
 for p, d in ((CONNS_FILE, {}), (BANS_FILE, {"ips":[], "asns":[], "devices":[]})):
     if not os.path.exists(p):
         try:
-            save_json(p, d)
+            with file_lock(p):
+                if not os.path.exists(p):
+                    save_json(p, d)
         except Exception:
             pass
 
+# Attempts go to rotating, indexed segments under attempts/ (an old
+# attempts.log is moved in as the first segment)
+attempts_log = None
+if storage is None:
+    attempts_log = attempts_log_mod.from_env(ATTEMPTS_DIR)
+    attempts_log.import_legacy(ATTEMPTS_LOG)
+
+# Signed offline tokens from /check (TOKEN_SECRET or TOKEN_ED25519_KEY; off otherwise)
+token_signer = license_token.from_env()
+
+def ban_generation():
+    return storage.generation('bans') if storage is not None else generations.get('bans')
+
+def token_fields(key, device_name):
+    """{'token', 'expires'} to add to a successful /check, if tokens are enabled"""
+    if token_signer is None:
+        return {}
+    token, expires = token_signer.issue(key, device_name, ban_generation())
+    return {'token': token, 'expires': expires}
+
+# Client address: X-Forwarded-For only counts when set by TRUSTED_PROXIES
+trusted_proxies = client_addr.from_env()
+
+def client_ip():
+    return trusted_proxies.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
+# Per-IP / per-key token buckets shared by all workers (RATE_LIMIT=1, RATE_*)
+rate_limiter = rate_limit.from_env(APP_DIR)
+
+def rate_wait(ip=None, key=None, last=True):
+    """Seconds ip/key must wait before its next request, 0 if it may proceed
+    (last=False when a later stage of the same request checks the key)"""
+    if rate_limiter is None:
+        return 0
+    return rate_limiter.check(ip=ip, key=key, last=last)
+
+def throttled(ip=None, key=None, last=True):
+    """429 response with Retry-After if ip/key is over its rate, else None"""
+    wait = rate_wait(ip, key, last)
+    if not wait:
+        return None
+    resp = jsonify({'result':'rate_limited', 'retry_after': wait})
+    resp.headers['Retry-After'] = str(wait)
+    return resp, 429
+
+# Live event stream for /admin/events (EVENTS=1, EVENTS_*)
+events = events_mod.from_env(APP_DIR)
+
+def emit(evs):
+    """Publish event dicts to /admin/events subscribers in every worker"""
+    if events is not None and evs:
+        events.publish_many(evs)
+
+# Per-minute attempt counts for /admin/stats (ROLLUP_*; ROLLUPS=0 disables)
+rollups = rollups_mod.from_env(APP_DIR)
+
+# Automatic time-limited IP/ASN bans from failed checks (ABUSE=1, ABUSE_*)
+abuse = abuse_mod.from_env(APP_DIR, apply_ban, lift_ban, emit)
+
+def count_attempts(t, ip, asn, items, results, ids=None):
+    """Feed /check results to the stats rollups and the abuse detector"""
+    if rollups is not None:
+        ids = ids or key_ids([it['key'] for it in items])
+        rollups.record_many([(t, r, ip, asn, k) for k, r in zip(ids, results)])
+    if abuse is not None:
+        fails = [(ip, asn, it['key']) for it, r in zip(items, results) if r == 'wrong']
+        if fails:
+            abuse.observe_many(fails, t)
+
+# Largest item count accepted by /check/batch and /heartbeat/batch
+BATCH_MAX = int(os.environ.get('BATCH_MAX', 500))
+
+# Connection state lives in memory and is written behind (CONN_FLUSH_INTERVAL
+# seconds, or sooner after CONN_FLUSH_DIRTY changed keys). A session is active
+# while its last heartbeat is at most ACTIVE_WINDOW seconds old.
+conn_store_args = dict(
+    flush_interval=float(os.environ.get('CONN_FLUSH_INTERVAL', 2.0)),
+    flush_dirty=int(os.environ.get('CONN_FLUSH_DIRTY', 500)),
+    active_window=int(os.environ.get('ACTIVE_WINDOW', 5)),
+)
+if storage is not None:
+    conn_store = storage_mod.SqliteConnectionStore(storage, **conn_store_args)
+else:
+    conn_store = ConnectionStore(CONNS_FILE, **conn_store_args)
+
+# background flushes of connection state show up as the conn_flush stage
+conn_store.on_flush = lambda seconds: metrics.observe('license_stage_seconds', seconds, stage='conn_flush')
+
 app = Flask(__name__)
 
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def record_request(resp):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'started' in g:
+        metrics.observe('license_request_seconds', time.perf_counter() - g.started, route=route)
+    metrics.inc('license_requests_total', route=route, status=resp.status_code)
+    return resp
+
 # Ensure keys file exists and is valid JSON
-if not os.path.exists(KEYS_FILE):
+if digest_keys is None and not os.path.exists(KEYS_FILE):
     try:
-        with open(KEYS_FILE, 'w') as f:
-            json.dump([], f)
+        with file_lock(KEYS_FILE):
+            if not os.path.exists(KEYS_FILE):
+                save_json(KEYS_FILE, [])
     except Exception:
         pass
 
 
 @app.route('/check', methods=['GET', 'POST'])
 def check_key():
+    # Determine client IP (X-Forwarded-For from a trusted proxy) and
+    # throttle before reading the body or touching any file
+    ip = client_ip()
+    limited = throttled(ip=ip, last=False)
+    if limited:
+        return limited
+
     # Accept key via GET param, JSON body or header
     key = request.args.get('key') or request.headers.get('X-License-Key')
     if not key and request.is_json:
@@ -67,62 +378,159 @@ def check_key():
 
     if not key:
         return jsonify({'result':'error', 'message':'no key provided'}), 400
+    limited = throttled(key=key)
+    if limited:
+        return limited
+    if prefilter_miss(key, ip):
+        return jsonify({'result':'wrong'})
 
-    # Determine client IP (respect X-Forwarded-For if behind proxy)
-    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-
-    # simple ASN/org lookup
-    asn = None
-    org = None
-    try:
-        r = requests.get(f'https://ipinfo.io/{ip}/json', timeout=2)
-        if r.status_code == 200:
-            data = r.json()
-            org = data.get('org')
-            if org and org.startswith('AS'):
-                asn = org.split(' ')[0]
-    except Exception:
-        pass
-
-    # log attempt
-    t = int(time.time())
-    with open(ATTEMPTS_LOG, 'a') as f:
-        f.write(json.dumps({'time':t, 'ip':ip, 'key': key}) + "\n")
-
-    # check bans
-    bans = load_json(BANS_FILE, {"ips":[], "asns":[], "devices":[]})
-    if ip in bans.get('ips', []):
-        return jsonify({'result':'banned'})
-    if asn and asn in bans.get('asns', []):
-        return jsonify({'result':'banned'})
-
-    device_info = None
+    device_info = device_name = None
     if request.is_json:
         try:
             device_info = request.json.get('device_info') or request.json.get('device_name')
             device_name = request.json.get('device_name')
         except Exception:
             device_info = None
-    else:
-        device_name = None
-
-    # check device bans
-    if device_name and device_name in bans.get('devices', []):
-        return jsonify({'result':'banned'})
-
-    with lock:
-        keys = load_keys()
 
-    result = 'success' if key in keys else 'wrong'
-
-    # update active connections
-    conns = load_json(CONNS_FILE, {})
-    # store by key and ip
-    conns.setdefault(key, {})
-    conns[key].update({'last_seen': t, 'ip': ip, 'asn': asn, 'org': org, 'device': device_name, 'device_info': device_info})
-    save_json(CONNS_FILE, conns)
+    # simple ASN/org lookup
+    asn, org = lookup_asn(ip)
+
+    result = check(key, ip, asn, org, device_name, device_info)
+    resp = {'result': result}
+    want_token = request.args.get('token') == '1' or (request.is_json and request.json.get('token') is True)
+    if result == 'success' and want_token:
+        resp.update(token_fields(key, device_name))
+    return jsonify(resp)
+
+@app.route('/verify', methods=['POST'])
+def verify_token():
+    # { token, key, device_name? } -> valid / stale (now banned, /check again) /
+    # invalid (bad or expired token, or the key was removed)
+    if token_signer is None:
+        return jsonify({'result':'error', 'message':'tokens disabled'}), 404
+    ip = client_ip()
+    limited = throttled(ip=ip)
+    if limited:
+        return limited
+    if not request.is_json:
+        return jsonify({'result':'error', 'message':'expected json body'}), 400
+    token = request.json.get('token')
+    if not isinstance(token, str):
+        return jsonify({'result':'error', 'message':'no token'}), 400
+    key = request.json.get('key')
+    if not isinstance(key, str) or not key:
+        return jsonify({'result':'error', 'message':'no key'}), 400
+    device = request.json.get('device_name')
+    device = device if isinstance(device, str) else None
+    claims = token_signer.verify(token, key=key, device=device)
+    if claims is None or not key_index.contains_many([key])[0]:
+        return jsonify({'result':'invalid'})
+    # only bans that apply to this client make the token stale
+    asn = lookup_asn(ip)[0] if ban_index.has('asn') else None
+    if ban_index.match(ip=ip, asn=asn, device=device):
+        return jsonify({'result':'stale'})
+    return jsonify({'result':'valid', 'expires': claims['exp']})
+
+def check(key, ip, asn, org, device_name=None, device_info=None):
+    """Log the attempt, apply bans and look up the key; returns the /check result"""
+    item = {'key': key, 'device_name': device_name, 'device_info': device_info}
+    return check_many([item], ip, asn, org)[0]
+
+def check_many(items, ip, asn, org):
+    """check() for items ({key, device_name, device_info}) from one client IP.
+
+    Attempts are logged in one write, the ip/asn bans are evaluated once, keys
+    are looked up together and connection state is updated under one lock.
+    """
+    # log attempts
+    t = int(time.time())
+    ids = key_ids([it['key'] for it in items])
+    attempts = [{'time':t, 'ip':ip, 'key': k} for k in ids]
+    with metrics.time('license_stage_seconds', stage='attempts_log'):
+        if storage is not None:
+            storage.add_attempts(attempts)
+        else:
+            attempts_log.append_many(attempts)
 
-    return jsonify({'result': result})
+    # check bans
+    with metrics.time('license_stage_seconds', stage='bans'):
+        banned = ban_index.match(ip=ip, asn=asn)
+    if banned:
+        metrics.inc('license_check_results_total', len(items), result='banned')
+        count_attempts(t, ip, asn, items, ['banned'] * len(items), ids)
+        emit([{'type':'check', 'result':'banned', 'key':k, 'ip':ip, 'asn':asn,
+               'device':it.get('device_name')} for k, it in zip(ids, items)])
+        return ['banned'] * len(items)
+
+    # check device bans; only the rest reach the key lookup
+    results = [None] * len(items)
+    pending = []
+    with metrics.time('license_stage_seconds', stage='bans'):
+        for i, it in enumerate(items):
+            if it.get('device_name') and ban_index.match(device=it['device_name']):
+                results[i] = 'banned'
+            else:
+                pending.append(i)
+    with metrics.time('license_stage_seconds', stage='keys'):
+        found = key_index.contains_many([items[i]['key'] for i in pending])
+
+    # update active connections (stored by key, flushed in the background)
+    updates = {}
+    for i, ok in zip(pending, found):
+        it = items[i]
+        results[i] = 'success' if ok else 'wrong'
+        updates[ids[i]] = dict(last_seen=t, ip=ip, asn=asn, org=org,
+                                  device=it.get('device_name'), device_info=it.get('device_info'))
+    with metrics.time('license_stage_seconds', stage='conn_store'):
+        conn_store.update_many(updates)
+
+    for r in results:
+        metrics.inc('license_check_results_total', result=r)
+    count_attempts(t, ip, asn, items, results, ids)
+    emit([{'type':'check', 'result':r, 'key':k, 'ip':ip, 'asn':asn, 'device':it.get('device_name')}
+          for k, it, r in zip(ids, items, results)])
+    return results
+
+def batch_items():
+    """Validated list of batch items from the JSON body, or an error response"""
+    if not request.is_json:
+        return None, (jsonify({'result':'error', 'message':'expected json body'}), 400)
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list):
+        return None, (jsonify({'result':'error', 'message':'expected a json array'}), 400)
+    if len(items) > BATCH_MAX:
+        return None, (jsonify({'result':'error', 'message':'batch too large', 'max': BATCH_MAX}), 413)
+    return items, None
+
+@app.route('/check/batch', methods=['POST'])
+def check_batch():
+    # JSON array of { key, device_name, device_info }; one result per item
+    ip = client_ip()
+    limited = throttled(ip=ip)
+    if limited:
+        return limited
+    items, err = batch_items()
+    if err:
+        return err
+    results = [{'result':'error', 'message':'no key provided'} for _ in items]
+    valid = []
+    for i, it in enumerate(items):
+        if not isinstance(it, dict) or not isinstance(it.get('key'), str) or not it['key']:
+            continue
+        wait = rate_wait(key=it['key'], last=False)
+        if wait:
+            results[i] = {'result':'rate_limited', 'retry_after': wait}
+        elif prefilter_miss(it['key'], ip):
+            results[i] = {'result':'wrong'}
+        else:
+            valid.append(i)
+    if valid:
+        asn, org = lookup_asn(ip)
+        for i, r in zip(valid, check_many([items[i] for i in valid], ip, asn, org)):
+            results[i] = {'result': r}
+    return jsonify({'result':'ok', 'results': results})
 
 
 @app.route('/heartbeat', methods=['POST'])
@@ -130,37 +538,101 @@ def heartbeat():
     # minimal heartbeat endpoint: expects JSON { key, device_name, device_info }
     if not request.is_json:
         return jsonify({'result':'error','message':'expected json body'}), 400
+    ip = client_ip()
+    limited = throttled(ip=ip, last=False)
+    if limited:
+        return limited
     key = request.json.get('key')
     device_name = request.json.get('device_name')
     device_info = request.json.get('device_info')
     if not key:
         return jsonify({'result':'error','message':'no key'}), 400
+    limited = throttled(key=key)
+    if limited:
+        return limited
 
-    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
     t = int(time.time())
 
     # ASN lookup best-effort
-    asn = None
-    org = None
-    try:
-        r = requests.get(f'https://ipinfo.io/{ip}/json', timeout=2)
-        if r.status_code == 200:
-            data = r.json()
-            org = data.get('org')
-            if org and org.startswith('AS'):
-                asn = org.split(' ')[0]
-    except Exception:
-        pass
+    asn, org = lookup_asn(ip)
 
     # update active connections
-    with lock:
-        conns = load_json(CONNS_FILE, {})
-        conns.setdefault(key, {})
-        conns[key].update({'last_seen': t, 'ip': ip, 'asn': asn, 'org': org, 'device': device_name, 'device_info': device_info})
-        save_json(CONNS_FILE, conns)
+    kid = key_id(key)
+    conn_store.update(kid, last_seen=t, ip=ip, asn=asn, org=org, device=device_name, device_info=device_info)
+    emit([{'type':'heartbeat', 'key':kid, 'ip':ip, 'asn':asn, 'device':device_name}])
 
     return jsonify({'result':'ok'})
 
+@app.route('/heartbeat/batch', methods=['POST'])
+def heartbeat_batch():
+    # JSON array of { key, device_name, device_info }; one result per item
+    ip = client_ip()
+    limited = throttled(ip=ip)
+    if limited:
+        return limited
+    items, err = batch_items()
+    if err:
+        return err
+    t = int(time.time())
+    results = []
+    updates = {}
+    for it in items:
+        if not isinstance(it, dict) or not isinstance(it.get('key'), str) or not it['key']:
+            results.append({'result':'error', 'message':'no key'})
+            continue
+        wait = rate_wait(key=it['key'], last=False)
+        if wait:
+            results.append({'result':'rate_limited', 'retry_after': wait})
+            continue
+        updates[it['key']] = dict(last_seen=t, ip=ip, device=it.get('device_name'),
+                                  device_info=it.get('device_info'))
+        results.append({'result':'ok'})
+    if updates:
+        asn, org = lookup_asn(ip)
+        for fields in updates.values():
+            fields.update(asn=asn, org=org)
+        updates = dict(zip(key_ids(updates), updates.values()))
+        conn_store.update_many(updates)
+        emit([{'type':'heartbeat', 'key':k, 'ip':ip, 'asn':asn, 'device':f.get('device')}
+              for k, f in updates.items()])
+    return jsonify({'result':'ok', 'results': results})
+
+# extra /admin/status sections registered by other serving modes (name -> fn)
+status_sources = {}
+
+def apply_udp_beats(beats):
+    """Same state update as /heartbeat for a batch of verified UDP beats"""
+    statuses = {}
+    evs = []
+    for b in beats:
+        key, ip = b['key'], b['ip']
+        prev = conn_store.get(key)
+        if prev is not None and prev.get('ip') == ip:
+            asn, org = prev.get('asn'), prev.get('org')
+        else:
+            asn, org = lookup_asn(ip)
+        conn_store.update(key, last_seen=b['time'], ip=ip, asn=asn, org=org, device_hash=b['device_hash'])
+        if ban_index.match(ip=ip, asn=asn):
+            statuses[key] = udp_heartbeat.STATUS_BANNED
+        evs.append({'type':'heartbeat', 'key':key, 'ip':ip, 'asn':asn, 'udp':True})
+    emit(evs)
+    return statuses
+
+# Optional binary UDP heartbeat (UDP_HEARTBEAT_PORT, off by default); every
+# worker binds the port with SO_REUSEPORT
+UDP_HEARTBEAT_PORT = int(os.environ.get('UDP_HEARTBEAT_PORT', 0))
+udp = None
+if UDP_HEARTBEAT_PORT:
+    if digest_keys is not None:
+        # UDP beats are verified with an HMAC keyed by the license key itself
+        raise RuntimeError('UDP_HEARTBEAT_PORT needs the plaintext keys; not available with KEY_STORE=digest')
+    udp = udp_heartbeat.UdpHeartbeat(os.environ.get('UDP_HEARTBEAT_HOST', '0.0.0.0'), UDP_HEARTBEAT_PORT,
+                                     key_index.keys, apply_udp_beats,
+                                     batch_size=int(os.environ.get('UDP_BATCH_SIZE', 256)),
+                                     stamp=storage.stamp('keys') if storage else keys_stamp)
+    udp.start()
+    status_sources['udp'] = udp.stats
+
 def require_admin():
     token = request.headers.get('X-Admin-Token')
     if not token or token != ADMIN_TOKEN:
@@ -177,13 +649,21 @@ def admin_add():
     if not key:
         return jsonify({'result':'error', 'message':'no key'}), 400
 
-    with lock:
-        keys = load_keys()
-        if key in keys:
+    if storage is not None:
+        if not storage.add_key(key):
             return jsonify({'result':'exists'})
-        keys.append(key)
-        save_keys(keys)
-
+    elif digest_keys is not None:
+        if not digest_keys.add_many([key]):
+            return jsonify({'result':'exists'})
+    else:
+        with file_lock(KEYS_FILE):
+            keys = load_keys()
+            if key in keys:
+                return jsonify({'result':'exists'})
+            keys.append(key)
+            save_keys(keys)
+
+    emit([{'type':'key_added', 'key':key_id(key)}])
     return jsonify({'result':'added'})
 
 @app.route('/admin/remove', methods=['POST'])
@@ -196,15 +676,85 @@ def admin_remove():
     if not key:
         return jsonify({'result':'error', 'message':'no key'}), 400
 
-    with lock:
-        keys = load_keys()
-        if key not in keys:
+    if storage is not None:
+        if not storage.remove_key(key):
             return jsonify({'result':'not_found'})
-        keys.remove(key)
-        save_keys(keys)
-
+    elif digest_keys is not None:
+        if not digest_keys.remove_many([key]):
+            return jsonify({'result':'not_found'})
+    else:
+        with file_lock(KEYS_FILE):
+            keys = load_keys()
+            if key not in keys:
+                return jsonify({'result':'not_found'})
+            keys.remove(key)
+            save_keys(keys)
+
+    emit([{'type':'key_removed', 'key':key_id(key)}])
     return jsonify({'result':'removed'})
 
+# Largest number of distinct keys accepted by /admin/add-bulk and /admin/remove-bulk
+BULK_MAX = int(os.environ.get('BULK_MAX', 1000000))
+
+def bulk_entries():
+    """({key: meta}, invalid, None) from the request body, or (None, None, error response).
+
+    One key per line, or CSV with a `key` column (text/csv or ?format=csv);
+    the body is read as a stream, so it may be sent chunked.
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'lines')
+    try:
+        entries, invalid = key_bulk.parse(key_bulk.body_lines(request.stream), fmt, BULK_MAX)
+    except key_bulk.TooMany:
+        return None, None, (jsonify({'result':'error', 'message':'too many keys', 'max': BULK_MAX}), 413)
+    except ValueError as e:
+        return None, None, (jsonify({'result':'error', 'message': str(e)}), 400)
+    return entries, invalid, None
+
+@app.route('/admin/add-bulk', methods=['POST'])
+def admin_add_bulk():
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    entries, invalid, err = bulk_entries()
+    if err:
+        return err
+    if storage is not None:
+        res = key_bulk.import_keys(entries, storage=storage)
+    elif digest_keys is not None:
+        res = key_bulk.import_keys(entries, digests=digest_keys)
+    else:
+        res = key_bulk.import_keys(entries, KEYS_FILE, generations)
+        key_index.invalidate()
+    emit([{'type':'keys_imported', 'added':res['added']}])
+    return jsonify(dict(res, result='ok', invalid=invalid))
+
+@app.route('/admin/remove-bulk', methods=['POST'])
+def admin_remove_bulk():
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    entries, invalid, err = bulk_entries()
+    if err:
+        return err
+    if storage is not None:
+        res = key_bulk.remove_keys(entries, storage=storage)
+    elif digest_keys is not None:
+        res = key_bulk.remove_keys(entries, digests=digest_keys)
+    else:
+        res = key_bulk.remove_keys(entries, KEYS_FILE, generations)
+        key_index.invalidate()
+    emit([{'type':'keys_removed', 'removed':res['removed']}])
+    return jsonify(dict(res, result='ok', invalid=invalid))
+
+@app.route('/admin/export', methods=['GET'])
+def admin_export():
+    # every key, streamed (one per line, or ?format=csv with metadata columns);
+    # hex digests with KEY_STORE=digest
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    fmt = 'csv' if request.args.get('format') == 'csv' else 'lines'
+    body = key_bulk.export_keys(KEYS_FILE, storage, fmt, digest_keys)
+    return Response(body, mimetype='text/csv' if fmt == 'csv' else 'text/plain')
+
 
 @app.route('/admin/ban', methods=['POST'])
 def admin_ban():
@@ -216,22 +766,21 @@ def admin_ban():
     val = request.json.get('value')
     if not typ or not val:
         return jsonify({'result':'error', 'message':'missing type or value'}), 400
-    bans = load_json(BANS_FILE, {"ips":[], "asns":[], "devices":[]})
-    if typ == 'ip':
-        if val in bans['ips']:
-            return jsonify({'result':'exists'})
-        bans['ips'].append(val)
-    elif typ == 'asn':
-        if val in bans['asns']:
-            return jsonify({'result':'exists'})
-        bans['asns'].append(val)
-    elif typ == 'device':
-        if val in bans['devices']:
-            return jsonify({'result':'exists'})
-        bans['devices'].append(val)
-    else:
+    if typ == 'ip' and parse_ip_ban(val) is None:
+        return jsonify({'result':'error', 'message':'invalid ip or cidr'}), 400
+    if typ not in BAN_FIELDS:
         return jsonify({'result':'error', 'message':'unknown type'}), 400
-    save_json(BANS_FILE, bans)
+    if storage is None and load_bans() is None:
+        return bans_file_error()
+    # an admin ban is permanent: an auto-ban of the same value is taken over
+    # before expiry can lift it (and again if one landed in between)
+    converted = abuse is not None and abuse.forget(typ, val, 'manual_ban')
+    if not apply_ban(typ, val):
+        if converted or (abuse is not None and abuse.forget(typ, val, 'manual_ban')):
+            emit([{'type':'ban', 'ban_type':typ, 'value':val, 'converted':True}])
+            return jsonify({'result':'converted'})
+        return jsonify({'result':'exists'})
+    emit([{'type':'ban', 'ban_type':typ, 'value':val}])
     return jsonify({'result':'banned'})
 
 
@@ -243,60 +792,157 @@ def admin_unban():
         return jsonify({'result':'error', 'message':'expected json body'}), 400
     typ = request.json.get('type')
     val = request.json.get('value')
-    bans = load_json(BANS_FILE, {"ips":[], "asns":[], "devices":[]})
-    if typ == 'ip' and val in bans['ips']:
-        bans['ips'].remove(val)
-    elif typ == 'asn' and val in bans['asns']:
-        bans['asns'].remove(val)
-    elif typ == 'device' and val in bans['devices']:
-        bans['devices'].remove(val)
-    else:
+    if storage is None and load_bans() is None:
+        return bans_file_error()
+    # forgotten first, so a new auto-ban cannot be registered and then dropped
+    if abuse is not None:
+        abuse.forget(typ, val, 'manual_unban')
+    if not lift_ban(typ, val):
         return jsonify({'result':'not_found'})
-    save_json(BANS_FILE, bans)
+    emit([{'type':'unban', 'ban_type':typ, 'value':val}])
     return jsonify({'result':'unbanned'})
 
 
+@app.route('/admin/abuse', methods=['GET'])
+def admin_abuse():
+    # active automatic bans and the newest ?limit=N audit records
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    if abuse is None:
+        return jsonify({'result':'error', 'message':'abuse detection disabled'}), 404
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify({'result':'ok', 'active': abuse.active(), 'audit': abuse.audit(limit), 'stats': abuse.stats()})
+
+
 @app.route('/admin/connections', methods=['GET'])
 def admin_connections():
+    # ?state=active|stale|all (default all), ?counts=1 for just the numbers,
+    # ?since=<epoch> for only sessions seen since then (`now` is the next since)
     if not require_admin():
         return jsonify({'result':'forbidden'}), 403
-    conns = load_json(CONNS_FILE, {})
+    now = int(time.time())
+    since = request.args.get('since', type=int)
+    if request.args.get('counts') == '1':
+        return jsonify({'result':'ok', 'counts': conn_store.counts(now)})
+    state = request.args.get('state', 'all')
+    if state == 'active':
+        conns, active = conn_store.active(now), True
+    elif state == 'stale':
+        conns, active = conn_store.stale(now), False
+    elif state == 'all':
+        conns, active = conn_store.snapshot(), None
+    else:
+        return jsonify({'result':'error', 'message':'state must be active, stale or all'}), 400
     # convert timestamps to readable
     out = {}
     for k, v in conns.items():
-        vv = v.copy()
-        if 'last_seen' in vv:
-            vv['last_seen_readable'] = datetime.utcfromtimestamp(vv['last_seen']).isoformat() + 'Z'
-            # mark active if last_seen within 5 seconds
-            now = int(time.time())
-            vv['active'] = (now - vv.get('last_seen', 0)) <= 5
-        out[k] = vv
-    return jsonify({'result':'ok', 'connections': out})
+        if since is not None and v.get('last_seen', 0) < since:
+            continue
+        if 'last_seen' in v:
+            v['last_seen_readable'] = datetime.utcfromtimestamp(v['last_seen']).isoformat() + 'Z'
+            v['active'] = active if active is not None else (now - v['last_seen']) <= conn_store.sessions.window
+        out[k] = v
+    return jsonify({'result':'ok', 'connections': out, 'now': now})
 
 
 @app.route('/admin/attempts', methods=['GET'])
 def admin_attempts():
+    # paged: ?since=<epoch>&until=<epoch>&limit=N, then ?cursor=<next> for more
     if not require_admin():
         return jsonify({'result':'forbidden'}), 403
-    lines = []
+    since = request.args.get('since', type=int)
+    until = request.args.get('until', type=int)
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+    cursor = request.args.get('cursor')
+    if since is None and not cursor:
+        since = int(time.time()) - 3600
     try:
-        with open(ATTEMPTS_LOG, 'r') as f:
-            for line in f:
-                try:
-                    lines.append(json.loads(line.strip()))
-                except Exception:
-                    pass
-    except Exception:
-        pass
-    return jsonify({'result':'ok', 'attempts': lines})
+        if storage is not None:
+            lines, nxt = storage.attempts_range(since=since, until=until, limit=limit, cursor=cursor)
+        else:
+            lines, nxt = attempts_log.read(since=since, until=until, limit=limit, cursor=cursor)
+    except ValueError:
+        return jsonify({'result':'error', 'message':'bad cursor'}), 400
+    return jsonify({'result':'ok', 'attempts': lines, 'next': nxt})
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    # top values from the per-minute rollups: ?window=1h&group_by=ip|asn|key|result
+    # &filter=failed|wrong|banned|success&limit=N
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    if rollups is None:
+        return jsonify({'result':'error', 'message':'rollups disabled'}), 404
+    try:
+        window = rollups_mod.parse_window(request.args.get('window'))
+        res = rollups.query(window, request.args.get('group_by', 'ip'), request.args.get('filter'),
+                            max(1, min(request.args.get('limit', 10, type=int), 1000)))
+    except ValueError as e:
+        return jsonify({'result':'error', 'message': str(e)}), 400
+    return jsonify(dict(res, result='ok'))
 
 @app.route('/admin/list', methods=['GET'])
 def admin_list():
     if not require_admin():
         return jsonify({'result':'forbidden'}), 403
-    with lock:
-        keys = load_keys()
-    return jsonify({'result':'ok', 'keys':keys})
+    return jsonify({'result':'ok', 'keys':key_index.keys()})
+
+@app.route('/admin/events', methods=['GET'])
+def admin_events():
+    # text/event-stream of check/heartbeat/ban/unban/key_added/key_removed
+    # events; a sync worker is held for as long as the stream stays open
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    if events is None:
+        return jsonify({'result':'error', 'message':'events disabled'}), 404
+    last = request.headers.get('Last-Event-ID') or request.args.get('since')
+    sub = events.subscribe(int(last) if last and last.isdigit() else None, holds_worker=True)
+    if sub is None:
+        return jsonify({'result':'error', 'message':'too many subscribers'}), 503
+    return Response(events_mod.sse(events, sub), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    extra = []
+    cache = asn_cache.stats()
+    extra.append(('license_asn_cache_events_total', 'counter', 'Shared ASN cache events',
+                  {'license_asn_cache_events_total{event="%s"}' % k: cache.get(k, 0) for k in asn_cache_mod.COUNTERS}))
+    if rate_limiter is not None:
+        limits = rate_limiter.buckets.counters()
+        extra.append(('license_rate_limit_total', 'counter', 'Rate limiter decisions',
+                      {'license_rate_limit_total{outcome="%s"}' % k: v for k, v in limits.items()}))
+    extra.append(('license_keys', 'gauge', 'Authorized keys', {'license_keys': key_index.stats()['size']}))
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/status', methods=['GET'])
+def admin_status():
+    if not require_admin():
+        return jsonify({'result':'forbidden'}), 403
+    status = {'result':'ok', 'key_index': key_index.stats(),
+              'asn_db': asn_db.stats() if asn_db else None,
+              'asn_cache': asn_cache.stats(),
+              'conn_store': conn_store.stats(),
+              'bans': ban_index.stats(),
+              'generations': generations.stats(),
+              'attempts_log': attempts_log.stats() if attempts_log else None}
+    if token_signer is not None:
+        status['tokens'] = token_signer.stats()
+    if rate_limiter is not None:
+        status['rate_limit'] = rate_limiter.stats()
+    if events is not None:
+        status['events'] = events.stats()
+    if rollups is not None:
+        status['rollups'] = rollups.stats()
+    if abuse is not None:
+        status['abuse'] = abuse.stats()
+    if key_filter is not None:
+        status['key_filter'] = key_filter.stats()
+    for name, fn in status_sources.items():
+        status[name] = fn()
+    return jsonify(status)
 
 if __name__ == '__main__':
     # For quick testing only. Use gunicorn for production.
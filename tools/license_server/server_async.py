@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import time
+import queue
+import asyncio
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+import events as events_mod
+
+# Asyncio (ASGI) serving mode for server.py:
+#
+#   uvicorn server_async:app --host 0.0.0.0 --port 5000
+#
+# /check and /heartbeat are handled on the event loop. Remote ASN lookups run
+# on a thread pool sized to server.py's keep-alive connection pool
+# (HTTP_POOL_SIZE), and concurrent lookups for the same IP share one request.
+# Everything that may wait on a lock or the disk (rate limiter, key filter,
+# attempt logging, connection updates, events, SQLite) runs on a separate I/O
+# pool (ASYNC_IO_THREADS), so a slow provider or disk never stalls the loop.
+# Bodies are capped at ASYNC_MAX_BODY, except /admin/* requests carrying the
+# admin token, which take ASYNC_ADMIN_MAX_BODY (0 = no cap, as server.py).
+# /admin/events streams from the event loop; the rest of /admin/* and anything
+# else is passed to the Flask app unchanged, so every response matches the
+# sync server.
+
+IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', 8))
+MAX_BODY = int(os.environ.get('ASYNC_MAX_BODY', 1024 * 1024))
+ADMIN_MAX_BODY = int(os.environ.get('ASYNC_ADMIN_MAX_BODY', 0))
+EVENTS_POLL = 0.25
+
+http_pool = ThreadPoolExecutor(server.HTTP_POOL_SIZE, thread_name_prefix='asn-fetch')
+io_pool = ThreadPoolExecutor(IO_THREADS, thread_name_prefix='license-io')
+
+_inflight = {}
+counters = {'requests': 0, 'remote_lookups': 0, 'shared_lookups': 0}
+
+
+async def lookup_asn(ip):
+    """(asn, org) without blocking the loop; one remote lookup per IP at a time"""
+    res = server.local_asn(ip)
+    if res is not None:
+        return res
+    fut = _inflight.get(ip)
+    if fut is not None:
+        counters['shared_lookups'] += 1
+        return await asyncio.shield(fut)
+    fut = asyncio.get_running_loop().run_in_executor(http_pool, server.remote_asn, ip)
+    _inflight[ip] = fut
+    counters['remote_lookups'] += 1
+    try:
+        return await asyncio.shield(fut)
+    finally:
+        _inflight.pop(ip, None)
+
+
+def run_io(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(io_pool, fn, *args)
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {}
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            self.headers[name] = self.headers[name] + ',' + value if name in self.headers else value
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+        mimetype = self.headers.get('content-type', '').split(';')[0].strip().lower()
+        self.is_json = mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+        self._json = None
+
+    def json(self):
+        """Parsed JSON body (dict) or raises ValueError"""
+        if self._json is None:
+            data = json.loads(self.body or b'null')
+            if not isinstance(data, dict):
+                raise ValueError('expected a json object')
+            self._json = data
+        return self._json
+
+
+async def send_json(send, obj, status=200, headers=()):
+    body = (json.dumps(obj, separators=(',', ':'), sort_keys=True) + '\n').encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_throttled(send, wait):
+    await send_json(send, {'result': 'rate_limited', 'retry_after': wait}, 429,
+                    [(b'retry-after', str(wait).encode())])
+
+
+async def check_key(req, send):
+    ip = server.trusted_proxies.client_ip(req.remote_addr, req.headers.get('x-forwarded-for'))
+    wait = await run_io(server.rate_wait, ip, None, False)
+    if wait:
+        return await send_throttled(send, wait)
+    # Accept key via GET param, JSON body or header
+    key = req.args.get('key') or req.headers.get('x-license-key')
+    device_info = device_name = None
+    want_token = req.args.get('token') == '1'
+    if req.is_json:
+        try:
+            data = req.json()
+        except ValueError:
+            return await send_json(send, {'result': 'error', 'message': 'invalid json'}, 400)
+        key = key or data.get('key')
+        want_token = want_token or data.get('token') is True
+        device_info = data.get('device_info') or data.get('device_name')
+        device_name = data.get('device_name')
+    if not key:
+        return await send_json(send, {'result': 'error', 'message': 'no key provided'}, 400)
+    wait = await run_io(server.rate_wait, None, key)
+    if wait:
+        return await send_throttled(send, wait)
+    if await run_io(server.prefilter_miss, key, ip):
+        return await send_json(send, {'result': 'wrong'})
+    asn, org = await lookup_asn(ip)
+    result = await run_io(server.check, key, ip, asn, org, device_name, device_info)
+    resp = {'result': result}
+    if result == 'success' and want_token:
+        resp.update(server.token_fields(key, device_name))
+    await send_json(send, resp)
+
+
+async def heartbeat(req, send):
+    if not req.is_json:
+        return await send_json(send, {'result': 'error', 'message': 'expected json body'}, 400)
+    ip = server.trusted_proxies.client_ip(req.remote_addr, req.headers.get('x-forwarded-for'))
+    wait = await run_io(server.rate_wait, ip, None, False)
+    if wait:
+        return await send_throttled(send, wait)
+    try:
+        data = req.json()
+    except ValueError:
+        return await send_json(send, {'result': 'error', 'message': 'invalid json'}, 400)
+    key = data.get('key')
+    if not key:
+        return await send_json(send, {'result': 'error', 'message': 'no key'}, 400)
+    wait = await run_io(server.rate_wait, None, key)
+    if wait:
+        return await send_throttled(send, wait)
+    t = int(time.time())
+    asn, org = await lookup_asn(ip)
+    await run_io(record_heartbeat, key, t, ip, asn, org, data)
+    await send_json(send, {'result': 'ok'})
+
+
+def record_heartbeat(key, t, ip, asn, org, data):
+    # the store lock may be held by a flush, and emit() writes the shared ring
+    kid = server.key_id(key)
+    server.conn_store.update(kid, last_seen=t, ip=ip, asn=asn, org=org,
+                             device=data.get('device_name'), device_info=data.get('device_info'))
+    server.emit([{'type': 'heartbeat', 'key': kid, 'ip': ip, 'asn': asn, 'device': data.get('device_name')}])
+
+
+async def events_stream(scope, receive, send):
+    """/admin/events without holding a thread: polls the subscription queue"""
+    req = Request(scope, b'')
+    token = req.headers.get('x-admin-token')
+    if not token or token != server.ADMIN_TOKEN:
+        return await send_json(send, {'result': 'forbidden'}, 403)
+    if server.events is None:
+        return await send_json(send, {'result': 'error', 'message': 'events disabled'}, 404)
+    last = req.headers.get('last-event-id') or req.args.get('since')
+    sub = server.events.subscribe(int(last) if last and last.isdigit() else None)
+    if sub is None:
+        return await send_json(send, {'result': 'error', 'message': 'too many subscribers'}, 503)
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b'retry: 2000\n\n', 'more_body': True})
+        reported = 0
+        idle = 0.0
+        while True:
+            done, _ = await asyncio.wait([disconnected], timeout=EVENTS_POLL)
+            if done:
+                return
+            chunks = []
+            while True:
+                try:
+                    seq, ev = sub.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if sub.dropped > reported:
+                    chunks.append(events_mod.format_dropped(sub.dropped - reported))
+                    reported = sub.dropped
+                chunks.append(events_mod.format_event(seq, ev))
+            idle = 0.0 if chunks else idle + EVENTS_POLL
+            if idle >= 15.0:
+                chunks.append(events_mod.KEEPALIVE)
+                idle = 0.0
+            if chunks:
+                await send({'type': 'http.response.body', 'body': ''.join(chunks).encode(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        server.events.unsubscribe(sub)
+
+
+ROUTES = {
+    ('/check', 'GET'): check_key,
+    ('/check', 'POST'): check_key,
+    ('/heartbeat', 'POST'): heartbeat,
+}
+
+
+def call_wsgi(scope, body):
+    """Run the Flask app for one request; returns (status, headers, body)"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    result = server.app(environ, start_response)
+    try:
+        data = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started['status'], started['headers'], data
+
+
+async def wsgi_fallback(scope, body, send):
+    status, headers, data = await run_io(call_wsgi, scope, body)
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+def body_limit(scope):
+    """Largest body accepted for this request, 0 for no limit"""
+    if scope['path'].startswith('/admin/'):
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'x-admin-token' and value.decode('latin-1') == server.ADMIN_TOKEN:
+                return ADMIN_MAX_BODY
+    return MAX_BODY
+
+
+async def read_body(receive, limit=MAX_BODY):
+    chunks = []
+    size = 0
+    while True:
+        msg = await receive()
+        if msg['type'] == 'http.disconnect':
+            return None
+        chunk = msg.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            return False
+        chunks.append(chunk)
+        if not msg.get('more_body'):
+            return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    while True:
+        msg = await receive()
+        if msg['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif msg['type'] == 'lifespan.shutdown':
+            # write out pending connection state before the process exits
+            await run_io(server.conn_store.flush)
+            http_pool.shutdown(wait=False)
+            io_pool.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    body = await read_body(receive, body_limit(scope))
+    if body is None:
+        return
+    if body is False:
+        return await send_json(send, {'result': 'error', 'message': 'body too large'}, 413)
+    counters['requests'] += 1
+    if scope['path'] == '/admin/events' and scope['method'] == 'GET':
+        return await events_stream(scope, receive, send)
+    handler = ROUTES.get((scope['path'], scope['method']))
+    if handler is None:
+        return await wsgi_fallback(scope, body, send)
+    started = time.perf_counter()
+    status = {}
+
+    async def send_recorded(msg):
+        if msg['type'] == 'http.response.start':
+            status['code'] = msg['status']
+        await send(msg)
+
+    await handler(Request(scope, body), send_recorded)
+    # same series the Flask hooks record for the sync routes
+    server.metrics.observe('license_request_seconds', time.perf_counter() - started, route=scope['path'])
+    server.metrics.inc('license_requests_total', route=scope['path'], status=status.get('code', 0))
+
+
+def stats():
+    return dict(counters, inflight=len(_inflight), http_pool=server.HTTP_POOL_SIZE, io_threads=IO_THREADS)
+
+server.status_sources['async'] = stats
@@ -1,19 +1,73 @@
 #!/usr/bin/env python3
 import os
 import json
-import threading
+import time
 import requests
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
+from key_index import KeyIndex
+from ban_engine import BanIndex, parse_ip_ban
+import ipasn
+import asn_cache as asn_cache_mod
+from conn_pipeline import ConnectionPipeline
+import storage as storage_mod
+from conn_store import ConnectionStore, file_lock
+from snapshot import Generations, SnapshotStamp, publish
+from conn_history import PartitionedHistory
+import events as events_mod
+import key_bulk
+import digest_store
+import key_filter as key_filter_mod
+import rollups as rollups_mod
+import abuse as abuse_mod
+import client_addr
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
 KEYS_FILE = os.path.join(APP_DIR, 'authorized_keys.json')
 CONNECTIONS_FILE = os.path.join(APP_DIR, 'connections.json')
 FAILED_LOGINS_FILE = os.path.join(APP_DIR, 'failed_logins.json')
 BANS_FILE = os.path.join(APP_DIR, 'bans.json')
+SESSIONS_FILE = os.path.join(APP_DIR, 'sessions.json')
+HISTORY_DIR = os.path.join(APP_DIR, 'history')
+GENERATIONS_FILE = os.path.join(APP_DIR, 'generations.bin')
 ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'change-me')
 
-lock = threading.Lock()
+# keys/bans JSON files are published atomically; workers compare a shared
+# generation counter to know when their cached copy is stale
+generations = Generations(GENERATIONS_FILE)
+keys_stamp = SnapshotStamp(generations, 'keys', KEYS_FILE)
+
+# SQLite backend when LICENSE_DB is set, otherwise the JSON files above; its
+# commits move the same generation counters
+storage = storage_mod.from_env(generations)
+# KEY_STORE=digest keeps only salted key digests (keys.bin), see digest_store.py
+digest_keys = None if storage else digest_store.from_env(
+    APP_DIR, generations, lambda path: SnapshotStamp(generations, 'keys', path))
+
+def key_ids(keys):
+    """Names client keys are recorded under in history, sessions, rollups
+    and events: the salted hex digest with KEY_STORE=digest, else the key"""
+    if digest_keys is None:
+        return list(keys)
+    return [d.hex() for d in digest_keys.digest_many(keys)]
+
+def key_id(key):
+    return key_ids([key])[0]
+
+if storage:
+    key_index = storage_mod.StorageKeyIndex(storage)
+elif digest_keys is not None:
+    key_index = digest_keys
+else:
+    key_index = KeyIndex(KEYS_FILE, keys_stamp)
+
+# Bloom prefilter so guessed keys are rejected before any other work (KEY_FILTER=1)
+if storage:
+    key_filter = key_filter_mod.from_env(storage.stamp('keys'), storage.iter_keys)
+elif digest_keys is not None:
+    key_filter = key_filter_mod.from_env(digest_keys.stamp, digest_keys.iter_digests, digest_keys.digest)
+else:
+    key_filter = key_filter_mod.from_env(keys_stamp, key_index.keys)
 
 def load_json(filepath, default=None):
     try:
@@ -23,68 +77,218 @@ def load_json(filepath, default=None):
         return default if default is not None else []
 
 def save_json(filepath, data):
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2)
+    publish(filepath, data)
 
-def get_asn_info(ip):
-    """Fetch ASN info from IP using ip-api.com"""
+# Optional local IP->ASN table (ASN_DB=path); misses only go to ip-api.com
+# when ASN_REMOTE_FALLBACK=1.
+asn_db = ipasn.load_default()
+ASN_REMOTE_FALLBACK = os.environ.get('ASN_REMOTE_FALLBACK', '0') == '1'
+
+asn_cache = asn_cache_mod.from_env(APP_DIR)
+
+# overridable so benchmarks can point lookups at a local stub
+IP_API_URL = os.environ.get('IP_API_URL', 'http://ip-api.com/json/{ip}?fields=org,asn,isp')
+
+def fetch_ip_api(ip):
+    """Remote (asn, org, isp) lookup via ip-api.com, None on failure"""
     try:
-        resp = requests.get(f"http://ip-api.com/json/{ip}?fields=org,asn,isp", timeout=2)
+        resp = requests.get(IP_API_URL.format(ip=ip), timeout=2)
         if resp.status_code == 200:
             data = resp.json()
-            return {
-                "asn": data.get("asn", "N/A"),
-                "org": data.get("org", "N/A"),
-                "isp": data.get("isp", "N/A")
-            }
+            return (data.get("asn", "N/A"), data.get("org", "N/A"), data.get("isp", "N/A"))
     except Exception:
         pass
-    return {"asn": "N/A", "org": "N/A", "isp": "N/A"}
+    return None
+
+def get_asn_info(ip):
+    """Fetch ASN info from IP using the local table or ip-api.com (cached)"""
+    if asn_db is not None:
+        rec = asn_db.lookup(ip)
+        if rec is not None:
+            return {"asn": rec[0], "org": rec[1] or "N/A", "isp": rec[2] or "N/A"}
+        if not ASN_REMOTE_FALLBACK:
+            return {"asn": "N/A", "org": "N/A", "isp": "N/A"}
+    rec = asn_cache.get_or_fetch(ip, fetch_ip_api)
+    if rec is None:
+        return {"asn": "N/A", "org": "N/A", "isp": "N/A"}
+    return {"asn": rec[0], "org": rec[1], "isp": rec[2]}
+
+def load_bans():
+    """bans.json as a list of ban records; None if it holds something else
+    (e.g. server.py's {"ips", "asns", "devices"} layout in a shared APP_DIR),
+    which is neither applied nor overwritten"""
+    bans = load_json(BANS_FILE, [])
+    return bans if isinstance(bans, list) else None
+
+def ban_pairs():
+    """(type, value) for every ban in bans.json"""
+    return [(b.get("type"), b.get("value")) for b in load_bans() or [] if isinstance(b, dict)]
+
+# Compiled ban lists (IP/CIDR, key, ASN), rebuilt when the source changes
+if storage is not None:
+    ban_index = BanIndex(storage.ban_pairs, storage.stamp('bans'))
+else:
+    bans_stamp = SnapshotStamp(generations, 'bans', BANS_FILE)
+    ban_index = BanIndex(ban_pairs, bans_stamp)
 
 def is_banned(ip, key, asn):
     """Check if IP, key, or ASN is banned"""
-    bans = load_json(BANS_FILE, [])
-    for ban in bans:
-        if ban.get("type") == "ip" and ban.get("value") == ip:
-            return True
-        if ban.get("type") == "key" and ban.get("value") == key:
-            return True
-        if ban.get("type") == "asn" and ban.get("value") == asn:
-            return True
-    return False
-
-def log_connection(ip, key, device_name, device_info, success):
-    """Log connection attempt"""
-    with lock:
-        asn_info = get_asn_info(ip)
-        conn = {
-            "ip": ip,
-            "key": key,
-            "device_name": device_name or "Unknown",
-            "device_info": device_info or {},
-            "asn": asn_info.get("asn"),
-            "org": asn_info.get("org"),
-            "isp": asn_info.get("isp"),
-            "timestamp": datetime.now().isoformat(),
-            "success": success
-        }
-        
-        if success:
-            conns = load_json(CONNECTIONS_FILE, [])
-            conns.append(conn)
-            save_json(CONNECTIONS_FILE, conns)
-        else:
-            failed = load_json(FAILED_LOGINS_FILE, [])
-            failed.append(conn)
-            save_json(FAILED_LOGINS_FILE, failed)
+    return ban_index.match(ip=ip, key=key, asn=asn) is not None
+
+def apply_ban(ban_type, value, reason=''):
+    """Store a ban and apply it to this worker's index; False if it already
+    existed or bans.json is not ours to write"""
+    if storage is not None:
+        gen = storage.add_ban(ban_type, value, reason)
+        if not gen:
+            return False
+        ban_index.added(ban_type, value, (gen - 1, gen))
+        return True
+    with file_lock(BANS_FILE):
+        before = bans_stamp()
+        bans = load_bans()
+        if bans is None:
+            return False
+        for b in bans:
+            if isinstance(b, dict) and b.get('type') == ban_type and b.get('value') == value:
+                return False
+        bans.append({
+            'type': ban_type,
+            'value': value,
+            'reason': reason,
+            'timestamp': datetime.now().isoformat()
+        })
+        publish(BANS_FILE, bans, generations, 'bans')
+        ban_index.added(ban_type, value, (before, bans_stamp(force=True)))
+    return True
+
+def lift_ban(ban_type, value):
+    """Remove a ban; False if there was none (or bans.json is not ours)"""
+    if storage is not None:
+        gen = storage.remove_ban(ban_type, value)
+        if not gen:
+            return False
+        ban_index.removed(ban_type, value, (gen - 1, gen))
+        return True
+    with file_lock(BANS_FILE):
+        before = bans_stamp()
+        bans = load_bans()
+        if bans is None:
+            return False
+        kept = [b for b in bans if not (isinstance(b, dict) and b.get('type') == ban_type
+                                        and b.get('value') == value)]
+        if len(kept) == len(bans):
+            return False
+        publish(BANS_FILE, kept, generations, 'bans')
+        ban_index.removed(ban_type, value, (before, bans_stamp(force=True)))
+    return True
+
+def enrich_connection(conn):
+    """Fill in ASN fields for a queued connection event"""
+    if conn.get("asn") is None:
+        conn.update(get_asn_info(conn["ip"]))
+    return conn
+
+# Connection history is kept in hourly partitions (HISTORY_PARTITIONS of them)
+# and the latest connection per key in a session table that drops keys not
+# seen for SESSION_TTL seconds, so /admin/connections lists current sessions.
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 3600))
+HISTORY_PARTITIONS = int(os.environ.get('HISTORY_PARTITIONS', 72))
+
+if storage is not None:
+    sessions = storage_mod.SqliteConnectionStore(storage)
+    history = failed_history = None
+else:
+    sessions = ConnectionStore(SESSIONS_FILE, max_age=SESSION_TTL)
+    history = PartitionedHistory(HISTORY_DIR, 'connections', retention=HISTORY_PARTITIONS)
+    failed_history = PartitionedHistory(HISTORY_DIR, 'failed', retention=HISTORY_PARTITIONS)
+    history.import_legacy(CONNECTIONS_FILE)
+    failed_history.import_legacy(FAILED_LOGINS_FILE)
+
+# Per-minute attempt counts for /admin/stats (ROLLUP_*; ROLLUPS=0 disables)
+rollups = rollups_mod.from_env(APP_DIR)
+
+def persist_connections(batch):
+    """Append a batch of connection events to the history and session table"""
+    if abuse is not None:
+        fails = [(c["ip"], c["asn"], c["key"]) for c in batch if c["result"] == "wrong"]
+        if fails:
+            abuse.observe_many(fails)
+    # queued with the client's key; written under its recorded name
+    for c, kid in zip(batch, key_ids([c["key"] for c in batch])):
+        c["key"] = kid
+    if rollups is not None:
+        rollups.record_many([(c["last_seen"], c["result"], c["ip"], c["asn"], c["key"]) for c in batch])
+    ok = [c for c in batch if c["success"]]
+    failed = [c for c in batch if not c["success"]]
+    if storage is not None:
+        storage.add_attempts(batch)
+    else:
+        history.append(ok)
+        failed_history.append(failed)
+    for c in ok:
+        sessions.update(c["key"], ip=c["ip"], asn=c["asn"], org=c["org"], isp=c["isp"],
+                        device=c["device_name"], device_info=c["device_info"], last_seen=c["last_seen"])
+
+pipeline = ConnectionPipeline(
+    enrich_connection,
+    persist_connections,
+    workers=int(os.environ.get('LOG_WORKERS', 2)),
+    maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('LOG_BATCH_SIZE', 200)),
+    flush_interval=float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0)),
+)
+
+def log_connection(ip, key, device_name, device_info, success, asn_info=None, result=None):
+    """Queue a connection attempt for background enrichment and logging"""
+    conn = {
+        "ip": ip,
+        "key": key,
+        "device_name": device_name or "Unknown",
+        "device_info": device_info or {},
+        "asn": None,
+        "org": None,
+        "isp": None,
+        "timestamp": datetime.now().isoformat(),
+        "last_seen": int(time.time()),
+        "success": success,
+        "result": result or ("success" if success else "wrong")
+    }
+    if asn_info:
+        conn.update(asn_info)
+    pipeline.submit(conn)
+
+# Live event stream for /admin/events (EVENTS=1, EVENTS_*)
+events = events_mod.from_env(APP_DIR)
+
+def emit(evs):
+    """Publish event dicts to /admin/events subscribers in every worker"""
+    if events is not None and evs:
+        events.publish_many(evs)
+
+# Automatic time-limited IP/ASN bans from failed checks (ABUSE=1, ABUSE_*)
+abuse = abuse_mod.from_env(APP_DIR, apply_ban, lift_ban, emit)
+
+def check_result(result, ip, key, device_name, asn):
+    emit([{'type': 'check', 'result': result, 'key': key_id(key), 'ip': ip, 'asn': asn, 'device': device_name}])
+    return jsonify({'result': result})
 
 app = Flask(__name__)
 
+# Client address: X-Forwarded-For only counts when set by TRUSTED_PROXIES
+trusted_proxies = client_addr.from_env()
+
+def client_ip():
+    return trusted_proxies.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'))
+
 # Ensure files exist
-for f in [KEYS_FILE, CONNECTIONS_FILE, FAILED_LOGINS_FILE, BANS_FILE]:
+for f in [KEYS_FILE, BANS_FILE]:
+    if f == KEYS_FILE and digest_keys is not None:
+        continue
     if not os.path.exists(f):
-        with open(f, 'w') as fp:
-            json.dump([], fp)
+        with file_lock(f):
+            if not os.path.exists(f):
+                save_json(f, [])
 
 @app.route('/check', methods=['GET', 'POST'])
 def check_key():
@@ -96,28 +300,36 @@ def check_key():
     device_name = request.args.get('device_name') or (request.json.get('device_name') if request.is_json else None)
     device_info = request.args.get('device_info') or (request.json.get('device_info') if request.is_json else None)
     
-    ip = request.remote_addr
+    ip = client_ip()
     
     if not key:
         return jsonify({'result': 'error', 'message': 'no key provided'}), 400
     
-    # Check if banned
-    asn_info = get_asn_info(ip)
-    asn = asn_info.get("asn")
+    # Certainly unknown keys stop here: no ASN lookup, ban check or logging
+    if key_filter is not None and not key_filter.might_contain(key):
+        if rollups is not None:
+            rollups.record(time.time(), 'wrong', ip, None, key_id(key))
+        if abuse is not None:
+            abuse.observe(ip, None, key)
+        return jsonify({'result': 'wrong'})
+    
+    # Check if banned; the ASN is only needed on the request path when ASN
+    # bans exist, otherwise the logging pipeline looks it up later
+    asn_info = None
+    if ban_index.has("asn"):
+        asn_info = get_asn_info(ip)
+    asn = asn_info.get("asn") if asn_info else None
     if is_banned(ip, key, asn):
-        log_connection(ip, key, device_name, device_info, False)
-        return jsonify({'result': 'banned'})
+        log_connection(ip, key, device_name, device_info, False, asn_info, result='banned')
+        return check_result('banned', ip, key, device_name, asn)
     
     # Check key validity
-    with lock:
-        keys = load_json(KEYS_FILE, [])
-    
-    if key in keys:
-        log_connection(ip, key, device_name, device_info, True)
-        return jsonify({'result': 'success'})
+    if key_index.contains(key):
+        log_connection(ip, key, device_name, device_info, True, asn_info)
+        return check_result('success', ip, key, device_name, asn)
     else:
-        log_connection(ip, key, device_name, device_info, False)
-        return jsonify({'result': 'wrong'})
+        log_connection(ip, key, device_name, device_info, False, asn_info)
+        return check_result('wrong', ip, key, device_name, asn)
 
 def require_admin():
     token = request.headers.get('X-Admin-Token')
@@ -127,23 +339,87 @@ def require_admin():
 
 @app.route('/admin/connections', methods=['GET'])
 def admin_connections():
-    """List active connections"""
+    """List current sessions (latest connection per key); ?since=<epoch> for
+    only those seen since then. `now` in the reply is the next `since`."""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    now = int(time.time())
+    since = max(request.args.get('since', 0, type=int), now - SESSION_TTL)
+    if storage is not None:
+        current = storage.connections(since=since)
+    else:
+        current = {k: v for k, v in sessions.snapshot().items() if v.get('last_seen', 0) >= since}
+    active = [session_record(k, v) for k, v in current.items()]
+    active.sort(key=lambda c: c.get('last_seen', 0), reverse=True)
+    return jsonify({'result': 'ok', 'connections': active, 'now': now})
+
+def session_record(key, state):
+    """Connection-log shaped record for a session table entry"""
+    return {
+        'ip': state.get('ip'), 'key': key, 'device_name': state.get('device'),
+        'device_info': state.get('device_info'), 'asn': state.get('asn'),
+        'org': state.get('org'), 'isp': state.get('isp'),
+        'timestamp': datetime.fromtimestamp(state.get('last_seen', 0)).isoformat(),
+        'last_seen': state.get('last_seen', 0), 'success': True
+    }
+
+def list_attempts(success, log):
+    """(records, next) for the history listings.
+
+    ?since=<epoch> filters by time; otherwise the newest ?limit=N records, or
+    with ?cursor=<next from the previous reply> only the ones recorded after it.
+    """
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 10000))
+    since = request.args.get('since', type=int)
+    cursor = request.args.get('cursor')
+    if since is not None:
+        if storage is not None:
+            return storage.attempts(success=success, since=since, limit=limit), None
+        return log.read(limit=limit, since=since), None
+    if storage is not None:
+        return storage.attempts_page(success=success, cursor=cursor, limit=limit)
+    return log.page(cursor=cursor, limit=limit)
+
+@app.route('/admin/history', methods=['GET'])
+def admin_history():
+    """Newest successful connections (?limit=N, ?since=<epoch>, ?cursor=<next>)"""
     if not require_admin():
         return jsonify({'result': 'forbidden'}), 403
-    with lock:
-        conns = load_json(CONNECTIONS_FILE, [])
-    # Return only successful connections (active sessions)
-    active = [c for c in conns if c.get('success')]
-    return jsonify({'result': 'ok', 'connections': active})
+    try:
+        conns, nxt = list_attempts(True, history)
+    except ValueError:
+        return jsonify({'result': 'error', 'message': 'bad cursor'}), 400
+    return jsonify({'result': 'ok', 'connections': conns, 'next': nxt})
 
 @app.route('/admin/failed-logins', methods=['GET'])
 def admin_failed_logins():
-    """List failed login attempts"""
+    """List failed login attempts (newest ?limit=N, ?since=<epoch>, ?cursor=<next>)"""
     if not require_admin():
         return jsonify({'result': 'forbidden'}), 403
-    with lock:
-        failed = load_json(FAILED_LOGINS_FILE, [])
-    return jsonify({'result': 'ok', 'failed': failed})
+    try:
+        failed, nxt = list_attempts(False, failed_history)
+    except ValueError:
+        return jsonify({'result': 'error', 'message': 'bad cursor'}), 400
+    return jsonify({'result': 'ok', 'failed': failed, 'next': nxt})
+
+@app.route('/admin/stats', methods=['GET'])
+def admin_stats():
+    """Top IPs/ASNs/keys/results from the per-minute rollups
+    (?window=1h&group_by=ip|asn|key|result&filter=failed|wrong|banned|success&limit=N)"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    if rollups is None:
+        return jsonify({'result': 'error', 'message': 'rollups disabled'}), 404
+    try:
+        window = rollups_mod.parse_window(request.args.get('window'))
+        res = rollups.query(window, request.args.get('group_by', 'ip'), request.args.get('filter'),
+                            max(1, min(request.args.get('limit', 10, type=int), 1000)))
+    except ValueError as e:
+        return jsonify({'result': 'error', 'message': str(e)}), 400
+    return jsonify(dict(res, result='ok'))
+
+def bans_file_error():
+    return jsonify({'result': 'error', 'message': 'bans.json is not a list of bans (written by server.py?)'}), 409
 
 @app.route('/admin/ban', methods=['POST'])
 def admin_ban():
@@ -162,21 +438,21 @@ def admin_ban():
     
     if ban_type not in ['ip', 'asn', 'key']:
         return jsonify({'result': 'error', 'message': 'invalid type'}), 400
+    if ban_type == 'ip' and parse_ip_ban(value) is None:
+        return jsonify({'result': 'error', 'message': 'invalid ip or cidr'}), 400
     
-    with lock:
-        bans = load_json(BANS_FILE, [])
-        for b in bans:
-            if b.get('type') == ban_type and b.get('value') == value:
-                return jsonify({'result': 'exists'})
-        
-        bans.append({
-            'type': ban_type,
-            'value': value,
-            'reason': reason,
-            'timestamp': datetime.now().isoformat()
-        })
-        save_json(BANS_FILE, bans)
+    if storage is None and load_bans() is None:
+        return bans_file_error()
+    # an admin ban is permanent: an auto-ban of the same value is taken over
+    # before expiry can lift it (and again if one landed in between)
+    converted = abuse is not None and abuse.forget(ban_type, value, 'manual_ban')
+    if not apply_ban(ban_type, value, reason):
+        if converted or (abuse is not None and abuse.forget(ban_type, value, 'manual_ban')):
+            emit([{'type': 'ban', 'ban_type': ban_type, 'value': value, 'reason': reason, 'converted': True}])
+            return jsonify({'result': 'converted'})
+        return jsonify({'result': 'exists'})
     
+    emit([{'type': 'ban', 'ban_type': ban_type, 'value': value, 'reason': reason}])
     return jsonify({'result': 'added'})
 
 @app.route('/admin/unban', methods=['POST'])
@@ -193,20 +469,37 @@ def admin_unban():
     if not ban_type or not value:
         return jsonify({'result': 'error', 'message': 'type and value required'}), 400
     
-    with lock:
-        bans = load_json(BANS_FILE, [])
-        bans = [b for b in bans if not (b.get('type') == ban_type and b.get('value') == value)]
-        save_json(BANS_FILE, bans)
+    if storage is None and load_bans() is None:
+        return bans_file_error()
+    # forgotten first, so a new auto-ban cannot be registered and then dropped
+    if abuse is not None:
+        abuse.forget(ban_type, value, 'manual_unban')
+    if not lift_ban(ban_type, value):
+        return jsonify({'result': 'not_found'})
     
+    emit([{'type': 'unban', 'ban_type': ban_type, 'value': value}])
     return jsonify({'result': 'removed'})
 
+@app.route('/admin/abuse', methods=['GET'])
+def admin_abuse():
+    """Active automatic bans and the newest ?limit=N audit records"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    if abuse is None:
+        return jsonify({'result': 'error', 'message': 'abuse detection disabled'}), 404
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify({'result': 'ok', 'active': abuse.active(), 'audit': abuse.audit(limit), 'stats': abuse.stats()})
+
 @app.route('/admin/bans', methods=['GET'])
 def admin_bans():
     """List all bans"""
     if not require_admin():
         return jsonify({'result': 'forbidden'}), 403
-    with lock:
-        bans = load_json(BANS_FILE, [])
+    if storage is not None:
+        return jsonify({'result': 'ok', 'bans': storage.list_bans()})
+    bans = load_bans()
+    if bans is None:
+        return bans_file_error()
     return jsonify({'result': 'ok', 'bans': bans})
 
 @app.route('/admin/add', methods=['POST'])
@@ -220,13 +513,22 @@ def admin_add():
     if not key:
         return jsonify({'result': 'error', 'message': 'no key'}), 400
     
-    with lock:
-        keys = load_json(KEYS_FILE, [])
-        if key in keys:
+    if storage is not None:
+        if not storage.add_key(key):
+            return jsonify({'result': 'exists'})
+    elif digest_keys is not None:
+        if not digest_keys.add_many([key]):
             return jsonify({'result': 'exists'})
-        keys.append(key)
-        save_json(KEYS_FILE, keys)
+    else:
+        with file_lock(KEYS_FILE):
+            keys = load_json(KEYS_FILE, [])
+            if key in keys:
+                return jsonify({'result': 'exists'})
+            keys.append(key)
+            publish(KEYS_FILE, keys, generations, 'keys')
+            key_index.invalidate()
     
+    emit([{'type': 'key_added', 'key': key_id(key)}])
     return jsonify({'result': 'added'})
 
 @app.route('/admin/remove', methods=['POST'])
@@ -240,23 +542,131 @@ def admin_remove():
     if not key:
         return jsonify({'result': 'error', 'message': 'no key'}), 400
     
-    with lock:
-        keys = load_json(KEYS_FILE, [])
-        if key not in keys:
+    if storage is not None:
+        if not storage.remove_key(key):
+            return jsonify({'result': 'not_found'})
+    elif digest_keys is not None:
+        if not digest_keys.remove_many([key]):
             return jsonify({'result': 'not_found'})
-        keys.remove(key)
-        save_json(KEYS_FILE, keys)
+    else:
+        with file_lock(KEYS_FILE):
+            keys = load_json(KEYS_FILE, [])
+            if key not in keys:
+                return jsonify({'result': 'not_found'})
+            keys.remove(key)
+            publish(KEYS_FILE, keys, generations, 'keys')
+            key_index.invalidate()
     
+    emit([{'type': 'key_removed', 'key': key_id(key)}])
     return jsonify({'result': 'removed'})
 
+# Largest number of distinct keys accepted by /admin/add-bulk and /admin/remove-bulk
+BULK_MAX = int(os.environ.get('BULK_MAX', 1000000))
+
+def bulk_entries():
+    """({key: meta}, invalid, None) from the request body, or (None, None, error response).
+
+    One key per line, or CSV with a `key` column (text/csv or ?format=csv);
+    the body is read as a stream, so it may be sent chunked.
+    """
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'lines')
+    try:
+        entries, invalid = key_bulk.parse(key_bulk.body_lines(request.stream), fmt, BULK_MAX)
+    except key_bulk.TooMany:
+        return None, None, (jsonify({'result': 'error', 'message': 'too many keys', 'max': BULK_MAX}), 413)
+    except ValueError as e:
+        return None, None, (jsonify({'result': 'error', 'message': str(e)}), 400)
+    return entries, invalid, None
+
+@app.route('/admin/add-bulk', methods=['POST'])
+def admin_add_bulk():
+    """Add many keys in one commit"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    entries, invalid, err = bulk_entries()
+    if err:
+        return err
+    if storage is not None:
+        res = key_bulk.import_keys(entries, storage=storage)
+    elif digest_keys is not None:
+        res = key_bulk.import_keys(entries, digests=digest_keys)
+    else:
+        res = key_bulk.import_keys(entries, KEYS_FILE, generations)
+        key_index.invalidate()
+    emit([{'type': 'keys_imported', 'added': res['added']}])
+    return jsonify(dict(res, result='ok', invalid=invalid))
+
+@app.route('/admin/remove-bulk', methods=['POST'])
+def admin_remove_bulk():
+    """Remove many keys in one commit"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    entries, invalid, err = bulk_entries()
+    if err:
+        return err
+    if storage is not None:
+        res = key_bulk.remove_keys(entries, storage=storage)
+    elif digest_keys is not None:
+        res = key_bulk.remove_keys(entries, digests=digest_keys)
+    else:
+        res = key_bulk.remove_keys(entries, KEYS_FILE, generations)
+        key_index.invalidate()
+    emit([{'type': 'keys_removed', 'removed': res['removed']}])
+    return jsonify(dict(res, result='ok', invalid=invalid))
+
+@app.route('/admin/export', methods=['GET'])
+def admin_export():
+    """Stream every key (one per line, or ?format=csv with metadata); hex
+    digests with KEY_STORE=digest"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    fmt = 'csv' if request.args.get('format') == 'csv' else 'lines'
+    body = key_bulk.export_keys(KEYS_FILE, storage, fmt, digest_keys)
+    return Response(body, mimetype='text/csv' if fmt == 'csv' else 'text/plain')
+
 @app.route('/admin/list', methods=['GET'])
 def admin_list():
     """List all keys"""
     if not require_admin():
         return jsonify({'result': 'forbidden'}), 403
-    with lock:
-        keys = load_json(KEYS_FILE, [])
-    return jsonify({'result': 'ok', 'keys': keys})
+    return jsonify({'result': 'ok', 'keys': key_index.keys()})
+
+@app.route('/admin/events', methods=['GET'])
+def admin_events():
+    """Server-sent events: check, ban, unban, key_added, key_removed.
+    Each open stream holds a sync worker."""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    if events is None:
+        return jsonify({'result': 'error', 'message': 'events disabled'}), 404
+    last = request.headers.get('Last-Event-ID') or request.args.get('since')
+    sub = events.subscribe(int(last) if last and last.isdigit() else None, holds_worker=True)
+    if sub is None:
+        return jsonify({'result': 'error', 'message': 'too many subscribers'}), 503
+    return Response(events_mod.sse(events, sub), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/admin/status', methods=['GET'])
+def admin_status():
+    """Internal cache/index counters"""
+    if not require_admin():
+        return jsonify({'result': 'forbidden'}), 403
+    return jsonify({
+        'result': 'ok',
+        'key_index': key_index.stats(),
+        'asn_db': asn_db.stats() if asn_db else None,
+        'asn_cache': asn_cache.stats(),
+        'pipeline': pipeline.stats(),
+        'bans': ban_index.stats(),
+        'generations': generations.stats(),
+        'sessions': sessions.stats(),
+        'history': history.stats() if history else None,
+        'failed_history': failed_history.stats() if failed_history else None,
+        'events': events.stats() if events else None,
+        'key_filter': key_filter.stats() if key_filter else None,
+        'rollups': rollups.stats() if rollups else None,
+        'abuse': abuse.stats() if abuse else None
+    })
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import time
+import struct
+import threading
+
+from conn_store import atomic_write_json, file_lock
+from key_index import file_stamp
+
+# Shared state for the JSON files every gunicorn worker caches
+# (authorized_keys.json, bans.json).
+#
+# Writers take the file's lock, read-modify-write, publish the new contents
+# with write-to-temp + fsync + rename, and bump the file's counter in a small
+# mmap'd generations file. Readers never see a half-written file, and a worker
+# can tell whether its cached copy is current by reading one 8-byte counter
+# instead of parsing JSON.
+
+SLOTS = ('keys', 'bans')
+_SLOT = struct.Struct('<Q')
+
+
+class Generations:
+    """Named change counters in a small memory-mapped file shared by all processes"""
+
+    def __init__(self, path, names=SLOTS):
+        self.path = path
+        self.names = tuple(names)
+        self._lock = threading.Lock()
+        self._mm = None
+        self._pid = None
+
+    def _map(self):
+        if self._pid == os.getpid():
+            return self._mm
+        with self._lock:
+            if self._pid != os.getpid():
+                size = _SLOT.size * len(self.names)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if os.fstat(fd).st_size < size:
+                        os.ftruncate(fd, size)
+                    self._mm = mmap.mmap(fd, size)
+                finally:
+                    os.close(fd)
+                self._pid = os.getpid()
+        return self._mm
+
+    def get(self, name):
+        return _SLOT.unpack_from(self._map(), _SLOT.size * self.names.index(name))[0]
+
+    def bump(self, name):
+        """Increment name's counter and return the new value"""
+        mm = self._map()
+        off = _SLOT.size * self.names.index(name)
+        with file_lock(self.path):
+            value = _SLOT.unpack_from(mm, off)[0] + 1
+            _SLOT.pack_into(mm, off, value)
+        return value
+
+    def stats(self):
+        return {name: self.get(name) for name in self.names}
+
+
+class SnapshotStamp:
+    """Change stamp for a published file: its generation, plus a stat of the
+    file every `recheck` seconds so edits made outside publish() are noticed"""
+
+    def __init__(self, gens, name, path, recheck=5.0):
+        self.gens = gens
+        self.name = name
+        self.path = path
+        self.recheck = recheck
+        self._file = None
+        self._next = 0.0
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if force or now >= self._next:
+            self._file = file_stamp(self.path)
+            self._next = now + self.recheck
+        return (self.gens.get(self.name), self._file)
+
+
+def publish(path, data, gens=None, name=None, indent=2):
+    """Atomically replace path with data and bump its generation.
+
+    Call with file_lock(path) held around the read-modify-write.
+    """
+    atomic_write_json(path, data, indent=indent)
+    if gens is not None:
+        return gens.bump(name)
+    return 0
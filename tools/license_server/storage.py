@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+
+from conn_store import ConnectionStore
+
+# SQLite (WAL) storage for keys, bans, connection state and attempts.
+#
+# Enabled by pointing LICENSE_DB at a database file; server.py,
+# server_extended.py and manage_keys.py then use it instead of the JSON files.
+# Every table is keyed or indexed for the lookups the servers do, so point
+# reads and single-row writes stay O(log n). Import existing JSON data once
+# with `python3 manage_keys.py migrate`.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS key_meta (
+    key TEXT PRIMARY KEY,
+    meta TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bans (
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    reason TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (type, value)
+);
+CREATE TABLE IF NOT EXISTS connections (
+    key TEXT PRIMARY KEY,
+    ip TEXT,
+    asn TEXT,
+    org TEXT,
+    isp TEXT,
+    device TEXT,
+    device_info TEXT,
+    last_seen INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS connections_last_seen ON connections(last_seen);
+CREATE INDEX IF NOT EXISTS connections_ip ON connections(ip);
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    ip TEXT,
+    key TEXT,
+    success INTEGER,
+    asn TEXT,
+    org TEXT,
+    isp TEXT,
+    device_name TEXT,
+    device_info TEXT
+);
+CREATE INDEX IF NOT EXISTS attempts_time ON attempts(time);
+CREATE INDEX IF NOT EXISTS attempts_ip ON attempts(ip, time);
+CREATE INDEX IF NOT EXISTS attempts_key ON attempts(key, time);
+CREATE INDEX IF NOT EXISTS attempts_success ON attempts(success, time);
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+BAN_TYPES = ('ip', 'asn', 'key', 'device')
+
+def _dumps(v):
+    return None if v is None else json.dumps(v)
+
+def _loads(v):
+    try:
+        return json.loads(v) if v is not None else None
+    except ValueError:
+        return v
+
+def _attempt(row):
+    t, ip, key, ok, asn, org, isp, dn, di = row
+    return {
+        'time': int(t), 'timestamp': datetime.fromtimestamp(t).isoformat(),
+        'ip': ip, 'key': key, 'success': None if ok is None else bool(ok),
+        'asn': asn, 'org': org, 'isp': isp,
+        'device_name': dn, 'device_info': _loads(di),
+    }
+
+def _last_seen_range(since, before):
+    where, args = [], []
+    if since is not None:
+        where.append('last_seen >= ?')
+        args.append(since)
+    if before is not None:
+        where.append('last_seen < ?')
+        args.append(before)
+    return (' WHERE ' + ' AND '.join(where) if where else ''), args
+
+def epoch(ts):
+    """Attempt time as epoch seconds from an int/float or ISO string"""
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class Storage:
+    """Thread- and fork-safe access to the license database.
+
+    attempts_retention (seconds, 0 keeps everything) bounds the attempts
+    table; older rows are deleted in the background of add_attempts().
+    generations (a snapshot.Generations) mirrors every committed generation
+    bump, so stamp() can be polled without a query.
+    """
+
+    def __init__(self, path, attempts_retention=0, generations=None):
+        self.path = path
+        self.attempts_retention = attempts_retention
+        self.generations = generations
+        self._next_expire = 0.0
+        self._expire_lock = threading.Lock()
+        self.expired_attempts = 0
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(SCHEMA)
+        # databases created before connections.isp existed
+        if 'isp' not in [r[1] for r in db.execute('PRAGMA table_info(connections)')]:
+            db.execute('ALTER TABLE connections ADD COLUMN isp TEXT')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _tx(self, fn, *args):
+        db = self._db()
+        self._local.bumped = set()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            out = fn(db, *args)
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        if self.generations is not None:
+            for name in self._local.bumped:
+                self.generations.bump(name)
+        return out
+
+    # keys
+
+    def has_key(self, key):
+        return self._db().execute('SELECT 1 FROM keys WHERE key = ?', (key,)).fetchone() is not None
+
+    def existing_keys(self, keys):
+        """Subset of keys that are authorized (one query per 500 keys)"""
+        keys = list(keys)
+        found = set()
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            sql = 'SELECT key FROM keys WHERE key IN (%s)' % ','.join('?' * len(chunk))
+            found.update(r[0] for r in self._db().execute(sql, chunk))
+        return found
+
+    def list_keys(self):
+        return list(self.iter_keys())
+
+    def iter_keys(self):
+        for (key,) in self._db().execute('SELECT key FROM keys ORDER BY created, rowid'):
+            yield key
+
+    def add_key(self, key):
+        """True if added, False if it already existed"""
+        return self.add_keys([key]) == 1
+
+    def add_keys(self, keys):
+        """Insert many keys in one transaction; returns how many were new"""
+        now = time.time()
+        def run(db):
+            before = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO keys(key, created) VALUES (?, ?)', ((k, now) for k in keys))
+            added = db.total_changes - before
+            if added:
+                self._bump(db, 'keys')
+            return added
+        return self._tx(run)
+
+    def remove_key(self, key):
+        """True if removed, False if it was not present"""
+        return self.remove_keys([key]) == 1
+
+    def remove_keys(self, keys):
+        keys = list(keys)
+        def run(db):
+            before = db.total_changes
+            db.executemany('DELETE FROM keys WHERE key = ?', ((k,) for k in keys))
+            removed = db.total_changes - before
+            db.executemany('DELETE FROM key_meta WHERE key = ?', ((k,) for k in keys))
+            if removed:
+                self._bump(db, 'keys')
+            return removed
+        return self._tx(run)
+
+    def set_key_meta(self, meta):
+        """Store {key: metadata dict} (replacing earlier metadata)"""
+        self._tx(lambda db: db.executemany('INSERT OR REPLACE INTO key_meta(key, meta) VALUES (?, ?)',
+                                           ((k, json.dumps(m)) for k, m in meta.items())))
+
+    def key_meta(self):
+        return {k: _loads(m) for k, m in self._db().execute('SELECT key, meta FROM key_meta')}
+
+    def count_keys(self):
+        return self._db().execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+    # bans
+
+    def ban_pairs(self):
+        return self._db().execute('SELECT type, value FROM bans').fetchall()
+
+    def generation(self, name):
+        """Counter bumped in the same transaction as every change to `name`"""
+        row = self._db().execute('SELECT value FROM generations WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def stamp(self, name, recheck=1.0):
+        """Cheap change stamp for generation(name), see GenerationStamp"""
+        return GenerationStamp(self, name, recheck)
+
+    def _bump(self, db, name):
+        self._local.bumped.add(name)
+        db.execute('INSERT INTO generations(name, value) VALUES (?, 1) '
+                   'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+        return db.execute('SELECT value FROM generations WHERE name = ?', (name,)).fetchone()[0]
+
+    def list_bans(self):
+        rows = self._db().execute('SELECT type, value, reason, timestamp FROM bans ORDER BY rowid')
+        return [{'type': t, 'value': v, 'reason': r or '', 'timestamp': ts} for t, v, r, ts in rows]
+
+    def add_ban(self, ban_type, value, reason='', timestamp=None):
+        """New 'bans' generation if added, 0 if the ban already existed"""
+        def run(db):
+            cur = db.execute(
+                'INSERT OR IGNORE INTO bans(type, value, reason, timestamp) VALUES (?, ?, ?, ?)',
+                (ban_type, value, reason, timestamp or datetime.now().isoformat()))
+            return self._bump(db, 'bans') if cur.rowcount == 1 else 0
+        return self._tx(run)
+
+    def remove_ban(self, ban_type, value):
+        """New 'bans' generation if removed, 0 if there was no such ban"""
+        def run(db):
+            cur = db.execute('DELETE FROM bans WHERE type = ? AND value = ?', (ban_type, value))
+            return self._bump(db, 'bans') if cur.rowcount == 1 else 0
+        return self._tx(run)
+
+    # connection state (latest per key)
+
+    def upsert_connections(self, conns):
+        """Write key -> state, keeping whichever copy has the newest last_seen"""
+        rows = [(k, v.get('ip'), v.get('asn'), v.get('org'), v.get('isp'), v.get('device'),
+                 _dumps(v.get('device_info')), int(v.get('last_seen') or 0))
+                for k, v in conns.items()]
+        def run(db):
+            db.executemany(
+                'INSERT INTO connections(key, ip, asn, org, isp, device, device_info, last_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET ip = excluded.ip, asn = excluded.asn, '
+                'org = excluded.org, isp = excluded.isp, device = excluded.device, '
+                'device_info = excluded.device_info, last_seen = excluded.last_seen '
+                'WHERE excluded.last_seen >= connections.last_seen',
+                rows)
+        if rows:
+            self._tx(run)
+
+    def connections(self, since=None, before=None):
+        """key -> state, optionally only sessions seen at or after `since` / before `before`"""
+        sql = 'SELECT key, ip, asn, org, isp, device, device_info, last_seen FROM connections'
+        where, args = _last_seen_range(since, before)
+        sql += where
+        return {k: {'last_seen': ls, 'ip': ip, 'asn': asn, 'org': org, 'isp': isp, 'device': dev,
+                    'device_info': _loads(di)}
+                for k, ip, asn, org, isp, dev, di, ls in self._db().execute(sql, args)}
+
+    def connection(self, key):
+        """State of one key, or None (a primary key lookup)"""
+        row = self._db().execute('SELECT ip, asn, org, isp, device, device_info, last_seen FROM connections '
+                                 'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        ip, asn, org, isp, dev, di, ls = row
+        return {'last_seen': ls, 'ip': ip, 'asn': asn, 'org': org, 'isp': isp, 'device': dev,
+                'device_info': _loads(di)}
+
+    def count_connections(self, since=None, before=None):
+        where, args = _last_seen_range(since, before)
+        return self._db().execute('SELECT COUNT(*) FROM connections' + where, args).fetchone()[0]
+
+    # attempts / connection history
+
+    def add_attempts(self, attempts):
+        """Append attempt dicts (server.py log lines or server_extended.py events)"""
+        rows = [(epoch(a.get('time', a.get('timestamp'))), a.get('ip'), a.get('key'),
+                 None if a.get('success') is None else int(bool(a['success'])),
+                 a.get('asn'), a.get('org'), a.get('isp'), a.get('device_name'),
+                 _dumps(a.get('device_info')))
+                for a in attempts]
+        if rows:
+            self._tx(lambda db: db.executemany(
+                'INSERT INTO attempts(time, ip, key, success, asn, org, isp, device_name, device_info) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows))
+        if self.attempts_retention and time.monotonic() >= self._next_expire:
+            self._schedule_expire()
+
+    def _schedule_expire(self):
+        with self._expire_lock:
+            if time.monotonic() < self._next_expire:
+                return
+            self._next_expire = time.monotonic() + 60
+        threading.Thread(target=self.expire_attempts, name='attempts-expire', daemon=True).start()
+
+    def expire_attempts(self, now=None, chunk=10000):
+        """Delete attempts older than attempts_retention; returns how many.
+        Runs in chunks so writers are never blocked for long."""
+        if not self.attempts_retention:
+            return 0
+        cutoff = (now if now is not None else time.time()) - self.attempts_retention
+        total = 0
+        while True:
+            n = self._tx(lambda db: db.execute(
+                'DELETE FROM attempts WHERE id IN (SELECT id FROM attempts WHERE time < ? LIMIT ?)',
+                (cutoff, chunk)).rowcount)
+            total += n
+            if n < chunk:
+                break
+        self.expired_attempts += total
+        return total
+
+    def attempts(self, success=None, since=None, until=None, limit=None, first=None):
+        """Attempts oldest-first in server_extended.py's record format.
+
+        limit keeps the newest N matching rows, first the oldest N.
+        """
+        sql = 'SELECT time, ip, key, success, asn, org, isp, device_name, device_info FROM attempts'
+        where, args = [], []
+        if success is not None:
+            where.append('success = ?')
+            args.append(int(success))
+        if since is not None:
+            where.append('time >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('time <= ?')
+            args.append(until)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if limit:
+            # newest `limit` rows, still returned oldest-first
+            sql = 'SELECT * FROM (%s ORDER BY id DESC LIMIT ?) ORDER BY time' % sql
+            args.append(limit)
+        elif first:
+            sql += ' ORDER BY time, id LIMIT ?'
+            args.append(first)
+        else:
+            sql += ' ORDER BY id'
+        return [_attempt(row) for row in self._db().execute(sql, args)]
+
+    def attempts_range(self, since=None, until=None, limit=1000, cursor=None):
+        """One page of attempts with since <= time <= until, oldest first, in
+        server.py's {time, ip, key} format. Returns (attempts, next_cursor).
+
+        The cursor is "<time>:<id>" of the last row returned, so pages stay
+        exact when many attempts share a second. Past the last row the cursor
+        stays put (for tailing); it is None once `until` has been reached.
+        """
+        where, args = [], []
+        if cursor:
+            t, _, rowid = cursor.rpartition(':')
+            t, rowid = float(t), int(rowid)
+            where.append('(time > ? OR (time = ? AND id > ?))')
+            args += [t, t, rowid]
+        elif since is not None:
+            where.append('time >= ?')
+            args.append(since)
+        if until is not None:
+            where.append('time <= ?')
+            args.append(until)
+        sql = 'SELECT id, time, ip, key FROM attempts'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        rows = self._db().execute(sql + ' ORDER BY time, id LIMIT ?', args + [limit]).fetchall()
+        out = [{'time': int(t), 'ip': ip, 'key': key} for _, t, ip, key in rows]
+        if rows:
+            nxt = '%r:%d' % (rows[-1][1], rows[-1][0])
+        else:
+            nxt = cursor
+        if until is not None and len(rows) < limit:
+            nxt = None
+        return out, nxt
+
+    def attempts_page(self, success=None, cursor=None, limit=1000):
+        """(attempts, next_cursor) for incremental readers; the cursor is a row id.
+
+        Without a cursor: the newest `limit` attempts. With one: up to `limit`
+        attempts inserted after it, oldest first.
+        """
+        db = self._db()
+        top = db.execute('SELECT MAX(id) FROM attempts').fetchone()[0] or 0
+        cols = 'id, time, ip, key, success, asn, org, isp, device_name, device_info'
+        filt, args = '', []
+        if success is not None:
+            filt = ' AND success = ?'
+            args.append(int(success))
+        if cursor is None:
+            rows = db.execute('SELECT %s FROM attempts WHERE id <= ?%s ORDER BY id DESC LIMIT ?' % (cols, filt),
+                              [top] + args + [limit]).fetchall()[::-1]
+            return [_attempt(r[1:]) for r in rows], top
+        rows = db.execute('SELECT %s FROM attempts WHERE id > ? AND id <= ?%s ORDER BY id LIMIT ?' % (cols, filt),
+                          [int(cursor), top] + args + [limit]).fetchall()
+        nxt = rows[-1][0] if len(rows) == limit else top
+        return [_attempt(r[1:]) for r in rows], nxt
+
+
+class GenerationStamp:
+    """Change stamp for a generation polled on every request: the mirrored
+    counter in generations.bin (moved after each commit made through a Storage
+    that has it) plus the database value, re-read every `recheck` seconds so
+    writers without the mirror are noticed too"""
+
+    def __init__(self, storage, name, recheck=1.0):
+        self.storage = storage
+        self.name = name
+        self.recheck = recheck
+        self._value = None
+        self._next = 0.0
+
+    def __call__(self, force=False):
+        now = time.monotonic()
+        if force or now >= self._next:
+            self._value = self.storage.generation(self.name)
+            self._next = now + self.recheck
+        gens = self.storage.generations
+        return (gens.get(self.name) if gens is not None else None, self._value)
+
+
+class StorageKeyIndex:
+    """KeyIndex-compatible view of the keys table (lookups hit the primary key index)"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.lookups = 0
+
+    def refresh(self):
+        pass
+
+    def invalidate(self):
+        pass
+
+    def contains(self, key):
+        self.lookups += 1
+        return self.storage.has_key(key)
+
+    def contains_many(self, keys):
+        self.lookups += len(keys)
+        found = self.storage.existing_keys(keys)
+        return [k in found for k in keys]
+
+    def keys(self):
+        return self.storage.list_keys()
+
+    def stats(self):
+        return {'backend': 'sqlite', 'size': self.storage.count_keys(), 'reloads': 0, 'lookups': self.lookups}
+
+
+class SqliteConnectionStore(ConnectionStore):
+    """ConnectionStore that writes behind into the connections table"""
+
+    def __init__(self, storage, flush_interval=2.0, flush_dirty=500, max_age=0, active_window=5):
+        self.storage = storage
+        super().__init__(storage.path, flush_interval, flush_dirty, max_age, active_window)
+
+    def _read_disk(self):
+        # nothing to preload; reads go to the table
+        return {}
+
+    def _write(self, dirty):
+        self.storage.upsert_connections(dirty)
+        return dirty
+
+    def _refresh(self, merged):
+        with self._lock:
+            # flushed keys live in the table now
+            for k in merged:
+                if k not in self._dirty:
+                    self._conns.pop(k, None)
+
+    def get(self, key):
+        cur = super().get(key)
+        if cur is not None:
+            return cur
+        return self.storage.connection(key)
+
+    def snapshot(self):
+        out = self.storage.connections()
+        out.update(super().snapshot())
+        return out
+
+    # every worker's sessions are in the table; last_seen is indexed, so these
+    # stay proportional to the rows asked for
+
+    def _cutoff(self, now):
+        return (now if now is not None else time.time()) - self.sessions.window
+
+    def active(self, now=None):
+        out = self.storage.connections(since=self._cutoff(now))
+        out.update(super().active(now))
+        return out
+
+    def stale(self, now=None):
+        out = self.storage.connections(before=self._cutoff(now))
+        live = super().active(now)
+        for k in live:
+            out.pop(k, None)
+        return out
+
+    def counts(self, now=None):
+        # stale is as of the last flush
+        cutoff = self._cutoff(now)
+        active = set(self.storage.connections(since=cutoff))
+        active.update(super().active(now))
+        stale = self.storage.count_connections(before=cutoff)
+        return {'active': len(active), 'stale': stale, 'total': len(active) + stale}
+
+
+def from_env(generations=None):
+    """Storage named by LICENSE_DB, or None to keep using the JSON files"""
+    path = os.environ.get('LICENSE_DB')
+    if not path:
+        return None
+    return Storage(path, attempts_retention=int(os.environ.get('ATTEMPTS_RETENTION_DAYS', 30)) * 86400,
+                   generations=generations)
+
+def migrate_json(storage, app_dir):
+    """One-shot import of the JSON/log files in app_dir; returns per-table counts"""
+    def load(name, default):
+        try:
+            with open(os.path.join(app_dir, name), 'r') as f:
+                return json.load(f)
+        except Exception:
+            return default
+
+    counts = {}
+    keys = load('authorized_keys.json', [])
+    counts['keys'] = storage.add_keys([k for k in keys if isinstance(k, str) and k] if isinstance(keys, list) else [])
+
+    bans = load('bans.json', [])
+    n = 0
+    if isinstance(bans, dict):
+        # server.py layout: {"ips": [...], "asns": [...], "devices": [...]}
+        for field, typ in (('ips', 'ip'), ('asns', 'asn'), ('devices', 'device'), ('keys', 'key')):
+            for v in bans.get(field, []):
+                n += bool(storage.add_ban(typ, v))
+    elif isinstance(bans, list):
+        for b in bans:
+            if isinstance(b, dict) and b.get('type') in BAN_TYPES and b.get('value'):
+                n += bool(storage.add_ban(b['type'], b['value'], b.get('reason', ''), b.get('timestamp')))
+    counts['bans'] = n
+
+    conns = load('connections.json', {})
+    if isinstance(conns, dict):
+        conns = {k: v for k, v in conns.items() if isinstance(v, dict)}
+        storage.upsert_connections(conns)
+        counts['connections'] = len(conns)
+    elif isinstance(conns, list):
+        # server_extended.py history list: successful checks (skip null/garbage entries)
+        conns = [c for c in conns if isinstance(c, dict)]
+        for c in conns:
+            c.setdefault('success', True)
+        storage.add_attempts(conns)
+        latest = {}
+        for c in conns:
+            if c.get('key'):
+                latest[c['key']] = {'ip': c.get('ip'), 'asn': c.get('asn'), 'org': c.get('org'),
+                                    'isp': c.get('isp'), 'device': c.get('device_name'),
+                                    'device_info': c.get('device_info'),
+                                    'last_seen': int(epoch(c.get('timestamp')))}
+        storage.upsert_connections(latest)
+        counts['connections'] = len(latest)
+        counts['history'] = len(conns)
+
+    failed = load('failed_logins.json', [])
+    failed = [f for f in failed if isinstance(f, dict)] if isinstance(failed, list) else []
+    for f in failed:
+        f['success'] = False
+    storage.add_attempts(failed)
+    counts['failed_logins'] = len(failed)
+
+    n = 0
+    batch = []
+    try:
+        with open(os.path.join(app_dir, 'attempts.log'), 'r') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict):
+                    continue
+                batch.append(rec)
+                if len(batch) >= 10000:
+                    storage.add_attempts(batch)
+                    n += len(batch)
+                    batch = []
+    except OSError:
+        pass
+    storage.add_attempts(batch)
+    counts['attempts'] = n + len(batch)
+    return counts
@@ -0,0 +1,43 @@
+import os
+import sys
+import shutil
+import importlib
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the server modules import each other by flat name (python3 server.py / gunicorn server:app)
+sys.path.insert(0, SERVER_DIR)
+
+SERVER_MODULES = ('server', 'server_async', 'server_extended')
+
+
+@pytest.fixture
+def load_server(tmp_path, monkeypatch):
+    """load_server(name='server', **env) imports a fresh copy of a server module.
+
+    The copy lives in tmp_path, so its APP_DIR (keys, bans, logs, .bin files)
+    is the test's directory and never the source tree. Remote ASN lookups
+    fail fast and rate limiting is off unless env says otherwise.
+    """
+    pytest.importorskip('flask')
+    pytest.importorskip('requests')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for name in SERVER_MODULES:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    monkeypatch.setenv('ADMIN_TOKEN', 'secret')
+    monkeypatch.setenv('IPINFO_URL', 'http://127.0.0.1:9/{ip}')
+    monkeypatch.setenv('RATE_LIMIT', '0')
+    for var in ('LICENSE_DB', 'KEY_STORE', 'ASN_DB', 'UDP_HEARTBEAT_PORT'):
+        monkeypatch.delenv(var, raising=False)
+
+    def load(name='server', **env):
+        for k, v in env.items():
+            monkeypatch.setenv(k, str(v))
+        for mod in SERVER_MODULES:
+            shutil.copy(os.path.join(SERVER_DIR, mod + '.py'), str(tmp_path))
+        return importlib.import_module(name)
+
+    return load
+
@@ -0,0 +1,138 @@
+import os
+import json
+import math
+
+import pytest
+
+from abuse import AbuseDetector, DecayedCounters
+
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def make(tmp_path, **kw):
+    store = set()
+
+    def ban(typ, value, reason=''):
+        if (typ, value) in store:
+            return False
+        store.add((typ, value))
+        return True
+
+    def unban(typ, value):
+        if (typ, value) not in store:
+            return False
+        store.discard((typ, value))
+        return True
+
+    counters = DecayedCounters(str(tmp_path / 'abuse.bin'), slots=64)
+    det = AbuseDetector(counters, str(tmp_path / 'autobans.json'), str(tmp_path / 'abuse_audit.log'),
+                        ban, unban, **kw)
+    det._pid = os.getpid()  # no background expiry thread
+    return det, store
+
+
+def test_decayed_counts(tmp_path):
+    c = DecayedCounters(str(tmp_path / 'abuse.bin'), slots=64)
+    assert c.hit('ip:a', 60, now=1000) == 1
+    assert c.hit('ip:a', 60, now=1000) == 2
+    assert math.isclose(c.hit('ip:a', 60, now=1060), 2 * math.exp(-1) + 1)
+    c.reset('ip:a')
+    assert c.hit('ip:a', 60, now=1060) == 1
+
+
+def test_ip_ban_and_expiry(tmp_path):
+    det, store = make(tmp_path, ip_fails=3, ban_seconds=100)
+    det.observe_many([('1.1.1.1', None, None)] * 2, now=1000)
+    assert store == set()
+    det.observe('1.1.1.1', now=1000)
+    assert store == {('ip', '1.1.1.1')}
+    assert [b['value'] for b in det.active()] == ['1.1.1.1']
+    assert det.expire(now=1099) == 0
+    assert det.expire(now=1100) == 1
+    assert store == set() and det.active() == []
+    actions = [r['action'] for r in det.audit()]
+    assert actions == ['expire', 'ban']
+
+
+def test_allow_list_and_prefix_alert(tmp_path):
+    events = []
+    det, store = make(tmp_path, ip_fails=1, prefix_fails=2, prefix_len=4, allow=['127.0.0.1'],
+                      emit=events.extend)
+    det.observe_many([('127.0.0.1', None, 'ABCD-1'), ('127.0.0.1', None, 'ABCD-2')], now=1000)
+    assert store == set()
+    assert det.alerts == 1
+    assert events[0]['type'] == 'abuse_alert' and events[0]['value'] == 'ABCD'
+
+
+def test_forget_keeps_expiry_from_lifting(tmp_path):
+    det, store = make(tmp_path, ip_fails=1, ban_seconds=100)
+    det.observe('1.1.1.1', now=1000)
+    assert det.forget('ip', '1.1.1.1', 'manual_ban', now=1001)
+    assert not det.forget('ip', '1.1.1.1')
+    assert det.active() == []
+    assert det.expire(now=2000) == 0
+    assert store == {('ip', '1.1.1.1')}
+    assert det.audit()[0] == {'time': 1001, 'action': 'manual_ban', 'type': 'ip', 'value': '1.1.1.1'}
+    with open(str(tmp_path / 'autobans.json')) as f:
+        assert json.load(f) == {}
+
+
+def failed_checks(client, n, forwarded):
+    for i in range(n):
+        res = client.get('/check', query_string={'key': 'WRONG-%d' % i},
+                         headers={'X-Forwarded-For': forwarded})
+        assert res.get_json()['result'] in ('wrong', 'banned')
+
+
+def test_auto_ban_uses_forwarded_client(load_server):
+    srv = load_server(ABUSE=1, ABUSE_IP_FAILS=3, ABUSE_ASN_FAILS=0, ABUSE_PREFIX_FAILS=0)
+    c = srv.app.test_client()
+    # the header's first hop is spoofed; nginx appended the real client
+    failed_checks(c, 3, '198.51.100.9, 203.0.113.7')
+    assert [(b['type'], b['value']) for b in srv.abuse.active()] == [('ip', '203.0.113.7')]
+    assert srv.ban_index.match(ip='203.0.113.7')
+    assert not srv.ban_index.match(ip='198.51.100.9')
+
+
+def test_manual_ban_converts_auto_ban(load_server):
+    srv = load_server(ABUSE=1, ABUSE_IP_FAILS=3, ABUSE_ASN_FAILS=0, ABUSE_PREFIX_FAILS=0)
+    c = srv.app.test_client()
+    failed_checks(c, 3, '203.0.113.7')
+    res = c.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.7'}, headers=ADMIN)
+    assert res.get_json() == {'result': 'converted'}
+    assert srv.abuse.active() == []
+    srv.abuse.expire(now=2 ** 40)
+    assert srv.ban_index.match(ip='203.0.113.7')
+    res = c.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.7'}, headers=ADMIN)
+    assert res.get_json() == {'result': 'exists'}
+
+
+@pytest.mark.parametrize('name, unbanned', [('server', 'unbanned'), ('server_extended', 'removed')])
+def test_manual_unban_drops_auto_ban(load_server, name, unbanned):
+    srv = load_server(name, ABUSE=1, ABUSE_IP_FAILS=3, ABUSE_ASN_FAILS=0, ABUSE_PREFIX_FAILS=0)
+    srv.abuse.observe_many([('203.0.113.8', None, None)] * 3)
+    assert srv.abuse.active()
+    res = srv.app.test_client().post('/admin/unban', json={'type': 'ip', 'value': '203.0.113.8'},
+                                     headers=ADMIN)
+    assert res.get_json() == {'result': unbanned}
+    assert srv.abuse.active() == []
+    assert not srv.ban_index.match(ip='203.0.113.8')
+
+
+def test_servers_sharing_app_dir_leave_each_others_bans_alone(load_server, tmp_path):
+    srv = load_server('server')
+    c = srv.app.test_client()
+    assert c.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.9'}, headers=ADMIN).get_json() == \
+        {'result': 'banned'}
+    ext = load_server('server_extended', ABUSE=1, ABUSE_IP_FAILS=1, ABUSE_ASN_FAILS=0, ABUSE_PREFIX_FAILS=0)
+    e = ext.app.test_client()
+    assert ext.ban_pairs() == []
+    res = e.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.10'}, headers=ADMIN)
+    assert res.status_code == 409
+    assert e.post('/admin/unban', json={'type': 'ip', 'value': '203.0.113.9'}, headers=ADMIN).status_code == 409
+    assert e.get('/admin/bans', headers=ADMIN).status_code == 409
+    # an auto-ban cannot be stored either, and does not crash the detector
+    ext.abuse.observe('203.0.113.11')
+    assert ext.abuse.active() == []
+    with open(str(tmp_path / 'bans.json')) as f:
+        assert json.load(f)['ips'] == ['203.0.113.9']
@@ -0,0 +1,41 @@
+from conn_store import ActiveSessions, ConnectionStore
+
+
+def test_sessions_expire_after_window():
+    s = ActiveSessions(window=5)
+    s.touch('A', 100, now=100)
+    s.touch('B', 103, now=103)
+    assert s.keys(now=104) == {'A': 100, 'B': 103}
+    assert s.sweep(now=106) == 1
+    assert s.keys(now=106) == {'B': 103}
+    assert len(s) == 1 and s.expired == 1
+
+
+def test_newer_heartbeat_keeps_session_and_old_ones_are_ignored():
+    s = ActiveSessions(window=5)
+    s.touch('A', 100, now=100)
+    s.touch('A', 104, now=104)
+    s.touch('A', 101, now=104)  # out of order: ignored
+    assert s.sweep(now=106) == 0
+    assert s.keys(now=106) == {'A': 104}
+    s.touch('B', 90, now=106)  # already outside the window
+    assert 'B' not in s.keys(now=106)
+
+
+def test_heap_is_compacted_after_many_superseded_entries():
+    s = ActiveSessions(window=10 ** 9)
+    for t in range(5000):
+        s.touch('A', t, now=t)
+    s.sweep(now=5000)
+    assert len(s._heap) == 1 and s.keys(now=5000) == {'A': 4999}
+
+
+def test_store_splits_active_and_stale(tmp_path):
+    store = ConnectionStore(str(tmp_path / 'connections.json'), active_window=5)
+    store.update('A', last_seen=1000, ip='1.1.1.1')
+    store.update('B', last_seen=1004, ip='2.2.2.2')
+    store.sessions.touch('A', 1000, now=1000)
+    store.sessions.touch('B', 1004, now=1004)
+    assert set(store.active(now=1006)) == {'B'}
+    assert set(store.stale(now=1006)) == {'A'}
+    assert store.counts(now=1006) == {'active': 1, 'stale': 1, 'total': 2}
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('tabulate')
+
+import admin_dashboard as dash
+
+
+def _scripted(monkeypatch, replies, polls):
+    """api_call answers from replies[endpoint] in order; sleep stops the loop after `polls`"""
+    calls = []
+
+    def api_call(endpoint, method='GET', data=None, params=None):
+        calls.append((endpoint, params))
+        return replies[endpoint].pop(0)
+
+    def sleep(_):
+        if sum(1 for e, _ in calls if e == '/admin/connections') >= polls:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(dash, 'api_call', api_call)
+    monkeypatch.setattr(dash.time, 'sleep', sleep)
+    return calls
+
+
+def test_watch_fetches_only_changes_after_first_poll(monkeypatch, capsys):
+    replies = {
+        '/admin/connections': [
+            {'result': 'ok', 'now': 1000, 'connections': [{'key': 'A', 'ip': '1.1.1.1', 'last_seen': 999}]},
+            {'result': 'ok', 'now': 1002, 'connections': [{'key': 'B', 'ip': '2.2.2.2', 'last_seen': 1001}]},
+        ],
+        '/admin/failed-logins': [
+            {'result': 'ok', 'next': 'c1', 'failed': [{'ip': '9.9.9.9', 'key': 'BAD1'}]},
+            {'result': 'ok', 'next': 'c2', 'failed': [{'ip': '9.9.9.9', 'key': 'BAD2'}]},
+        ],
+    }
+    calls = _scripted(monkeypatch, replies, polls=2)
+    dash.cmd_watch(0)
+    assert calls == [('/admin/connections', None), ('/admin/failed-logins', {'limit': 20}),
+                     ('/admin/connections', {'since': 1000}), ('/admin/failed-logins', {'cursor': 'c1'})]
+    frame = capsys.readouterr().out.split('=== LIVE')[-1]
+    assert '1.1.1.1' in frame and '2.2.2.2' in frame
+    assert 'BAD1' in frame and 'BAD2' in frame
+
+
+def test_watch_shows_errors_and_keeps_cursor(monkeypatch, capsys):
+    replies = {
+        '/admin/connections': [{'result': 'ok', 'now': 5, 'connections': []}, {'error': 'timeout'}],
+        '/admin/failed-logins': [{'result': 'ok', 'next': 'c1', 'failed': []},
+                                 {'result': 'forbidden'}],
+    }
+    calls = _scripted(monkeypatch, replies, polls=2)
+    dash.cmd_watch(0)
+    assert 'Error: failed-logins: forbidden' in capsys.readouterr().out
+    assert calls[-1] == ('/admin/failed-logins', {'cursor': 'c1'})
+
+
+@pytest.mark.parametrize('ev, text', [
+    ({'type': 'check', 'result': 'wrong', 'key': 'K', 'ip': '1.2.3.4'}, 'wrong'),
+    ({'type': 'ban', 'ban_type': 'ip', 'value': '1.2.3.4'}, 'ban        ip 1.2.3.4'),
+    ({'type': 'auto_ban', 'ban_type': 'asn', 'value': 'AS1', 'count': 30, 'until': 0}, '30 fails'),
+    ({'type': 'something_new', 'x': 1}, '"x": 1'),
+])
+def test_format_event(ev, text):
+    assert text in dash.format_event(dict(ev, time=0))
@@ -0,0 +1,70 @@
+import asn_cache
+from asn_cache import AsnCache
+
+
+class Fetcher:
+    def __init__(self, value=('AS1', 'Org', 'Isp')):
+        self.value = value
+        self.calls = []
+
+    def __call__(self, ip):
+        self.calls.append(ip)
+        return self.value
+
+
+def test_hit_after_miss(tmp_path):
+    cache = AsnCache(str(tmp_path / 'c.sqlite3'))
+    fetch = Fetcher()
+    assert cache.get_or_fetch('1.2.3.4', fetch) == ('AS1', 'Org', 'Isp')
+    assert cache.get_or_fetch('1.2.3.4', fetch) == ('AS1', 'Org', 'Isp')
+    assert fetch.calls == ['1.2.3.4']
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+
+
+def test_shared_between_instances(tmp_path):
+    # two workers opening the same file see each other's entries
+    path = str(tmp_path / 'c.sqlite3')
+    AsnCache(path).get_or_fetch('1.2.3.4', Fetcher())
+    fetch = Fetcher(('AS2', 'x', 'y'))
+    assert AsnCache(path).get_or_fetch('1.2.3.4', fetch) == ('AS1', 'Org', 'Isp')
+    assert fetch.calls == []
+
+
+def test_negative_entries_and_expiry(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(asn_cache.time, 'time', lambda: now[0])
+    cache = AsnCache(str(tmp_path / 'c.sqlite3'), ttl=100, negative_ttl=10)
+    failing = Fetcher(None)
+    assert cache.get_or_fetch('5.5.5.5', failing) is None
+    assert cache.get_or_fetch('5.5.5.5', failing) is None
+    assert len(failing.calls) == 1
+    now[0] += 11
+    ok = Fetcher()
+    assert cache.get_or_fetch('5.5.5.5', ok) == ('AS1', 'Org', 'Isp')
+    now[0] += 50
+    assert cache.get_or_fetch('5.5.5.5', ok) == ('AS1', 'Org', 'Isp')
+    assert len(ok.calls) == 1
+    now[0] += 100
+    cache.get_or_fetch('5.5.5.5', ok)
+    assert len(ok.calls) == 2
+    stats = cache.stats()
+    assert stats['negative_hits'] == 1 and stats['expired'] == 2 and stats['fetch_failures'] == 1
+
+
+def test_lru_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(asn_cache, 'EVICT_CHECK_EVERY', 1)
+    cache = AsnCache(str(tmp_path / 'c.sqlite3'), max_entries=20)
+    for i in range(50):
+        cache.get_or_fetch('10.0.0.%d' % i, Fetcher())
+    stats = cache.stats()
+    assert stats['entries'] <= 20
+    assert stats['evictions'] >= 30
+
+
+def test_ttl_zero_disables(tmp_path):
+    cache = AsnCache(str(tmp_path / 'c.sqlite3'), ttl=0)
+    fetch = Fetcher()
+    cache.get_or_fetch('1.1.1.1', fetch)
+    cache.get_or_fetch('1.1.1.1', fetch)
+    assert len(fetch.calls) == 2
@@ -0,0 +1,59 @@
+import gzip
+import os
+import threading
+
+from attempts_log import SegmentedLog
+
+
+def _closed_segment(log, n=50):
+    log.append_many([{'time': 1000 + i, 'ip': 'ip%d' % i, 'key': 'K'} for i in range(n)])
+    name = log._current_name()
+    lk = log._flock(True)
+    try:
+        log._new_segment()
+    finally:
+        log._unlock(lk)
+    log._close_fds()
+    return name
+
+
+def test_read_pages_and_tails(tmp_path):
+    log = SegmentedLog(str(tmp_path / 'a'), compress=False, retention=0)
+    log.append_many([{'time': 1000 + i, 'ip': 'x', 'key': 'K%d' % i} for i in range(5)])
+    page, cursor = log.read(since=0, limit=3)
+    assert [r['key'] for r in page] == ['K0', 'K1', 'K2']
+    page, cursor = log.read(cursor=cursor, limit=3)
+    assert [r['key'] for r in page] == ['K3', 'K4']
+    log.append({'time': 2000, 'ip': 'x', 'key': 'K5'})
+    page, _ = log.read(cursor=cursor)
+    assert [r['key'] for r in page] == ['K5']
+    assert log.read(since=0, until=1001)[1] is None
+
+
+def test_concurrent_maintain_compresses_once(tmp_path):
+    log = SegmentedLog(str(tmp_path / 'a'), compress=True, retention=0)
+    name = _closed_segment(log)
+    threads = [threading.Thread(target=log._maintain) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    files = sorted(os.listdir(str(tmp_path / 'a')))
+    assert name + '.log.gz' in files and name + '.log' not in files
+    assert not [f for f in files if '.tmp' in f]
+    with gzip.open(str(tmp_path / 'a' / (name + '.log.gz'))) as f:
+        assert len(f.read().splitlines()) == 50
+    assert len(log.read(since=0, limit=100)[0]) == 50
+
+
+def test_maintain_reuses_finished_archive(tmp_path):
+    log = SegmentedLog(str(tmp_path / 'a'), compress=True, retention=0)
+    name = _closed_segment(log, n=3)
+    plain = str(tmp_path / 'a' / (name + '.log'))
+    # another worker already finished the archive but has not removed the plain file
+    with open(plain, 'rb') as src, gzip.open(plain + '.gz', 'wb') as dst:
+        dst.write(src.read())
+    mtime = os.path.getmtime(plain + '.gz')
+    log._maintain()
+    assert not os.path.exists(plain)
+    assert os.path.getmtime(plain + '.gz') == mtime
@@ -0,0 +1,58 @@
+from ban_engine import BanIndex, BanMatcher
+
+
+def test_match_types_and_cidrs():
+    m = BanMatcher([('key', 'K'), ('asn', '64500'), ('device', 'D'), ('ip', '10.0.0.0/8'),
+                    ('ip', '1.2.3.4'), ('ip', '2001:db8::/32'), ('ip', 'garbage')])
+    assert m.match(key='K') == 'key'
+    assert m.match(asn='64500') == 'asn'
+    assert m.match(device='D') == 'device'
+    assert m.match(ip='10.200.1.1') == 'ip'
+    assert m.match(ip='::ffff:1.2.3.4') == 'ip'
+    assert m.match(ip='2001:db8::1') == 'ip'
+    assert m.match(ip='11.0.0.1', key='X') is None
+    assert m.match(ip='not an ip') is None
+
+
+def test_remove_keeps_other_spelling_of_same_address():
+    m = BanMatcher([('ip', '1.2.3.4'), ('ip', '1.2.3.4/32')])
+    m.remove('ip', '1.2.3.4')
+    assert m.match_ip('1.2.3.4')
+    m.remove('ip', '1.2.3.4/32')
+    assert not m.match_ip('1.2.3.4')
+    assert not m.has('ip')
+
+
+def test_remove_keeps_other_spelling_of_same_network():
+    m = BanMatcher([('ip', '10.0.0.0/24'), ('ip', '10.0.0.7/24')])
+    m.remove('ip', '10.0.0.7/24')
+    assert m.match_ip('10.0.0.9')
+    m.remove('ip', '10.0.0.0/24')
+    assert not m.match_ip('10.0.0.9')
+    assert m.stats()['ranges_v4'] == 0
+
+
+def test_add_and_remove_rebuild_ranges():
+    m = BanMatcher()
+    m.add('ip', '192.168.0.0/16')
+    m.add('ip', '192.168.0.0/16')
+    assert m.match_ip('192.168.5.5')
+    m.remove('ip', '192.168.0.0/16')
+    assert not m.match_ip('192.168.5.5')
+    m.remove('ip', '192.168.0.0/16')  # nothing left: no error
+
+
+def test_index_rebuilds_on_stamp_and_skips_own_writes():
+    bans = [('key', 'A')]
+    stamp = [1]
+    idx = BanIndex(lambda: list(bans), lambda: stamp[0])
+    assert idx.match(key='A') == 'key'
+    bans.append(('key', 'B'))
+    stamp[0] = 2
+    idx.added('key', 'B', stamps=(1, 2))
+    assert idx.match(key='B') == 'key'
+    assert idx.rebuilds == 1 and idx.incremental == 1
+    bans.append(('key', 'C'))
+    stamp[0] = 3
+    assert idx.match(key='C') == 'key'
+    assert idx.rebuilds == 2
@@ -0,0 +1,47 @@
+import json
+import random
+import ipaddress
+
+import bench
+
+
+def test_seeded_bans_never_cover_bench_clients():
+    bans = bench.seed_bans(300)
+    nets = [ipaddress.ip_network(v, strict=False) for t, v in bans if t == 'ip']
+    rng = random.Random(1)
+    for _ in range(200):
+        ip = ipaddress.ip_address(bench.bench_ip(rng))
+        assert not any(ip in n for n in nets)
+
+
+def test_percentile_and_summary():
+    assert bench.percentile([], 50) is None
+    assert bench.percentile([1, 2, 3, 4, 5], 50) == 3
+    s = bench.summarize('check', 4, [0.001, 0.002, 0.003], {200: 3}, 0, 1.5)
+    assert s['requests'] == 3 and s['rps'] == 2.0
+    assert s['latency_ms']['p50'] == 2.0 and s['status'] == {'200': 3}
+
+
+def test_replay_source_orders_by_time_and_ends(tmp_path):
+    log = tmp_path / 'attempts.log'
+    log.write_text('\n'.join([json.dumps({'time': 2, 'ip': '1.1.1.1', 'key': 'B'}),
+                              'not json',
+                              json.dumps({'time': 1, 'ip': '2.2.2.2', 'key': 'A'}),
+                              json.dumps({'time': 3, 'ip': '3.3.3.3'})]) + '\n')
+    nxt, n = bench.replay_source(str(log), speed=0)
+    assert n == 2
+    rng = random.Random(0)
+    first, second = nxt(rng), nxt(rng)
+    assert first[1] == '/check?key=A' and first[3]['X-Forwarded-For'] == '2.2.2.2'
+    assert second[1] == '/check?key=B'
+    assert nxt(rng) is None
+
+
+def test_drive_counts_statuses_against_the_stub():
+    stub = bench.start_stub(0.0, 0.0, 0.0)
+    try:
+        port = stub.server_address[1]
+        lat, statuses, errors, _ = bench.drive(port, 2, lambda rng: ('GET', '/8.8.8.8/json', None, {}), total=10)
+    finally:
+        stub.shutdown()
+    assert len(lat) == 10 and statuses == {200: 10} and errors == 0
@@ -0,0 +1,25 @@
+import client_addr
+from client_addr import TrustedProxies
+
+
+def test_header_ignored_unless_peer_is_trusted():
+    p = TrustedProxies(['127.0.0.1'])
+    assert p.client_ip('203.0.113.5', '1.1.1.1') == '203.0.113.5'
+    assert p.client_ip('127.0.0.1', None) == '127.0.0.1'
+
+
+def test_rightmost_untrusted_hop_wins():
+    p = TrustedProxies(['127.0.0.1', '10.0.0.0/8'])
+    # the client put 1.1.1.1 in the header itself; nginx appended the real peer
+    assert p.client_ip('127.0.0.1', '1.1.1.1, 198.51.100.7') == '198.51.100.7'
+    assert p.client_ip('127.0.0.1', '198.51.100.7, 10.1.2.3') == '198.51.100.7'
+    assert p.client_ip('::ffff:127.0.0.1', '198.51.100.7') == '198.51.100.7'
+    assert p.client_ip('127.0.0.1', '10.0.0.1, 10.0.0.2') == '10.0.0.1'
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('TRUSTED_PROXIES', raising=False)
+    assert client_addr.from_env().trusted('::1')
+    monkeypatch.setenv('TRUSTED_PROXIES', '')
+    p = client_addr.from_env()
+    assert p.client_ip('127.0.0.1', '1.1.1.1') == '127.0.0.1'
@@ -0,0 +1,51 @@
+import json
+import os
+
+from conn_history import PartitionedHistory
+
+
+def test_append_keeps_newest_partitions(tmp_path):
+    h = PartitionedHistory(str(tmp_path), 'connections', partition_seconds=3600, retention=2)
+    for hour in range(4):
+        h.append([{'key': 'K%d' % hour, 'last_seen': hour * 3600}], now=hour * 3600)
+    assert len(h.partitions()) == 2
+    assert h.dropped_partitions == 2
+    assert [r['key'] for r in h.read()] == ['K2', 'K3']
+    assert [r['key'] for r in h.read(limit=1)] == ['K3']
+    assert [r['key'] for r in h.read(since=3 * 3600)] == ['K3']
+
+
+def test_page_follows_appends_across_partitions(tmp_path):
+    h = PartitionedHistory(str(tmp_path), 'failed', partition_seconds=3600, retention=10)
+    h.append([{'n': 1}, {'n': 2}], now=0)
+    recs, cursor = h.page(limit=10)
+    assert [r['n'] for r in recs] == [1, 2]
+    assert h.page(cursor)[0] == []
+    h.append([{'n': 3}], now=10)
+    h.append([{'n': 4}, {'n': 5}], now=3600)
+    recs, cursor = h.page(cursor, limit=2)
+    assert [r['n'] for r in recs] == [3, 4]
+    recs, cursor = h.page(cursor, limit=2)
+    assert [r['n'] for r in recs] == [5]
+
+
+def test_page_skips_partial_line(tmp_path):
+    h = PartitionedHistory(str(tmp_path), 'connections')
+    h.append([{'n': 1}], now=0)
+    with open(h.partitions()[0], 'a') as f:
+        f.write('{"n": 2')
+    recs, cursor = h.page()
+    assert [r['n'] for r in recs] == [1]
+    with open(h.partitions()[0], 'a') as f:
+        f.write('}\n')
+    assert [r['n'] for r in h.page(cursor)[0]] == [2]
+
+
+def test_import_legacy_moves_list_once(tmp_path):
+    legacy = tmp_path / 'connections.json'
+    legacy.write_text(json.dumps([{'key': 'A'}, {'key': 'B'}]))
+    h = PartitionedHistory(str(tmp_path / 'history'), 'connections')
+    assert h.import_legacy(str(legacy)) == 2
+    assert not legacy.exists() and os.path.exists(str(legacy) + '.migrated')
+    assert h.import_legacy(str(legacy)) == 0
+    assert [r['key'] for r in h.read()] == ['A', 'B']
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from conn_pipeline import ConnectionPipeline
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > end:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+def test_enriches_and_persists_in_batches():
+    persisted = []
+    lock = threading.Lock()
+
+    def persist(batch):
+        with lock:
+            persisted.append(list(batch))
+
+    p = ConnectionPipeline(lambda e: dict(e, asn='AS1'), persist, workers=1, batch_size=10, flush_interval=0.05)
+    for i in range(25):
+        assert p.submit({'n': i})
+    wait_for(lambda: sum(len(b) for b in persisted) == 25)
+    assert all(len(b) <= 10 for b in persisted)
+    assert sorted(e['n'] for b in persisted for e in b) == list(range(25))
+    assert all(e['asn'] == 'AS1' for b in persisted for e in b)
+    p.stop()
+    assert p.stats()['persisted'] == 25
+
+
+def test_sheds_load_when_full():
+    gate = threading.Event()
+    p = ConnectionPipeline(lambda e: gate.wait() or e, lambda b: None, workers=1, maxsize=2,
+                           batch_size=1, put_timeout=0.01)
+    results = [p.submit({'n': i}) for i in range(10)]
+    assert not all(results)
+    assert p.stats()['dropped'] == results.count(False)
+    gate.set()
+    p.stop()
+
+
+def test_failures_are_counted_not_raised():
+    def enrich(e):
+        raise RuntimeError('lookup failed')
+
+    def persist(batch):
+        raise OSError('disk full')
+
+    p = ConnectionPipeline(enrich, persist, workers=1, batch_size=1, flush_interval=0.01)
+    p.submit({'n': 1})
+    wait_for(lambda: p.stats()['persist_failures'] == 1)
+    assert p.stats()['enrich_failures'] == 1
+    p.stop()
+
+
+def test_stop_drains_queue():
+    persisted = []
+    p = ConnectionPipeline(lambda e: e, persisted.extend, workers=2, batch_size=1000, flush_interval=60)
+    for i in range(50):
+        p.submit({'n': i})
+    p.stop()
+    assert len(persisted) == 50
@@ -0,0 +1,89 @@
+import json
+import threading
+
+from conn_store import ConnectionStore, atomic_write_json, file_lock
+
+
+def read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_updates_coalesce_until_flush(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    store = ConnectionStore(path, flush_interval=3600)
+    store.update('K', last_seen=1, ip='1.1.1.1')
+    store.update('K', last_seen=2)
+    store.update('J', last_seen=3)
+    assert store.get('K') == {'last_seen': 2, 'ip': '1.1.1.1'}
+    store.flush()
+    assert read(path) == {'K': {'last_seen': 2, 'ip': '1.1.1.1'}, 'J': {'last_seen': 3}}
+    assert store.stats()['flushes'] == 1 and store.stats()['flushed_keys'] == 2
+
+
+def test_workers_merge_newest_wins(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    a = ConnectionStore(path, flush_interval=3600)
+    b = ConnectionStore(path, flush_interval=3600)
+    a.update('K', last_seen=10, ip='a')
+    b.update('K', last_seen=5, ip='b')
+    b.update('ONLY_B', last_seen=5)
+    a.flush()
+    b.flush()
+    disk = read(path)
+    assert disk['K']['ip'] == 'a'
+    assert 'ONLY_B' in disk
+    # a picks up b's keys on its next flush
+    a.update('X', last_seen=11)
+    a.flush()
+    assert a.get('ONLY_B') == {'last_seen': 5}
+
+
+def test_max_age_drops_old_keys(tmp_path):
+    path = str(tmp_path / 'connections.json')
+    atomic_write_json(path, {'OLD': {'last_seen': 1}})
+    store = ConnectionStore(path, flush_interval=3600, max_age=60)
+    store.update('NEW', last_seen=int(__import__('time').time()))
+    store.flush()
+    assert list(read(path)) == ['NEW']
+    assert store.get('OLD') is None
+
+
+def test_failed_write_keeps_keys_dirty(tmp_path, monkeypatch):
+    path = str(tmp_path / 'c.json')
+    store = ConnectionStore(path, flush_interval=3600)
+    store.update('K', last_seen=1)
+
+    def fail(dirty):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(store, '_write', fail)
+    try:
+        store.flush()
+    except OSError:
+        pass
+    assert store.stats()['dirty'] == 1
+    monkeypatch.undo()
+    store.flush()
+    assert read(path) == {'K': {'last_seen': 1}}
+
+
+def test_file_lock_excludes_threads(tmp_path):
+    path = str(tmp_path / 'counter.json')
+    atomic_write_json(path, {'n': 0})
+
+    def bump():
+        for _ in range(50):
+            with file_lock(path):
+                data = read(path)
+                data['n'] += 1
+                atomic_write_json(path, data)
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert read(path) == {'n': 200}
+    # temp files are renamed away
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['counter.json', 'counter.json.lock']
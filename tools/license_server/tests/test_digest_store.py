@@ -0,0 +1,61 @@
+import os
+
+from digest_store import DigestStore
+from snapshot import Generations
+
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def test_add_remove_contains(tmp_path):
+    gens = Generations(str(tmp_path / 'generations.bin'))
+    ds = DigestStore(str(tmp_path / 'keys.bin'), gens, background=False)
+    assert ds.add_many(['A', 'B', 'A']) == 2
+    assert ds.add_many(['A']) == 0
+    assert ds.contains_many(['A', 'B', 'Z']) == [True, True, False]
+    assert ds.remove_many(['B', 'Z']) == 1
+    assert not ds.contains('B')
+    assert gens.get('keys') == 2
+    assert ds.digest_many(['A', 'B']) == [ds.digest('A'), ds.digest('B')]
+    assert ds.keys() == [ds.digest('A').hex()]
+
+
+def test_compaction_keeps_membership(tmp_path):
+    ds = DigestStore(str(tmp_path / 'keys.bin'), compact_at=3, background=False)
+    ds.add_many(['A', 'B'])
+    ds.remove_many(['A'])  # third delta record: compacts
+    assert ds.compactions == 1
+    assert os.path.getsize(str(tmp_path / 'keys.bin.delta')) == 0
+    assert ds.contains_many(['A', 'B']) == [False, True]
+    # another worker's view picks up the new base file
+    other = DigestStore(str(tmp_path / 'keys.bin'))
+    assert other.contains_many(['A', 'B']) == [False, True]
+
+
+def test_no_plaintext_key_on_disk(load_server, tmp_path):
+    srv = load_server(KEY_STORE='digest', EVENTS=1)
+    c = srv.app.test_client()
+    sub = srv.events.subscribe()
+    key = 'PLAINTEXT-KEY-1234'
+    assert c.post('/admin/add', json={'key': key}, headers=ADMIN).get_json() == {'result': 'added'}
+    assert c.get('/check', query_string={'key': key}).get_json()['result'] == 'success'
+    assert c.post('/heartbeat', json={'key': key, 'device_name': 'd'}).get_json() == {'result': 'ok'}
+    srv.conn_store.flush()
+    if srv.rollups is not None:
+        srv.rollups.flush()
+
+    kid = srv.key_id(key)
+    assert kid == srv.digest_keys.digest(key).hex()
+    assert kid in srv.conn_store.snapshot()
+    srv.events.poll()
+    seen = []
+    while not sub.queue.empty():
+        seen.append(sub.queue.get_nowait()[1].get('key'))
+    assert seen and set(seen) == {kid}
+
+    for root, dirs, files in os.walk(str(tmp_path)):
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        for name in files:
+            if name.endswith('.py'):
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                assert key.encode() not in f.read(), name
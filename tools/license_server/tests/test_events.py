@@ -0,0 +1,77 @@
+import events as events_mod
+from events import Broadcaster, EventRing, StreamSlots
+
+
+def _broadcaster(tmp_path, **kw):
+    ring = EventRing(str(tmp_path / 'events.bin'), slots=8)
+    return Broadcaster(ring, poll_interval=3600, **kw)
+
+
+def test_ring_reads_back_and_reports_overwritten(tmp_path):
+    ring = EventRing(str(tmp_path / 'events.bin'), slots=4)
+    for i in range(6):
+        ring.publish('check', n=i)
+    events, lost = ring.read(0)
+    assert [ev['n'] for _, ev in events] == [2, 3, 4, 5]
+    assert lost == 2 and ring.head() == 6
+
+
+def test_nothing_is_written_without_readers(tmp_path):
+    b = _broadcaster(tmp_path)
+    b.publish_many([{'type': 'check'}])
+    assert b.ring.head() == 0 and b.skipped == 1
+    sub = b.subscribe()
+    b.publish_many([{'type': 'check', 'n': 1}])
+    b.poll()
+    seq, ev = sub.queue.get_nowait()
+    assert seq == 1 and ev['n'] == 1
+
+
+def test_readers_in_another_process_keep_publishing_on(tmp_path):
+    reader, writer = _broadcaster(tmp_path), _broadcaster(tmp_path)
+    reader.subscribe()
+    writer.publish_many([{'type': 'heartbeat'}])
+    assert writer.ring.head() == 1
+    reader.ring.mark_readers(ttl=-1)  # the reader went away
+    writer.publish_many([{'type': 'heartbeat'}])
+    assert writer.ring.head() == 1
+
+
+def test_sync_streams_are_capped_across_broadcasters(tmp_path):
+    slots = str(tmp_path / 'events.bin.stream')
+    a = _broadcaster(tmp_path, sync_streams=StreamSlots(slots, 1))
+    b = _broadcaster(tmp_path, sync_streams=StreamSlots(slots, 1))
+    sub = a.subscribe(holds_worker=True)
+    assert sub is not None
+    assert b.subscribe(holds_worker=True) is None
+    assert b.subscribe() is not None  # async streams do not hold a worker
+    a.unsubscribe(sub)
+    assert b.subscribe(holds_worker=True) is not None
+
+
+def test_resume_from_last_event_id(tmp_path):
+    b = _broadcaster(tmp_path)
+    first = b.subscribe()
+    b.publish_many([{'type': 'check', 'n': i} for i in range(3)])
+    b.poll()
+    b.unsubscribe(first)
+    again = b.subscribe(after=1)
+    assert [ev['n'] for _, ev in (again.queue.get_nowait(), again.queue.get_nowait())] == [1, 2]
+
+
+def test_sse_stream_format(tmp_path):
+    b = _broadcaster(tmp_path)
+    sub = b.subscribe()
+    sub.queue.put_nowait((7, {'type': 'ban', 'value': '1.2.3.4'}))
+    stream = events_mod.sse(b, sub)
+    assert next(stream) == 'retry: 2000\n\n'
+    assert next(stream).startswith('id: 7\nevent: ban\n')
+    stream.close()
+    assert b.stats()['subscribers'] == 0
+
+
+def test_off_unless_enabled(tmp_path, monkeypatch):
+    monkeypatch.delenv('EVENTS', raising=False)
+    assert events_mod.from_env(str(tmp_path)) is None
+    monkeypatch.setenv('EVENTS', '1')
+    assert events_mod.from_env(str(tmp_path)).sync_streams.limit == 1
@@ -0,0 +1,68 @@
+import gzip
+
+import ipasn
+from ipasn import IpAsnDatabase
+
+
+CSV = """start_ip,end_ip,asn,org,isp
+1.0.0.0,1.0.0.255,13335,Cloudflare,Cloudflare Inc
+8.8.8.0,8.8.8.255,AS15169,Google,
+10.0.0.0,10.255.255.255,0,Not routed
+2001:db8::,2001:db8::ffff,64500,Example v6
+bogus,line,1,x
+"""
+
+
+def make_db(tmp_path, text=CSV, name='asn.csv'):
+    path = tmp_path / name
+    if name.endswith('.gz'):
+        with gzip.open(path, 'wt') as f:
+            f.write(text)
+    else:
+        path.write_text(text)
+    return IpAsnDatabase(str(path))
+
+
+def test_csv_lookup(tmp_path):
+    db = make_db(tmp_path)
+    assert db.lookup('1.0.0.7') == ('AS13335', 'Cloudflare', 'Cloudflare Inc')
+    assert db.lookup('8.8.8.8') == ('AS15169', 'Google', None)
+    assert db.lookup('1.0.1.0') is None
+    assert db.lookup('0.255.255.255') is None
+
+
+def test_not_routed_and_malformed_rows_skipped(tmp_path):
+    db = make_db(tmp_path)
+    assert db.lookup('10.1.2.3') is None
+    assert len(db) == 3
+
+
+def test_ipv6_and_mapped_ipv4(tmp_path):
+    db = make_db(tmp_path)
+    # no isp column: the org is used for both
+    assert db.lookup('2001:db8::1') == ('AS64500', 'Example v6', 'Example v6')
+    assert db.lookup('::ffff:1.0.0.1')[0] == 'AS13335'
+
+
+def test_invalid_input(tmp_path):
+    db = make_db(tmp_path)
+    assert db.lookup('not-an-ip') is None
+    assert db.lookup(None) is None
+    assert db.stats()['lookups'] == 2
+
+
+def test_tsv_gz(tmp_path):
+    tsv = '1.0.0.0\t1.0.0.255\t13335\tUS\tCLOUDFLARENET\n5.0.0.0\t5.0.0.255\t0\tNone\tNot routed\n'
+    db = make_db(tmp_path, tsv, 'ip2asn.tsv.gz')
+    assert db.lookup('1.0.0.9') == ('AS13335', 'CLOUDFLARENET', 'CLOUDFLARENET')
+    assert db.lookup('5.0.0.1') is None
+
+
+def test_load_default(tmp_path, monkeypatch):
+    monkeypatch.delenv('ASN_DB', raising=False)
+    assert ipasn.load_default() is None
+    monkeypatch.setenv('ASN_DB', str(tmp_path / 'missing.csv'))
+    assert ipasn.load_default() is None
+    make_db(tmp_path)
+    monkeypatch.setenv('ASN_DB', str(tmp_path / 'asn.csv'))
+    assert ipasn.load_default().lookup('1.0.0.1')[0] == 'AS13335'
@@ -0,0 +1,88 @@
+import io
+import json
+
+import pytest
+
+import key_bulk
+from snapshot import Generations
+from storage import Storage
+
+
+def test_parse_lines_skips_comments_and_counts_invalid():
+    lines = ['A\n', '  B  \n', '\n', '# comment\n', 'has space\n', 'X' * 300 + '\n', 'A\n']
+    entries, invalid = key_bulk.parse(lines)
+    assert entries == {'A': None, 'B': None}
+    assert invalid == 2
+
+
+def test_parse_csv_keeps_metadata():
+    lines = ['key,owner,note\n', 'A,acme,\n', 'B,,\n', ',x,y\n']
+    entries, invalid = key_bulk.parse(lines, 'csv')
+    assert entries == {'A': {'owner': 'acme'}, 'B': None}
+    assert invalid == 1
+
+
+def test_parse_csv_needs_key_column():
+    with pytest.raises(ValueError):
+        key_bulk.parse(['owner\n', 'acme\n'], 'csv')
+
+
+def test_parse_limit():
+    with pytest.raises(key_bulk.TooMany):
+        key_bulk.parse(['A\n', 'B\n', 'C\n'], limit=2)
+    # duplicates don't count towards the limit
+    assert key_bulk.parse(['A\n', 'A\n', 'B\n'], limit=2)[0] == {'A': None, 'B': None}
+
+
+def test_body_lines_decodes():
+    assert list(key_bulk.body_lines(io.BytesIO(b'A\nB\xff\n'))) == ['A\n', 'B�\n']
+
+
+def test_json_import_remove(tmp_path):
+    keys_file = str(tmp_path / 'keys.json')
+    gens = Generations(str(tmp_path / 'generations.bin'))
+    with open(keys_file, 'w') as f:
+        json.dump(['A'], f)
+    res = key_bulk.import_keys({'A': None, 'B': {'owner': 'acme'}, 'C': None}, keys_file, gens)
+    assert res == {'added': 2, 'existing': 1}
+    assert gens.get('keys') == 1
+    assert key_bulk.load_json(keys_file, None) == ['A', 'B', 'C']
+    assert key_bulk.load_json(str(tmp_path / 'keys_meta.json'), None) == {'B': {'owner': 'acme'}}
+
+    # nothing new: no publish, no generation bump
+    assert key_bulk.import_keys({'A': None}, keys_file, gens) == {'added': 0, 'existing': 1}
+    assert gens.get('keys') == 1
+
+    assert key_bulk.remove_keys(['B', 'Z'], keys_file, gens) == {'removed': 1, 'not_found': 1}
+    assert gens.get('keys') == 2
+    assert key_bulk.load_json(keys_file, None) == ['A', 'C']
+    assert key_bulk.load_json(str(tmp_path / 'keys_meta.json'), None) == {}
+
+
+def test_storage_import_remove(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    res = key_bulk.import_keys({'A': {'owner': 'acme'}, 'B': None}, storage=s)
+    assert res == {'added': 2, 'existing': 0}
+    assert key_bulk.import_keys({'A': None}, storage=s) == {'added': 0, 'existing': 1}
+    assert s.key_meta() == {'A': {'owner': 'acme'}}
+    assert key_bulk.remove_keys(['A', 'Z'], storage=s) == {'removed': 1, 'not_found': 1}
+    assert s.list_keys() == ['B']
+
+
+def test_export_lines_and_csv(tmp_path):
+    keys_file = str(tmp_path / 'keys.json')
+    key_bulk.import_keys({'A': {'owner': 'acme', 'seats': '2'}, 'B': None}, keys_file)
+    assert ''.join(key_bulk.export_keys(keys_file)) == 'A\nB\n'
+    assert ''.join(key_bulk.export_keys(keys_file, fmt='csv')) == 'key,owner,seats\nA,acme,2\nB,,\n'
+
+    s = Storage(str(tmp_path / 'l.db'))
+    key_bulk.import_keys({'C': {'note': 'x,y'}}, storage=s)
+    assert ''.join(key_bulk.export_keys(storage=s, fmt='csv')) == 'key,note\nC,"x,y"\n'
+
+
+def test_export_round_trips_through_parse(tmp_path):
+    keys_file = str(tmp_path / 'keys.json')
+    entries = {'A': {'owner': 'acme'}, 'B': None}
+    key_bulk.import_keys(entries, keys_file)
+    lines = io.StringIO(''.join(key_bulk.export_keys(keys_file, fmt='csv')))
+    assert key_bulk.parse(lines, 'csv') == (entries, 0)
@@ -0,0 +1,74 @@
+import time
+import hashlib
+
+from key_filter import BloomFilter, KeyFilter
+
+
+def test_bloom_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = ['key-%d' % i for i in range(1000)]
+    bloom.update(keys[:500])
+    for k in keys[500:]:
+        bloom.add(k)
+    assert bloom.count == 1000
+    assert all(k in bloom for k in keys)
+    # update() and add() set the same bits
+    other = BloomFilter(1000, 0.01)
+    for k in keys:
+        other.add(k)
+    assert other._array == bloom._array
+
+
+def test_bloom_false_positive_rate():
+    bloom = BloomFilter(2000, 0.01)
+    bloom.update('key-%d' % i for i in range(2000))
+    fp = sum('other-%d' % i in bloom for i in range(10000)) / 10000
+    assert fp < 0.03
+    assert 0.005 < bloom.expected_fp_rate() < 0.02
+
+
+def test_bloom_accepts_bytes():
+    bloom = BloomFilter(10)
+    bloom.add(b'\x00\x01')
+    assert b'\x00\x01' in bloom
+
+
+def test_key_filter_passes_through_until_built():
+    keys = ['A', 'B']
+    stamp = [1]
+    f = KeyFilter(lambda: stamp[0], lambda: list(keys))
+    assert f.might_contain('Z')  # not built yet
+    f.rebuild()
+    assert f.might_contain('A')
+    assert not f.might_contain('Z')
+    assert f.stats()['rejects'] == 1
+
+    # a new key passes while the filter is stale
+    keys.append('C')
+    stamp[0] = 2
+    assert f.stats()['stale']
+    assert f.might_contain('C')
+    f.rebuild()
+    assert not f.stats()['stale']
+    assert f.might_contain('C')
+    assert not f.might_contain('Z')
+
+
+def test_key_filter_rebuilds_in_background():
+    stamp = [1]
+    f = KeyFilter(lambda: stamp[0], lambda: ['A'])
+    f.might_contain('Z')
+    for _ in range(1000):
+        if f._building is None and f._bloom is not None:
+            break
+        time.sleep(0.005)
+    assert not f.might_contain('Z')
+
+
+def test_key_filter_transform():
+    def h(k):
+        return hashlib.blake2b(k.encode(), digest_size=16).digest()
+    f = KeyFilter(lambda: 1, lambda: [h('A')], transform=h)
+    f.rebuild()
+    assert f.might_contain('A')
+    assert not f.might_contain('B')
@@ -0,0 +1,66 @@
+import json
+import os
+
+from key_index import KeyIndex, file_stamp
+
+
+def write_keys(path, keys):
+    tmp = str(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(keys, f)
+    os.replace(tmp, path)
+
+
+def test_lookup_and_order(tmp_path):
+    path = tmp_path / 'keys.json'
+    write_keys(path, ['B', 'A', 'C'])
+    idx = KeyIndex(str(path))
+    assert idx.contains('A')
+    assert not idx.contains('Z')
+    assert idx.contains_many(['C', 'Z', 'B']) == [True, False, True]
+    assert idx.keys() == ['B', 'A', 'C']
+    assert idx.stats()['size'] == 3
+
+
+def test_reloads_only_when_file_changes(tmp_path):
+    path = tmp_path / 'keys.json'
+    write_keys(path, ['A'])
+    idx = KeyIndex(str(path))
+    for _ in range(5):
+        idx.contains('A')
+    assert idx.reloads == 1
+    write_keys(path, ['A', 'NEW'])
+    assert idx.contains('NEW')
+    assert idx.reloads == 2
+
+
+def test_custom_stamp_and_invalidate(tmp_path):
+    path = tmp_path / 'keys.json'
+    write_keys(path, ['A'])
+    gen = [1]
+    idx = KeyIndex(str(path), lambda: gen[0])
+    assert idx.contains('A')
+    write_keys(path, ['B'])
+    # the stamp did not move, so the cached copy is still served
+    assert idx.contains('A') and not idx.contains('B')
+    idx.invalidate()
+    assert idx.contains('B')
+    gen[0] = 2
+    write_keys(path, ['C'])
+    assert idx.contains('C')
+
+
+def test_keeps_last_good_copy_on_bad_json(tmp_path):
+    path = tmp_path / 'keys.json'
+    write_keys(path, ['A'])
+    idx = KeyIndex(str(path))
+    assert idx.contains('A')
+    with open(path, 'w') as f:
+        f.write('[ "half')
+    assert idx.contains('A')
+
+
+def test_missing_file(tmp_path):
+    idx = KeyIndex(str(tmp_path / 'absent.json'))
+    assert not idx.contains('A')
+    assert file_stamp(str(tmp_path / 'absent.json')) == ()
@@ -0,0 +1,51 @@
+import pytest
+
+import license_token
+from license_token import TokenSigner, verify
+
+
+def test_hmac_token_round_trip():
+    s = TokenSigner(secret='s3cret', ttl=60)
+    token, exp = s.issue('KEY-1', 'pc', generation=4, now=1000)
+    assert exp == 1060
+    claims = verify(token, secret='s3cret', key='KEY-1', device='pc', now=1010)
+    assert claims['gen'] == 4 and claims['kid'] == license_token.key_id('KEY-1').hex()
+    assert s.verify(token, key='KEY-1', now=1010) is not None
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'secret': 'other'},
+    {'secret': 's3cret', 'key': 'KEY-2'},
+    {'secret': 's3cret', 'device': 'laptop'},
+    {'secret': 's3cret', 'now': 2000},
+    {},
+])
+def test_rejected_tokens(kwargs):
+    token, _ = TokenSigner(secret='s3cret', ttl=60).issue('KEY-1', 'pc', now=1000)
+    kwargs.setdefault('now', 1010)
+    assert verify(token, **kwargs) is None
+
+
+def test_garbage_is_rejected_and_counted():
+    s = TokenSigner(secret='s3cret')
+    for bad in ('', 'a.b', 'x' * 10, 'e30.AAAA'):
+        assert s.verify(bad) is None
+    assert s.rejected == 4
+
+
+def test_eddsa_token_verifies_with_public_key():
+    ed25519 = pytest.importorskip('cryptography.hazmat.primitives.asymmetric.ed25519')
+    s = TokenSigner(private_key=ed25519.Ed25519PrivateKey.generate())
+    token, _ = s.issue('KEY-1', now=1000)
+    public = bytes.fromhex(s.public_key_hex())
+    assert verify(token, public_key=public, key='KEY-1', now=1000) is not None
+    assert verify(token, secret='anything', now=1000) is None
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv('TOKEN_ED25519_KEY', raising=False)
+    monkeypatch.delenv('TOKEN_SECRET', raising=False)
+    assert license_token.from_env() is None
+    monkeypatch.setenv('TOKEN_SECRET', 'x')
+    monkeypatch.setenv('TOKEN_TTL', '30')
+    assert license_token.from_env().ttl == 30
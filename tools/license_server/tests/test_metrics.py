@@ -0,0 +1,40 @@
+import json
+import os
+
+from metrics import Metrics, ARCHIVE
+
+DEAD_PID = 4194304 + 17  # above the largest pid_max
+
+
+def test_counters_and_histograms_render(tmp_path):
+    m = Metrics(str(tmp_path))
+    m.describe('req_seconds', 'histogram', 'Request latency')
+    m.inc('checks_total', result='ok')
+    m.inc('checks_total', 2, result='ok')
+    m.observe('req_seconds', 0.003, route='/check')
+    m.observe('req_seconds', 10, route='/check')
+    text = m.render([('extra_gauge', 'gauge', 'Extra', {'extra_gauge': 5})])
+    assert 'checks_total{result="ok"} 3' in text
+    assert 'req_seconds_bucket{route="/check",le="0.005"} 1' in text
+    assert 'req_seconds_bucket{route="/check",le="+Inf"} 2' in text
+    assert 'req_seconds_count{route="/check"} 2' in text
+    assert '# TYPE req_seconds histogram' in text and 'extra_gauge 5' in text
+
+
+def test_label_values_are_escaped(tmp_path):
+    m = Metrics(str(tmp_path))
+    m.inc('x_total', path='a"b\\c')
+    assert 'x_total{path="a\\"b\\\\c"} 1' in m.render()
+
+
+def test_exited_workers_fold_into_archive(tmp_path):
+    dead = {'counters': {'checks_total': 5}, 'histograms': {}}
+    with open(os.path.join(str(tmp_path), '%d.json' % DEAD_PID), 'w') as f:
+        json.dump(dead, f)
+    m = Metrics(str(tmp_path))
+    m.inc('checks_total')
+    assert m.collect()['counters']['checks_total'] == 6
+    assert not os.path.exists(os.path.join(str(tmp_path), '%d.json' % DEAD_PID))
+    assert os.path.exists(os.path.join(str(tmp_path), ARCHIVE))
+    # totals never go backwards once the dead worker's file is gone
+    assert m.collect()['counters']['checks_total'] == 6
@@ -0,0 +1,37 @@
+import rate_limit
+from rate_limit import RateLimiter, SharedBuckets
+
+
+def test_bucket_allows_burst_then_refills(tmp_path):
+    b = SharedBuckets(str(tmp_path / 'ratelimit.bin'), slots=64)
+    assert [b.take('ip:a', 1.0, 3, now=100) for _ in range(3)] == [0, 0, 0]
+    assert b.take('ip:a', 1.0, 3, now=100) > 0
+    assert b.take('ip:a', 1.0, 3, now=101.5) == 0
+    assert b.take('ip:b', 1.0, 3, now=100) == 0  # separate bucket
+
+
+def test_buckets_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'ratelimit.bin')
+    a, b = SharedBuckets(path, slots=64), SharedBuckets(path, slots=64)
+    a.take('key:K', 1.0, 1, now=100)
+    assert b.take('key:K', 1.0, 1, now=100) > 0
+
+
+def test_staged_request_counts_passed_once(tmp_path):
+    lim = RateLimiter(SharedBuckets(str(tmp_path / 'ratelimit.bin'), slots=64),
+                      ip_rate=100, ip_burst=100, key_rate=1, key_burst=1)
+    assert lim.check(ip='1.2.3.4', last=False) == 0
+    assert lim.check(key='K') == 0
+    assert lim.check(ip='1.2.3.4', last=False) == 0
+    assert lim.check(key='K') >= 1
+    c = lim.buckets.counters()
+    assert c['passed'] == 1 and c['limited_key'] == 1 and c['limited_ip'] == 0
+
+
+def test_off_unless_enabled(tmp_path, monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT', raising=False)
+    assert rate_limit.from_env(str(tmp_path)) is None
+    monkeypatch.setenv('RATE_LIMIT', '1')
+    monkeypatch.setenv('RATE_IP', '50')
+    lim = rate_limit.from_env(str(tmp_path))
+    assert lim.ip_rate == 50 and lim.key_rate == 2
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+
+import pytest
+
+import rollups as rollups_mod
+from rollups import Rollups, parse_window
+
+
+def make(tmp_path, **kw):
+    kw.setdefault('flush_interval', 3600)
+    return Rollups(str(tmp_path / 'rollups'), **kw)
+
+
+def test_parse_window():
+    assert parse_window(None) == 3600
+    assert parse_window('900') == 900
+    assert parse_window('15m') == 900
+    assert parse_window('2h') == 7200
+    assert parse_window('1d') == 86400
+    with pytest.raises(ValueError):
+        parse_window('xh')
+
+
+def test_query_groups_and_filters(tmp_path):
+    r = make(tmp_path)
+    now = int(time.time())
+    r.record_many([(now, 'wrong', '1.1.1.1', 1, 'A'),
+                   (now, 'wrong', '1.1.1.1', 1, 'B'),
+                   (now, 'banned', '2.2.2.2', None, 'A'),
+                   (now, 'success', '3.3.3.3', 2, 'C')])
+    r.flush()
+    res = r.query(3600, 'ip', 'failed', now=now)
+    assert res['total'] == 3
+    assert res['top'] == [{'value': '1.1.1.1', 'count': 2}, {'value': '2.2.2.2', 'count': 1}]
+    assert r.query(3600, 'asn', 'banned', now=now)['top'] == [{'value': '-', 'count': 1}]
+    by_result = r.query(3600, 'result', now=now)
+    assert {t['value']: t['count'] for t in by_result['top']} == {'wrong': 2, 'banned': 1, 'success': 1}
+    assert r.query(3600, 'key', 'success', now=now)['top'] == [{'value': 'C', 'count': 1}]
+    with pytest.raises(ValueError):
+        r.query(3600, 'device', now=now)
+
+
+def test_window_excludes_older_minutes(tmp_path):
+    r = make(tmp_path)
+    now = int(time.time())
+    r.record(now - 600, 'wrong', '1.1.1.1')
+    r.record(now, 'wrong', '2.2.2.2')
+    r.flush()
+    assert r.query(60, 'ip', now=now)['total'] == 1
+    assert r.query(3600, 'ip', now=now)['total'] == 2
+
+
+def test_workers_merge_into_shared_minutes(tmp_path):
+    a, b = make(tmp_path), make(tmp_path)
+    now = int(time.time())
+    a.record(now, 'wrong', '1.1.1.1')
+    assert a.query(3600, 'ip', now=now)['total'] == 1
+    b.record(now, 'wrong', '1.1.1.1')
+    # a query flushes the asking worker's own counts first
+    assert b.query(3600, 'ip', now=now)['total'] == 2
+    # the cached bucket is re-read once the file changes
+    assert a.query(3600, 'ip', now=now)['top'] == [{'value': '1.1.1.1', 'count': 2}]
+
+
+def test_values_past_max_entries_go_to_other(tmp_path):
+    r = make(tmp_path, max_entries=2)
+    now = int(time.time())
+    r.record_many([(now, 'wrong', '1.1.1.1', None, 'K%d' % i) for i in range(10)])
+    r.record_many([(now, 'wrong', '1.1.1.1', None, 'K0') for _ in range(5)])
+    r.flush()
+    res = r.query(3600, 'key', now=now)
+    assert res['top'][0] == {'value': 'K0', 'count': 6}
+    assert len(res['top']) == 2
+    assert res['other'] == 8
+    with open(os.path.join(r.dir, '%d.json' % (now // 60))) as f:
+        assert len(json.load(f)['key']['wrong']) == 3
+
+
+def test_old_minutes_expire(tmp_path):
+    r = make(tmp_path, retention=10)
+    old = os.path.join(r.dir, '%d.json' % (int(time.time()) // 60 - 60))
+    with open(old, 'w') as f:
+        json.dump({'results': {}, 'ip': {}, 'asn': {}, 'key': {}}, f)
+    r.flush()
+    assert not os.path.exists(old)
+
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('ROLLUPS', '0')
+    assert rollups_mod.from_env(str(tmp_path)) is None
+    monkeypatch.setenv('ROLLUPS', '1')
+    monkeypatch.setenv('ROLLUP_RETENTION', '60')
+    r = rollups_mod.from_env(str(tmp_path))
+    assert r.dir == str(tmp_path / 'rollups') and r.retention == 60
@@ -0,0 +1,70 @@
+import json
+import asyncio
+import threading
+
+ADMIN = [('x-admin-token', 'secret')]
+
+
+def call(app, method, path, body=b'', headers=(), query=b''):
+    """(status, parsed json) for one request through the ASGI app"""
+    msgs = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return msgs.pop(0) if msgs else {'type': 'http.disconnect'}
+
+    async def send(msg):
+        sent.append(msg)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+             'headers': [(k.encode(), v.encode()) for k, v in headers], 'client': ('127.0.0.1', 40000)}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]['status'], json.loads(b''.join(m.get('body', b'') for m in sent[1:]))
+
+
+def json_body(obj):
+    return json.dumps(obj).encode(), [('content-type', 'application/json')]
+
+
+def test_check_and_heartbeat_match_the_sync_server(load_server):
+    sa = load_server('server_async')
+    body, hdrs = json_body({'key': 'LIC-1'})
+    assert call(sa.app, 'POST', '/admin/add', body, hdrs + ADMIN) == (200, {'result': 'added'})
+    assert call(sa.app, 'GET', '/check', query=b'key=LIC-1')[1] == {'result': 'success'}
+    assert call(sa.app, 'GET', '/check', query=b'key=NOPE')[1] == {'result': 'wrong'}
+    body, hdrs = json_body({'key': 'LIC-1', 'device_name': 'pc'})
+    assert call(sa.app, 'POST', '/heartbeat', body, hdrs) == (200, {'result': 'ok'})
+    assert sa.server.conn_store.get('LIC-1')['device'] == 'pc'
+
+
+def test_public_bodies_are_capped_but_admin_bulk_is_not(load_server):
+    sa = load_server('server_async', ASYNC_MAX_BODY=64)
+    keys = ''.join('BULK-KEY-%04d\n' % i for i in range(50)).encode()
+    hdrs = [('content-type', 'text/plain')]
+    assert call(sa.app, 'POST', '/check', b'x' * 100)[0] == 413
+    assert call(sa.app, 'POST', '/admin/add-bulk', keys, hdrs)[0] == 413
+    status, res = call(sa.app, 'POST', '/admin/add-bulk', keys, hdrs + ADMIN)
+    assert status == 200 and res['added'] == 50
+
+
+def test_blocking_work_stays_off_the_event_loop(load_server, monkeypatch):
+    sa = load_server('server_async')
+    threads = {}
+    for name in ('rate_wait', 'prefilter_miss'):
+        orig = getattr(sa.server, name)
+
+        def spy(*args, _orig=orig, _name=name):
+            threads[_name] = threading.current_thread().name
+            return _orig(*args)
+        monkeypatch.setattr(sa.server, name, spy)
+    orig_update = sa.server.conn_store.update
+
+    def update(*args, **kw):
+        threads['update'] = threading.current_thread().name
+        return orig_update(*args, **kw)
+    monkeypatch.setattr(sa.server.conn_store, 'update', update)
+    call(sa.app, 'GET', '/check', query=b'key=K')
+    body, hdrs = json_body({'key': 'K'})
+    call(sa.app, 'POST', '/heartbeat', body, hdrs)
+    assert set(threads) == {'rate_wait', 'prefilter_miss', 'update'}
+    assert all(t.startswith('license-io') for t in threads.values()), threads
@@ -0,0 +1,39 @@
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def test_check_batch_answers_each_item(load_server):
+    server = load_server()
+    c = server.app.test_client()
+    assert c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN).get_json() == {'result': 'added'}
+    res = c.post('/check/batch', json=[{'key': 'LIC-1', 'device_name': 'pc'}, {'key': 'NOPE'}, {}, 'junk'])
+    assert res.status_code == 200
+    assert [r['result'] for r in res.get_json()['results']] == ['success', 'wrong', 'error', 'error']
+    assert server.conn_store.get('LIC-1')['device'] == 'pc'
+
+
+def test_check_batch_accepts_items_object_and_enforces_max(load_server):
+    server = load_server(BATCH_MAX=2)
+    c = server.app.test_client()
+    assert c.post('/check/batch', json={'items': [{'key': 'A'}]}).status_code == 200
+    res = c.post('/check/batch', json=[{'key': 'A'}] * 3)
+    assert res.status_code == 413 and res.get_json()['max'] == 2
+    assert c.post('/check/batch', data='[]').status_code == 400  # not json
+
+
+def test_check_batch_reports_banned_devices(load_server):
+    server = load_server()
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    c.post('/admin/ban', json={'type': 'device', 'value': 'bad-pc'}, headers=ADMIN)
+    res = c.post('/check/batch', json=[{'key': 'LIC-1', 'device_name': 'bad-pc'},
+                                       {'key': 'LIC-1', 'device_name': 'pc'}]).get_json()
+    assert [r['result'] for r in res['results']] == ['banned', 'success']
+
+
+def test_heartbeat_batch_updates_every_key(load_server):
+    server = load_server()
+    c = server.app.test_client()
+    res = c.post('/heartbeat/batch', json=[{'key': 'A', 'device_name': 'a'}, {'key': 'B'}, {'nokey': 1}])
+    assert [r['result'] for r in res.get_json()['results']] == ['ok', 'ok', 'error']
+    assert server.conn_store.get('A')['device'] == 'a'
+    assert server.conn_store.get('B') is not None
@@ -0,0 +1,34 @@
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def test_spoofed_forwarded_for_does_not_dodge_ip_bans(load_server):
+    server = load_server(TRUSTED_PROXIES='')
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    c.post('/admin/ban', json={'type': 'ip', 'value': '127.0.0.1'}, headers=ADMIN)
+    res = c.get('/check?key=LIC-1', headers={'X-Forwarded-For': '8.8.8.8'})
+    assert res.get_json() == {'result': 'banned'}
+
+
+def test_rate_limit_buckets_use_the_proxied_client(load_server):
+    server = load_server(RATE_LIMIT=1, RATE_IP=1, RATE_IP_BURST=1, RATE_KEY=0)
+    c = server.app.test_client()
+    # behind the loopback proxy: the appended hop is the client, spoofed hops are not
+    first = c.get('/check?key=K', headers={'X-Forwarded-For': '1.1.1.1, 198.51.100.7'})
+    assert first.status_code == 200
+    again = c.get('/check?key=K', headers={'X-Forwarded-For': '2.2.2.2, 198.51.100.7'})
+    assert again.status_code == 429 and again.headers['Retry-After']
+    other = c.get('/check?key=K', headers={'X-Forwarded-For': '198.51.100.8'})
+    assert other.status_code == 200
+    assert server.rate_limiter.buckets.counters()['passed'] == 2
+
+
+def test_extended_server_bans_the_proxied_client(load_server):
+    ext = load_server('server_extended')
+    c = ext.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    c.post('/admin/ban', json={'type': 'ip', 'value': '198.51.100.7'}, headers=ADMIN)
+    res = c.get('/check?key=LIC-1', headers={'X-Forwarded-For': '1.1.1.1, 198.51.100.7'})
+    assert res.get_json() == {'result': 'banned'}
+    res = c.get('/check?key=LIC-1', headers={'X-Forwarded-For': '198.51.100.7, 198.51.100.8'})
+    assert res.get_json() == {'result': 'success'}
@@ -0,0 +1,19 @@
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def test_unban_of_unknown_ban_is_not_found_and_silent(load_server):
+    ext = load_server('server_extended', EVENTS=1)
+    c = ext.app.test_client()
+    sub = ext.events.subscribe()
+    res = c.post('/admin/unban', json={'type': 'ip', 'value': '203.0.113.1'}, headers=ADMIN)
+    assert res.get_json() == {'result': 'not_found'}
+    ext.events.poll()
+    assert sub.queue.empty()
+    c.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.1'}, headers=ADMIN)
+    res = c.post('/admin/unban', json={'type': 'ip', 'value': '203.0.113.1'}, headers=ADMIN)
+    assert res.get_json() == {'result': 'removed'}
+    ext.events.poll()
+    kinds = []
+    while not sub.queue.empty():
+        kinds.append(sub.queue.get_nowait()[1]['type'])
+    assert kinds == ['ban', 'unban']
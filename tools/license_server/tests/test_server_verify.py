@@ -0,0 +1,53 @@
+ADMIN = {'X-Admin-Token': 'secret'}
+
+
+def _token(c, key='LIC-1', device='pc'):
+    res = c.post('/check', json={'key': key, 'device_name': device, 'token': True}).get_json()
+    assert res['result'] == 'success'
+    return res['token']
+
+
+def _verify(c, token, key='LIC-1', device='pc', ip='198.51.100.7'):
+    return c.post('/verify', json={'token': token, 'key': key, 'device_name': device},
+                  headers={'X-Forwarded-For': ip}).get_json()['result']
+
+
+def test_token_stays_valid_across_unrelated_bans(load_server):
+    server = load_server(TOKEN_SECRET='tok')
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    token = _token(c)
+    assert _verify(c, token) == 'valid'
+    c.post('/admin/ban', json={'type': 'ip', 'value': '203.0.113.9'}, headers=ADMIN)
+    c.post('/admin/ban', json={'type': 'device', 'value': 'other-pc'}, headers=ADMIN)
+    assert _verify(c, token) == 'valid'
+
+
+def test_token_is_stale_when_its_client_is_banned(load_server):
+    server = load_server(TOKEN_SECRET='tok')
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    token = _token(c)
+    c.post('/admin/ban', json={'type': 'ip', 'value': '198.51.100.0/24'}, headers=ADMIN)
+    assert _verify(c, token) == 'stale'
+    assert _verify(c, token, ip='192.0.2.1') == 'valid'
+    c.post('/admin/ban', json={'type': 'device', 'value': 'pc'}, headers=ADMIN)
+    assert _verify(c, token, ip='192.0.2.1') == 'stale'
+
+
+def test_token_is_invalid_after_key_removal(load_server):
+    server = load_server(TOKEN_SECRET='tok')
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    token = _token(c)
+    c.post('/admin/remove', json={'key': 'LIC-1'}, headers=ADMIN)
+    assert _verify(c, token) == 'invalid'
+
+
+def test_verify_requires_the_key(load_server):
+    server = load_server(TOKEN_SECRET='tok')
+    c = server.app.test_client()
+    c.post('/admin/add', json={'key': 'LIC-1'}, headers=ADMIN)
+    token = _token(c)
+    assert c.post('/verify', json={'token': token}).status_code == 400
+    assert _verify(c, token, key='LIC-2') == 'invalid'
@@ -0,0 +1,57 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from snapshot import Generations, SnapshotStamp, publish
+
+
+def test_generations_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'generations.bin')
+    a, b = Generations(path), Generations(path)
+    assert a.get('keys') == 0
+    assert a.bump('keys') == 1
+    assert b.get('keys') == 1 and b.get('bans') == 0
+    assert b.stats() == {'keys': 1, 'bans': 0}
+
+
+def _bump_many(path, n):
+    g = Generations(path)
+    for _ in range(n):
+        g.bump('bans')
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_bumps_from_several_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / 'generations.bin')
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=_bump_many, args=(path, 200)) for _ in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert Generations(path).get('bans') == 600
+
+
+def test_publish_bumps_and_stamp_follows(tmp_path):
+    gens = Generations(str(tmp_path / 'generations.bin'))
+    path = str(tmp_path / 'bans.json')
+    stamp = SnapshotStamp(gens, 'bans', path, recheck=3600)
+    before = stamp()
+    assert publish(path, {'ip': ['1.2.3.4']}, gens, 'bans') == 1
+    with open(path) as f:
+        assert json.load(f) == {'ip': ['1.2.3.4']}
+    assert stamp() != before
+    assert publish(path, {}) == 0  # no generations: file only
+
+
+def test_stamp_notices_outside_edits_on_recheck(tmp_path):
+    gens = Generations(str(tmp_path / 'generations.bin'))
+    path = tmp_path / 'authorized_keys.json'
+    path.write_text('[]')
+    stamp = SnapshotStamp(gens, 'keys', str(path), recheck=3600)
+    first = stamp()
+    path.write_text('["A", "B"]')
+    assert stamp() == first  # not rechecked yet
+    assert stamp(force=True) != first
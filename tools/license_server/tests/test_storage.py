@@ -0,0 +1,179 @@
+import json
+import sqlite3
+
+import storage as storage_mod
+from snapshot import Generations
+from storage import Storage, SqliteConnectionStore, migrate_json
+
+
+def test_keys_and_generation(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    assert s.add_keys(['A', 'B', 'A']) == 2
+    assert s.generation('keys') == 1
+    assert not s.add_key('A')
+    assert s.generation('keys') == 1
+    assert s.existing_keys(['A', 'Z']) == {'A'}
+    assert s.remove_key('A') and not s.remove_key('A')
+    assert s.generation('keys') == 2
+    assert s.list_keys() == ['B']
+
+
+def test_bans(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    assert s.add_ban('ip', '1.2.3.4', 'test') == 1
+    assert s.add_ban('ip', '1.2.3.4') == 0
+    assert s.ban_pairs() == [('ip', '1.2.3.4')]
+    assert s.remove_ban('ip', '1.2.3.4') == 2
+    assert s.remove_ban('ip', '1.2.3.4') == 0
+
+
+def test_connections_newest_wins_and_keep_isp(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    s.upsert_connections({'K': {'ip': 'a', 'isp': 'Isp A', 'last_seen': 10}})
+    s.upsert_connections({'K': {'ip': 'b', 'isp': 'Isp B', 'last_seen': 5}})
+    assert s.connections()['K']['ip'] == 'a'
+    assert s.connections()['K']['isp'] == 'Isp A'
+    assert s.connections(since=11) == {}
+    assert s.count_connections(before=11) == 1
+
+
+def test_connection_store_writes_isp(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    store = SqliteConnectionStore(s, flush_interval=3600)
+    store.update('K', ip='1.1.1.1', asn='AS1', org='Org', isp='Isp', last_seen=100)
+    store.flush()
+    assert Storage(s.path).connections()['K']['isp'] == 'Isp'
+
+
+def test_connection_store_get_is_a_point_lookup(tmp_path, monkeypatch):
+    s = Storage(str(tmp_path / 'l.db'))
+    s.upsert_connections({'K': {'ip': 'a', 'device_info': {'os': 'x'}, 'last_seen': 10}, 'L': {'last_seen': 5}})
+    assert s.connection('K')['device_info'] == {'os': 'x'}
+    assert s.connection('Z') is None
+    store = SqliteConnectionStore(s, flush_interval=3600)
+    monkeypatch.setattr(s, 'connections', None)  # no full table read
+    assert store.get('K')['ip'] == 'a'
+    assert store.get('Z') is None
+
+
+def test_adds_isp_column_to_old_database(tmp_path):
+    path = str(tmp_path / 'old.db')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE connections (key TEXT PRIMARY KEY, ip TEXT, asn TEXT, org TEXT, device TEXT, '
+               'device_info TEXT, last_seen INTEGER NOT NULL)')
+    db.execute("INSERT INTO connections VALUES ('K', 'ip', NULL, NULL, NULL, NULL, 1)")
+    db.commit()
+    db.close()
+    s = Storage(path)
+    assert s.connections()['K']['isp'] is None
+    s.upsert_connections({'K': {'ip': 'ip', 'isp': 'Isp', 'last_seen': 2}})
+    assert s.connections()['K']['isp'] == 'Isp'
+
+
+def write(tmp_path, name, data):
+    with open(tmp_path / name, 'w') as f:
+        if isinstance(data, str):
+            f.write(data)
+        else:
+            json.dump(data, f)
+
+
+def test_migrate_skips_malformed_entries(tmp_path):
+    write(tmp_path, 'authorized_keys.json', ['A', None, 'B'])
+    write(tmp_path, 'bans.json', [{'type': 'ip', 'value': '1.2.3.4'}, None, 'junk'])
+    write(tmp_path, 'connections.json', [
+        {'key': 'A', 'ip': '1.1.1.1', 'isp': 'Isp', 'timestamp': '2024-01-01T00:00:00'}, None, 'x'])
+    write(tmp_path, 'failed_logins.json', [{'key': 'Z', 'ip': '2.2.2.2'}, None, 'oops', 3])
+    write(tmp_path, 'attempts.log', '{"time": 1, "ip": "3.3.3.3", "key": "Q"}\nnull\n"str"\nnot json\n')
+    s = Storage(str(tmp_path / 'l.db'))
+    counts = migrate_json(s, str(tmp_path))
+    assert counts == {'keys': 2, 'bans': 1, 'connections': 1, 'history': 1, 'failed_logins': 1, 'attempts': 1}
+    assert s.connections()['A']['isp'] == 'Isp'
+    assert [a['key'] for a in s.attempts(success=False)] == ['Z']
+
+
+def test_migrate_server_py_layout(tmp_path):
+    write(tmp_path, 'bans.json', {'ips': ['1.2.3.4'], 'asns': ['AS1'], 'devices': []})
+    write(tmp_path, 'connections.json', {'K': {'ip': 'a', 'last_seen': 5}, 'BAD': None})
+    write(tmp_path, 'failed_logins.json', None)
+    s = Storage(str(tmp_path / 'l.db'))
+    counts = migrate_json(s, str(tmp_path))
+    assert counts['bans'] == 2 and counts['connections'] == 1 and counts['failed_logins'] == 0
+    assert list(s.connections()) == ['K']
+
+
+def test_from_env(tmp_path, monkeypatch):
+    monkeypatch.delenv('LICENSE_DB', raising=False)
+    assert storage_mod.from_env() is None
+    monkeypatch.setenv('LICENSE_DB', str(tmp_path / 'l.db'))
+    assert isinstance(storage_mod.from_env(), Storage)
+
+
+def test_attempts_range_pages_with_time_id_cursor(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    # five attempts in the same second must still page exactly
+    s.add_attempts([{'time': 100, 'ip': '1.1.1.%d' % i, 'key': 'K%d' % i} for i in range(5)])
+    s.add_attempts([{'time': 200, 'ip': '2.2.2.2', 'key': 'L'}])
+    seen, cursor = [], None
+    while True:
+        page, cursor = s.attempts_range(since=0, limit=2, cursor=cursor)
+        if not page:
+            break
+        seen += [a['key'] for a in page]
+    assert seen == ['K0', 'K1', 'K2', 'K3', 'K4', 'L']
+    assert cursor is not None  # tailing: stays at the last row
+    page, nxt = s.attempts_range(since=150, until=300, limit=10)
+    assert [a['key'] for a in page] == ['L'] and nxt is None
+
+
+def test_attempts_range_rejects_bad_cursor(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'))
+    try:
+        s.attempts_range(cursor='nope')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('bad cursor accepted')
+
+
+def test_expire_attempts_applies_retention(tmp_path):
+    s = Storage(str(tmp_path / 'l.db'), attempts_retention=3600)
+    s._next_expire = float('inf')  # no background run during the test
+    s.add_attempts([{'time': 1000, 'ip': 'a', 'key': 'old'}, {'time': 5000, 'ip': 'b', 'key': 'new'}])
+    assert s.expire_attempts(now=5000, chunk=1) == 1
+    assert [a['key'] for a in s.attempts_range(since=0)[0]] == ['new']
+    assert Storage(str(tmp_path / 'm.db')).expire_attempts() == 0
+
+
+def test_from_env_sets_attempts_retention(tmp_path, monkeypatch):
+    monkeypatch.setenv('LICENSE_DB', str(tmp_path / 'l.db'))
+    monkeypatch.setenv('ATTEMPTS_RETENTION_DAYS', '2')
+    assert storage_mod.from_env().attempts_retention == 2 * 86400
+
+
+def test_generation_stamp_mirrors_commits(tmp_path):
+    gens = Generations(str(tmp_path / 'generations.bin'))
+    s = Storage(str(tmp_path / 'l.db'), generations=gens)
+    stamp = s.stamp('keys', recheck=3600)
+    before = stamp()
+    s.add_keys(['A'])
+    assert gens.get('keys') == 1
+    assert stamp() != before
+    s.add_keys(['A'])  # nothing new, nothing bumped
+    assert gens.get('keys') == 1
+    s.add_ban('ip', '1.2.3.4')
+    assert gens.get('bans') == 1 and gens.get('keys') == 1
+
+
+def test_generation_stamp_rechecks_database(tmp_path, monkeypatch):
+    s = Storage(str(tmp_path / 'l.db'))
+    stamp = s.stamp('keys', recheck=3600)
+    assert stamp() == (None, 0)
+    # a writer without the mirror: seen once the recheck interval passes
+    Storage(str(tmp_path / 'l.db')).add_keys(['A'])
+    queries = []
+    monkeypatch.setattr(s, 'generation', lambda name: queries.append(name) or 1)
+    assert stamp() == (None, 0)
+    assert queries == []
+    assert stamp(force=True) == (None, 1)
+    assert queries == ['keys']
@@ -0,0 +1,59 @@
+from udp_heartbeat import UdpHeartbeat, make_packet, parse_reply, STATUS_BANNED
+
+ADDR = ('203.0.113.5', 40000)
+
+
+def _listener(keys, stamp, applied):
+    def apply(beats):
+        applied.extend(beats)
+        return {}
+    return UdpHeartbeat('127.0.0.1', 0, lambda: list(keys), apply, stamp=lambda: stamp[0])
+
+
+def test_valid_beat_is_applied_and_replayed_one_is_not():
+    applied = []
+    hb = _listener(['KEY-1'], [1], applied)
+    pkt = make_packet('KEY-1', 'pc', seq=1, t=1000)
+    hb.handle([(pkt, ADDR)], now=1000)
+    assert [b['key'] for b in applied] == ['KEY-1'] and applied[0]['ip'] == ADDR[0]
+    hb.handle([(pkt, ADDR)], now=1001)
+    assert hb.counters['stale'] == 1 and len(applied) == 1
+
+
+def test_forged_and_malformed_packets_are_dropped():
+    hb = _listener(['KEY-1'], [1], [])
+    forged = bytearray(make_packet('KEY-1', 'pc', seq=1, t=1000))
+    forged[-1] ^= 1
+    hb.handle([(bytes(forged), ADDR), (b'short', ADDR)], now=1000)
+    assert hb.counters['bad_mac'] == 1 and hb.counters['malformed'] == 1
+
+
+def test_unknown_ids_do_not_reload_until_the_stamp_moves():
+    keys, stamp, applied = ['KEY-1'], [1], []
+    hb = _listener(keys, stamp, applied)
+    flood = [(make_packet('GUESS-%d' % i, 'pc', seq=1, t=1000), ADDR) for i in range(100)]
+    hb.handle(flood, now=1000)
+    hb.handle(flood, now=1000)
+    assert hb.counters['unknown_key'] == 200
+    assert hb.counters['key_reloads'] == 1
+    keys.append('KEY-2')
+    hb.handle([(make_packet('KEY-2', 'pc', seq=1, t=1000), ADDR)], now=1000)
+    assert not applied  # not visible until the keys stamp changes
+    stamp[0] = 2
+    hb.handle([(make_packet('KEY-2', 'pc', seq=2, t=1000), ADDR)], now=1000)
+    assert [b['key'] for b in applied] == ['KEY-2']
+    assert hb.counters['key_reloads'] == 2
+
+
+def test_reply_round_trip():
+    hb = _listener(['KEY-1'], [1], [])
+    sent = []
+
+    class Sock:
+        def sendto(self, data, addr):
+            sent.append((data, addr))
+    hb.sock = Sock()
+    hb.apply = lambda beats: {'KEY-1': STATUS_BANNED}
+    hb.handle([(make_packet('KEY-1', 'pc', seq=7, t=1000), ADDR)], now=1000)
+    assert parse_reply('KEY-1', sent[0][0]) == (STATUS_BANNED, 7)
+    assert parse_reply('OTHER', sent[0][0]) is None
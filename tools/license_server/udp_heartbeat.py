@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import os
+import hmac
+import time
+import select
+import socket
+import struct
+import hashlib
+import threading
+
+from license_token import key_id, device_hash
+
+# Compact UDP heartbeat, an alternative to POST /heartbeat for game clients.
+#
+# Packet (44 bytes, network byte order):
+#   magic   2s  b'LH'
+#   version B   1
+#   flags   B   0
+#   key_id  8s  key_id(key): first 8 bytes of sha256(key)
+#   device  8s  device_hash(device_name): first 8 bytes of sha256(name)
+#   time    I   client unix time
+#   seq     I   counter, increasing per (time) for the same key/device
+#   mac     16s HMAC-SHA256(key, first 28 bytes), truncated
+#
+# The license key itself is the HMAC secret, so only a holder of the key can
+# keep its session alive. Packets must be within MAX_SKEW seconds of server
+# time and newer than the last accepted (time, seq) for that key and device.
+#
+# Reply (24 bytes): magic, version, status (0 ok, 1 banned), seq, and
+# HMAC-SHA256(key, first 8 bytes) truncated to 16. Unknown or forged packets
+# get no reply.
+
+MAGIC = b'LH'
+VERSION = 1
+PACKET = struct.Struct('!2sBB8s8sII16s')
+SIGNED = PACKET.size - 16
+REPLY = struct.Struct('!2sBBI16s')
+STATUS_OK = 0
+STATUS_BANNED = 1
+MAX_SKEW = 60
+
+
+def _mac(key, data):
+    return hmac.new(key.encode(), data, hashlib.sha256).digest()[:16]
+
+def make_packet(key, device_name, seq, t=None):
+    """Client side: build one heartbeat packet"""
+    head = PACKET.pack(MAGIC, VERSION, 0, key_id(key), device_hash(device_name),
+                       int(t if t is not None else time.time()), seq, b'')[:SIGNED]
+    return head + _mac(key, head)
+
+def parse_reply(key, data):
+    """Client side: (status, seq) from a reply, or None if it doesn't verify"""
+    if len(data) != REPLY.size:
+        return None
+    magic, version, status, seq, mac = REPLY.unpack(data)
+    if magic != MAGIC or not hmac.compare_digest(mac, _mac(key, data[:REPLY.size - 16])):
+        return None
+    return status, seq
+
+
+class UdpHeartbeat:
+    """UDP listener that verifies heartbeats and applies them in batches.
+
+    keys() returns the authorized keys and stamp() something cheap that
+    changes with them; the key table is rebuilt only when the stamp moves
+    (every key_refresh seconds without a stamp), so a flood of unknown key
+    ids costs one dict miss each. apply(beats) receives a list of
+    {'key', 'ip', 'device_hash', 'time'} dicts (one per key, newest wins) and
+    may return {key: status}. Every gunicorn worker can run one: the socket
+    uses SO_REUSEPORT so the kernel spreads packets across them.
+    """
+
+    def __init__(self, host, port, keys, apply, batch_size=256, key_refresh=5.0, stamp=None):
+        self.host = host
+        self.port = port
+        self._keys = keys
+        self.stamp = stamp
+        self._keys_stamp = None
+        self.apply = apply
+        self.batch_size = batch_size
+        self.key_refresh = key_refresh
+        self._by_id = {}
+        self._keys_loaded = None
+        self._last = {}
+        self._next_expire = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.sock = None
+        self.counters = {
+            'packets': 0,
+            'accepted': 0,
+            'malformed': 0,
+            'unknown_key': 0,
+            'bad_mac': 0,
+            'stale': 0,
+            'batches': 0,
+            'apply_failures': 0,
+            'key_reloads': 0,
+        }
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, self.port))
+            sock.setblocking(False)
+            self.sock = sock
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='udp-heartbeat', daemon=True).start()
+
+    def _load_keys(self):
+        now = time.monotonic()
+        if self.stamp is not None:
+            # stamp first: a change during the load triggers another one
+            stamp = self.stamp()
+            if self._keys_loaded is not None and stamp == self._keys_stamp:
+                return
+            self._keys_stamp = stamp
+        elif self._keys_loaded is not None and now - self._keys_loaded < self.key_refresh:
+            return
+        self._by_id = {key_id(k): k for k in self._keys()}
+        self._keys_loaded = now
+        self.counters['key_reloads'] += 1
+
+    def _run(self):
+        while True:
+            select.select([self.sock], [], [])
+            batch = []
+            # drain what is queued, up to batch_size packets per pass
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.sock.recvfrom(128))
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    break
+            if batch:
+                self.handle(batch)
+
+    def handle(self, packets, now=None):
+        """Verify (data, addr) pairs, apply the accepted beats, send replies"""
+        now = int(now or time.time())
+        # added keys start and removed keys stop verifying once the stamp moves
+        self._load_keys()
+        beats = {}
+        for data, addr in packets:
+            self.counters['packets'] += 1
+            if len(data) != PACKET.size:
+                self.counters['malformed'] += 1
+                continue
+            magic, version, _, kid, dev, t, seq, mac = PACKET.unpack(data)
+            if magic != MAGIC or version != VERSION:
+                self.counters['malformed'] += 1
+                continue
+            key = self._by_id.get(kid)
+            if key is None:
+                self.counters['unknown_key'] += 1
+                continue
+            if not hmac.compare_digest(mac, _mac(key, data[:SIGNED])):
+                self.counters['bad_mac'] += 1
+                continue
+            last = self._last.get((kid, dev))
+            if abs(now - t) > MAX_SKEW or (last is not None and (t, seq) <= last):
+                self.counters['stale'] += 1
+                continue
+            self._last[(kid, dev)] = (t, seq)
+            self.counters['accepted'] += 1
+            beats[key] = ({'key': key, 'ip': addr[0], 'device_hash': dev.hex(), 'time': now}, addr, seq)
+        self._expire_seen(now)
+        if not beats:
+            return
+        self.counters['batches'] += 1
+        try:
+            statuses = self.apply([b for b, _, _ in beats.values()]) or {}
+        except Exception:
+            self.counters['apply_failures'] += 1
+            return
+        if self.sock is None:
+            return
+        for key, (_, addr, seq) in beats.items():
+            head = REPLY.pack(MAGIC, VERSION, statuses.get(key, STATUS_OK), seq, b'')[:REPLY.size - 16]
+            try:
+                self.sock.sendto(head + _mac(key, head), addr)
+            except OSError:
+                pass
+
+    def _expire_seen(self, now):
+        # replay state only matters inside the skew window
+        if now >= self._next_expire:
+            cutoff = now - MAX_SKEW
+            self._last = {k: v for k, v in self._last.items() if v[0] >= cutoff}
+            self._next_expire = now + MAX_SKEW
+
+    def stats(self):
+        return dict(self.counters, port=self.port, known_keys=len(self._by_id), tracked=len(self._last))